@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Scoring throughput of the /handle/batch path (normalize + score_texts)
+in messages per second as the batch size grows. Downstream calls are not
+included. Run dataprep.py first and point --model-dir at its output.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+# Models are loaded below, from the benchmark's own model directory
+os.environ.setdefault("BFILTER_EAGER_LOAD", "false")
+import server  # noqa: E402
+from normalize import normalize  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="bfilter batch scoring throughput")
+    parser.add_argument("--model-dir", default=".", help="Directory holding scorer.bin or model.pkl/cv.pkl")
+    parser.add_argument("--data", default=os.path.join(SRC_DIR, "..", "data", "jailbreaks.csv"))
+    parser.add_argument("--batch-sizes", default="1,4,16,64,256")
+    parser.add_argument("--messages", type=int, default=4096, help="Messages scored per batch size")
+    parser.add_argument("--sklearn", action="store_true", help="Score with the sklearn sparse path instead of scorer.bin")
+    args = parser.parse_args()
+
+    data = os.path.abspath(args.data)
+    os.chdir(args.model_dir)
+    if args.sklearn:
+        server.clf = joblib.load("model.pkl")
+        server.cv = joblib.load("cv.pkl")
+        server.feature_log_prob_t = np.ascontiguousarray(server.clf.feature_log_prob_.T)
+        server.serving = server.ServingModel(None, "sklearn", server.BFILTER_PASS_THRESHOLD, server.BFILTER_THRESHOLD, None)
+    else:
+        server.load_models()
+
+    corpus = pd.read_csv(data)["text"].astype(str).tolist()
+    messages = (corpus * (args.messages // len(corpus) + 1))[:args.messages]
+
+    print(f"{'batch':>6} {'msgs/s':>12} {'us/msg':>10}")
+    for batch_size in (int(b) for b in args.batch_sizes.split(",")):
+        start = time.perf_counter()
+        for offset in range(0, len(messages), batch_size):
+            batch = messages[offset:offset + batch_size]
+            server.score_texts([normalize(text) for text in batch], server.serving)
+        elapsed = time.perf_counter() - start
+        print(f"{batch_size:>6} {len(messages) / elapsed:>12.0f} {elapsed / len(messages) * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
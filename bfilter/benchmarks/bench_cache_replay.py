@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Replays a message trace through the old prediction_cache eviction policy
+(drop the first 300 keys once past 500 entries) and through LRUCache with
+the same budget, and reports hit rates. Without --replay a Zipf-distributed
+trace is drawn from jailbreaks.csv.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+from cache import LRUCache, entry_size  # noqa: E402
+
+
+def load_trace(path: str) -> List[str]:
+    """One message per line, or JSONL objects with a "message" field"""
+    messages = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            if line.startswith("{"):
+                line = json.loads(line)["message"]
+            messages.append(line)
+    return messages
+
+
+def synthetic_trace(data: str, length: int, zipf_a: float, seed: int) -> List[str]:
+    corpus = pd.read_csv(data)["text"].astype(str).tolist()
+    rng = np.random.default_rng(seed)
+    ranks = rng.zipf(zipf_a, size=length) - 1
+    # Large ranks fall back to uniform picks so the tail is long but bounded
+    picks = np.where(ranks < len(corpus), ranks, rng.integers(0, len(corpus), size=length))
+    return [corpus[i] for i in picks]
+
+
+def replay_legacy(keys: List[str]) -> Dict[str, float]:
+    cache: Dict[str, float] = {}
+    hits = 0
+    for key in keys:
+        if key in cache:
+            hits += 1
+            continue
+        if len(cache) > 500:
+            for old in list(cache.keys())[:300]:
+                del cache[old]
+        cache[key] = 0.5
+    return {"hit_rate": hits / len(keys)}
+
+
+def replay_lru(keys: List[str], max_entries: int, max_bytes: int) -> Dict[str, float]:
+    cache = LRUCache(max_entries=max_entries, max_bytes=max_bytes)
+    for key in keys:
+        if cache.get(key) is None:
+            cache.set(key, 0.5)
+    return cache.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prediction cache replay benchmark")
+    parser.add_argument("--replay", help="Trace file, one message per line or JSONL with a message field")
+    parser.add_argument("--data", default=os.path.join(SRC_DIR, "..", "data", "jailbreaks.csv"))
+    parser.add_argument("--length", type=int, default=200000, help="Synthetic trace length")
+    parser.add_argument("--zipf", type=float, default=1.2, help="Synthetic trace Zipf exponent")
+    parser.add_argument("--seed", type=int, default=5525)
+    args = parser.parse_args()
+
+    messages = load_trace(args.replay) if args.replay else synthetic_trace(args.data, args.length, args.zipf, args.seed)
+    keys = [hashlib.md5(m.encode()).hexdigest() for m in messages]
+    # The legacy dict holds at most 501 entries; give the LRU the same bytes
+    budget_entries = 501
+    budget_bytes = budget_entries * entry_size(keys[0], 0.5)
+
+    print(f"trace length: {len(keys)}  distinct: {len(set(keys))}  budget: {budget_entries} entries / {budget_bytes} bytes")
+    print(f"legacy dict   hit rate: {replay_legacy(keys)['hit_rate']:.4f}")
+    stats = replay_lru(keys, budget_entries, budget_bytes)
+    print(f"LRUCache      hit rate: {stats['hit_rate']:.4f}  evictions: {stats['evictions']}")
+
+
+if __name__ == "__main__":
+    main()
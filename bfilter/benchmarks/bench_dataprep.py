@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Wall time and peak memory of dataprep.py on synthetic corpora of growing
+size (10k, 100k and 1M rows by default). Rows are drawn from
+bfilter/data/jailbreaks.csv with their words shuffled, keeping the
+class balance, and written to a temporary CSV in chunks. dataprep.py runs
+in a fresh process per size. Peak RSS is that process's (and its pool
+workers') maximum resident set, as reported by wait4.
+"""
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+
+def write_corpus(source: pd.DataFrame, rows: int, path: str, chunk_size: int = 100000) -> None:
+    rng = random.Random(0)
+    texts = source["text"].astype(str).tolist()
+    classes = source["class"].tolist()
+    with open(path, "w", newline="") as f:
+        f.write("class,text\n")
+        for start in range(0, rows, chunk_size):
+            sampled = [rng.randrange(len(texts)) for _ in range(min(chunk_size, rows - start))]
+            shuffled = []
+            for i in sampled:
+                words = texts[i].split(" ")
+                rng.shuffle(words)
+                shuffled.append(" ".join(words))
+            pd.DataFrame({"class": [classes[i] for i in sampled], "text": shuffled}).to_csv(
+                f, header=False, index=False)
+
+
+def run_dataprep(corpus: str, output_dir: str, chunk_size: int, workers: int):
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(SRC_DIR, "dataprep.py"), "--data", corpus, "--output-dir", output_dir,
+         "--chunk-size", str(chunk_size), "--workers", str(workers)],
+        stdout=subprocess.DEVNULL, cwd=SRC_DIR)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise RuntimeError(f"dataprep.py failed on {corpus}")
+    # ru_maxrss is in kilobytes on Linux
+    return elapsed, usage.ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="dataprep.py scaling benchmark")
+    parser.add_argument("--data", default=os.path.join(SRC_DIR, "..", "data", "jailbreaks.csv"))
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    source = pd.read_csv(args.data)
+    print(f"{'rows':>9} {'seconds':>9} {'rows/s':>9} {'peak_rss_mb':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in (int(size) for size in args.sizes.split(",")):
+            corpus = os.path.join(tmp, f"corpus-{rows}.csv")
+            write_corpus(source, rows, corpus)
+            elapsed, peak_mb = run_dataprep(corpus, os.path.join(tmp, f"out-{rows}"), args.chunk_size, args.workers)
+            print(f"{rows:>9} {elapsed:>9.1f} {rows / elapsed:>9.0f} {peak_mb:>12.0f}")
+            os.remove(corpus)
+
+
+if __name__ == "__main__":
+    main()
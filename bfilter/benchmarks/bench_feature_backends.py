@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+The vocabulary model against hashed models at several feature space sizes
+2^k, each trained by dataprep.py on a stratified --train-fraction of
+--data and evaluated on the rest:
+
+- vocabulary:  CountVectorizer + MultinomialNB, the default scorer.bin
+- nb-k:        HashingVectorizer + MultinomialNB (unsigned, --ngram-max)
+- linear-k:    HashingVectorizer + SGD logistic regression, signed hashing
+
+For each it reports the scorer.bin size, and from a fresh process the load
+time and anonymous memory gained (what each gunicorn worker holds
+privately) and its peak RSS after scoring, then the per-message scoring
+latency and the held-out ROC AUC.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+from normalize import normalize  # noqa: E402
+
+
+def anonymous_mb() -> float:
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Anonymous:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def roc_auc(labels: np.ndarray, scores: np.ndarray) -> float:
+    """Mann-Whitney U over average ranks, so ties count half"""
+    ranks = pd.Series(scores).rank().to_numpy()
+    positives = int(labels.sum())
+    negatives = len(labels) - positives
+    return float((ranks[labels].sum() - positives * (positives + 1) / 2) / (positives * negatives))
+
+
+def measure(model_dir: str, test_path: str, runs: int) -> dict:
+    """Runs in the child process"""
+    from lookup_scorer import SCORER_FILE, load_scorer
+
+    test = pd.read_csv(test_path)
+    texts = [normalize(text) for text in test["text"].astype(str)]
+    labels = (test["class"] == "spam").to_numpy()
+
+    before = anonymous_mb()
+    start = time.perf_counter()
+    scorer = load_scorer(os.path.join(model_dir, SCORER_FILE))
+    loaded = time.perf_counter()
+    anon = anonymous_mb() - before
+    best = float("inf")
+    for _ in range(runs):
+        start_score = time.perf_counter()
+        for text in texts:
+            scorer.score(text)
+        best = min(best, time.perf_counter() - start_score)
+    scores = scorer.score_batch(texts)
+    return {"load_ms": (loaded - start) * 1000, "anon_mb": anon, "rss_mb": rss_mb(),
+            "message_us": best / len(texts) * 1e6, "auc": roc_auc(labels, scores)}
+
+
+def split(data: str, train_fraction: float, tmp: str) -> List[str]:
+    corpus = pd.read_csv(data, usecols=["class", "text"])
+    rng = np.random.default_rng(0)
+    train = np.zeros(len(corpus), dtype=bool)
+    for label in corpus["class"].unique():
+        rows = np.flatnonzero(corpus["class"].to_numpy() == label)
+        train[rng.permutation(rows)[:int(len(rows) * train_fraction)]] = True
+    paths = [os.path.join(tmp, "train.csv"), os.path.join(tmp, "test.csv")]
+    corpus[train].to_csv(paths[0], index=False)
+    corpus[~train].to_csv(paths[1], index=False)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="vocabulary vs hashed feature backend benchmark")
+    parser.add_argument("--data", default=os.path.join(SRC_DIR, "..", "data", "jailbreaks.csv"))
+    parser.add_argument("--train-fraction", type=float, default=0.8)
+    parser.add_argument("--hash-bits", default="16,18,20,22", help="Feature space sizes 2^k to try")
+    parser.add_argument("--ngram-max", type=int, default=2, help="Word n-grams of the hashed models")
+    parser.add_argument("--runs", type=int, default=3, help="Best of this many scoring passes is reported")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--test", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child, args.test, args.runs)))
+        return
+
+    variants = [("vocabulary", ["--features", "vocabulary"])]
+    for bits in (int(b) for b in args.hash_bits.split(",")):
+        hashed = ["--features", "hashed", "--hash-bits", str(bits), "--ngram-max", str(args.ngram_max)]
+        variants.append((f"nb-{bits}", hashed + ["--model", "nb"]))
+        variants.append((f"linear-{bits}", hashed + ["--model", "linear", "--signed"]))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        train_path, test_path = split(args.data, args.train_fraction, tmp)
+        print(f"{'model':>12} {'scorer_kb':>10} {'load_ms':>8} {'anon_mb':>8} {'rss_mb':>7} "
+              f"{'message_us':>11} {'auc':>7}")
+        for name, options in variants:
+            model_dir = os.path.join(tmp, name)
+            subprocess.run([sys.executable, os.path.join(SRC_DIR, "dataprep.py"), "--data", train_path,
+                            "--output-dir", model_dir, *options], check=True, capture_output=True)
+            output = subprocess.run([sys.executable, __file__, "--child", model_dir, "--test", test_path,
+                                     "--runs", str(args.runs)], check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            size_kb = os.path.getsize(os.path.join(model_dir, "scorer.bin")) / 1024
+            print(f"{name:>12} {size_kb:>10.0f} {result['load_ms']:>8.2f} {result['anon_mb']:>8.1f} "
+                  f"{result['rss_mb']:>7.1f} {result['message_us']:>11.1f} {result['auc']:>7.4f}")
+
+
+if __name__ == "__main__":
+    main()
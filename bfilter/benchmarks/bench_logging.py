@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+CPU cost of a log call on the request path, old against new:
+
+- sync:     the previous bfilter StructuredLogger, a dict, a utcnow()
+            isoformat, json.dumps and a logging.StreamHandler write per call
+- async:    structured_logging.StructuredLogger, every record kept
+- sampled:  the same with the event sampled at 1%
+- disabled: a DEBUG record under the default INFO level
+
+--threads request threads each log --records "Request duration" records.
+stdout is a pipe drained by another process, as it is under Cloud Run, so
+writes cost what they do in production. Reported per record: CPU time of the
+calling threads (what a request pays), CPU time of the whole process (the
+writer thread included) and wall time.
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+import structured_logging  # noqa: E402
+
+
+class SyncStructuredLogger:
+    """bfilter's logger before structured_logging.py"""
+    def __init__(self, name: str):
+        self.logger = logging.getLogger(name)
+        self.service_name = name
+
+    def _log(self, level: str, message: str, **kwargs) -> None:
+        log_entry = {
+            "timestamp": datetime.utcnow().isoformat(),
+            "level": level,
+            "service": self.service_name,
+            "message": message,
+            **kwargs
+        }
+        self.logger.info(json.dumps(log_entry))
+
+    def info(self, message: str, **kwargs) -> None:
+        self._log("INFO", message, **kwargs)
+
+
+def run(log, threads: int, records: int, debug: bool = False):
+    caller_cpu = [0.0] * threads
+
+    def worker(index: int) -> None:
+        emit = log.debug if debug else log.info
+        start = time.thread_time()
+        for i in range(records):
+            emit("Request duration", duration=0.0123, status=200, path="/", request=i)
+        caller_cpu[index] = time.thread_time() - start
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    wall = time.perf_counter()
+    process = time.process_time()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    if isinstance(log, structured_logging.StructuredLogger):
+        log.writer.flush(timeout=60)
+    total = threads * records
+    return (sum(caller_cpu) / total * 1e6, (time.process_time() - process) / total * 1e6,
+            (time.perf_counter() - wall) / total * 1e6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="structured logging overhead benchmark")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--records", type=int, default=20000)
+    args = parser.parse_args()
+
+    # Point fd 1 at a pipe into a separate reader, keep the terminal for the results
+    results_out = os.fdopen(os.dup(1), "w")
+    reader = subprocess.Popen(["cat"], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+    os.dup2(reader.stdin.fileno(), 1)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s", handlers=[logging.StreamHandler(sys.stdout)])
+    # Room for every record, so nothing is measured as cheaper for having been dropped
+    writer = structured_logging.LogWriter(max_queue=args.threads * args.records)
+    cases = [
+        ("sync", SyncStructuredLogger("bench"), False),
+        ("async", structured_logging.StructuredLogger("bench", "INFO", log_writer=writer), False),
+        ("sampled", structured_logging.StructuredLogger("bench", "INFO", {"Request duration": 0.01}, writer), False),
+        ("disabled", structured_logging.StructuredLogger("bench", "INFO", log_writer=writer), True),
+    ]
+    print(f"{'logger':>9} {'caller_us':>10} {'process_us':>11} {'wall_us':>8}", file=results_out)
+    for name, log, debug in cases:
+        caller, process, wall = run(log, args.threads, args.records, debug)
+        print(f"{name:>9} {caller:>10.2f} {process:>11.2f} {wall:>8.2f}", file=results_out)
+        results_out.flush()
+
+    sys.stdout.flush()
+    os.close(1)
+    reader.stdin.close()
+    reader.wait()
+
+
+if __name__ == "__main__":
+    main()
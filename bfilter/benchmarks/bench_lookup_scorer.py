@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Per-message latency of the compiled lookup scorer against the sklearn
+transform/predict_proba stack, plus the largest probability difference.
+Run dataprep.py first and point --model-dir at its output directory.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List
+
+import joblib
+import numpy as np
+import pandas as pd
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+from lookup_scorer import LookupScorer, SCORER_FILE  # noqa: E402
+
+
+def timed(fn: Callable[[str], float], messages: List[str]) -> Dict[str, float]:
+    for message in messages[:50]:
+        fn(message)
+    latencies = []
+    for message in messages:
+        start = time.perf_counter()
+        fn(message)
+        latencies.append((time.perf_counter() - start) * 1e6)
+    latencies.sort()
+    return {"mean_us": statistics.mean(latencies), "p99_us": latencies[int(len(latencies) * 0.99) - 1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lookup scorer vs sklearn benchmark")
+    parser.add_argument("--model-dir", default=".", help="Directory holding model.pkl, cv.pkl and scorer.bin")
+    parser.add_argument("--data", default=os.path.join(SRC_DIR, "..", "data", "jailbreaks.csv"))
+    parser.add_argument("--messages", type=int, default=2000)
+    args = parser.parse_args()
+
+    clf = joblib.load(os.path.join(args.model_dir, "model.pkl"))
+    cv = joblib.load(os.path.join(args.model_dir, "cv.pkl"))
+    scorer_path = os.path.join(args.model_dir, SCORER_FILE)
+    scorer = LookupScorer.load(scorer_path) if os.path.exists(scorer_path) else LookupScorer.from_model(cv, clf)
+
+    messages = pd.read_csv(args.data)["text"].astype(str).str.lower().tolist()[:args.messages]
+
+    sklearn_scores = clf.predict_proba(cv.transform(messages))[:, 1]
+    lookup_scores = np.array([scorer.score(m) for m in messages])
+    print(f"messages: {len(messages)}  vocabulary: {len(scorer.hashes)}")
+    print(f"max |lookup - predict_proba|: {np.abs(sklearn_scores - lookup_scores).max():.3e}")
+
+    paths = {
+        "sklearn": lambda m: clf.predict_proba(cv.transform([m]))[0][1],
+        "lookup": scorer.score,
+    }
+    for name, fn in paths.items():
+        result = timed(fn, messages)
+        print(f"{name:>8}: mean {result['mean_us']:8.1f} us  p99 {result['p99_us']:8.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Throughput of text normalization in messages per second, on
+bfilter/data/jailbreaks.csv with each message repeated --repeat times to
+look at longer inputs:
+
+- legacy-train: dataprep's process_text before normalize.py (remove while
+                iterating, then the reversed text appended)
+- legacy-serve: server.py's process_text, with the lower() and replace()
+                its callers did
+- normalize:    normalize.normalize per message
+- findall, joined-lower: the alternatives normalize.py was measured
+                against, a regex over each message and a single lower()
+                over the joined batch
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+from typing import Callable, List
+
+import pandas as pd
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+from normalize import normalize  # noqa: E402
+
+_WORDS = re.compile(r"[^ ]{2,}")
+
+
+def legacy_train(text: str) -> str:
+    words = text.lower().split(" ")
+    for word in words:
+        if len(word) == 1:
+            words.remove(word)
+    text = " ".join(words)
+    return text + text[::-1]
+
+
+def legacy_serve(text: str) -> str:
+    text = text.lower().replace("aeiou0123456789", "")
+    return " ".join([word for word in text.split(" ") if len(word) > 1])
+
+
+def findall(texts: List[str]) -> List[str]:
+    return [" ".join(_WORDS.findall(text.strip().lower())) for text in texts]
+
+
+def joined_lower(texts: List[str]) -> List[str]:
+    # Only valid when no message contains the separator, which the corpus doesn't
+    lowered = "\x00".join(texts).lower().split("\x00")
+    return [" ".join([word for word in text.strip().split(" ") if len(word) > 1]) for text in lowered]
+
+
+def per_message(normalizer: Callable[[str], str]) -> Callable[[List[str]], List[str]]:
+    return lambda texts: [normalizer(text) for text in texts]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="text normalization throughput")
+    parser.add_argument("--data", default=os.path.join(SRC_DIR, "..", "data", "jailbreaks.csv"))
+    parser.add_argument("--repeat", default="1,20", help="Message lengths to try, as repeats of each message")
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--runs", type=int, default=5, help="Best of this many passes is reported")
+    args = parser.parse_args()
+
+    corpus = pd.read_csv(args.data)["text"].astype(str).tolist()
+    candidates = [("legacy-train", per_message(legacy_train)), ("legacy-serve", per_message(legacy_serve)),
+                  ("normalize", per_message(normalize)), ("findall", findall), ("joined-lower", joined_lower)]
+    print(f"{'repeat':>6} {'avg_chars':>9} {'normalizer':>13} {'msgs/s':>10}")
+    for repeat in (int(r) for r in args.repeat.split(",")):
+        messages = [" ".join([text] * repeat) for text in corpus]
+        messages = (messages * (args.messages // len(messages) + 1))[:args.messages]
+        avg_chars = sum(map(len, messages)) / len(messages)
+        for name, normalizer in candidates:
+            best = float("inf")
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                normalizer(messages)
+                best = min(best, time.perf_counter() - start)
+            print(f"{repeat:>6} {avg_chars:>9.0f} {name:>13} {len(messages) / best:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the bfilter scoring path.
+Compares the old dense path (cv.transform(...).toarray()) against the
+sparse path in server.score_text across several vocabulary sizes.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.naive_bayes import MultinomialNB
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+# Models are loaded below, from the benchmark's own model directory
+os.environ.setdefault("BFILTER_EAGER_LOAD", "false")
+import server  # noqa: E402
+
+
+def build_model(vocab_size: int, docs: int, seed: int):
+    """Fit a CountVectorizer + MultinomialNB over a synthetic corpus with exactly vocab_size terms"""
+    rng = random.Random(seed)
+    vocabulary = [f"tok{i:07d}" for i in range(vocab_size)]
+    corpus = []
+    labels = []
+    # Every term appears at least once so the fitted vocabulary has the requested size
+    for start in range(0, vocab_size, 50):
+        corpus.append(" ".join(vocabulary[start:start + 50]))
+        labels.append(rng.choice(["ham", "spam"]))
+    for _ in range(docs):
+        corpus.append(" ".join(rng.choices(vocabulary, k=40)))
+        labels.append(rng.choice(["ham", "spam"]))
+    cv = CountVectorizer()
+    clf = MultinomialNB()
+    clf.fit(cv.fit_transform(corpus), labels)
+    return cv, clf, vocabulary
+
+
+def measure(fn: Callable[[str], float], messages: List[str]) -> Dict[str, float]:
+    """Return mean/p95 latency and mean peak allocation for fn over messages"""
+    for message in messages[:20]:
+        fn(message)
+    latencies = []
+    peaks = []
+    for message in messages:
+        tracemalloc.start()
+        fn(message)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    for message in messages:
+        start = time.perf_counter()
+        fn(message)
+        latencies.append((time.perf_counter() - start) * 1e6)
+    latencies.sort()
+    return {
+        "mean_us": statistics.mean(latencies),
+        "p95_us": latencies[int(len(latencies) * 0.95) - 1],
+        "peak_kib": statistics.mean(peaks) / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dense vs sparse bfilter scoring benchmark")
+    parser.add_argument("--vocab-sizes", default="1000,10000,50000,200000",
+                        help="Comma separated vocabulary sizes")
+    parser.add_argument("--messages", type=int, default=500, help="Messages scored per vocabulary size")
+    parser.add_argument("--tokens", type=int, default=30, help="Tokens per message")
+    parser.add_argument("--seed", type=int, default=5525)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'vocab':>8} {'path':>6} {'mean_us':>10} {'p95_us':>10} {'peak_KiB':>10}")
+    for vocab_size in (int(v) for v in args.vocab_sizes.split(",")):
+        cv, clf, vocabulary = build_model(vocab_size, docs=2000, seed=args.seed)
+        messages = [" ".join(rng.choices(vocabulary, k=args.tokens)) for _ in range(args.messages)]
+
+        server.cv = cv
+        server.clf = clf
+        server.feature_log_prob_t = np.ascontiguousarray(clf.feature_log_prob_.T)
+        server.serving = server.ServingModel(None, f"bench-{vocab_size}", 0.0, 1.0, None)
+
+        paths = {
+            "dense": lambda m: clf.predict_proba(cv.transform([m]).toarray())[0][1],
+            "sparse": server.score_text,
+        }
+        for name, fn in paths.items():
+            result = measure(fn, messages)
+            print(f"{vocab_size:>8} {name:>6} {result['mean_us']:>10.1f} "
+                  f"{result['p95_us']:>10.1f} {result['peak_kib']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
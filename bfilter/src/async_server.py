@@ -0,0 +1,282 @@
+"""
+ASGI serving mode for bfilter (BFILTER_SERVER_MODE=asgi in the Dockerfile).
+
+/handle and /handle/batch run on the event loop: downstream sfilter and
+llmstub calls go through pooled aiohttp clients, retry backoff is an
+asyncio.sleep instead of time.sleep, and the CPU-bound NB scoring runs on a
+small thread pool. A worker blocked on a slow downstream therefore keeps
+serving other requests instead of pinning a gunicorn worker per request.
+
+Every other route (/, /health, /ready, /metrics) is served by the Flask
+app in server.py through WsgiToAsgi, so both modes share one
+implementation of the models, caches and endpoints.
+"""
+
+import asyncio
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from typing import Any, Dict, List, Tuple, Union
+from urllib.parse import parse_qs
+
+import aiohttp
+from asgiref.wsgi import WsgiToAsgi
+
+import server
+from server import structured_logger
+from service_client import AsyncResponse, AsyncServiceClient
+
+ResponseValue = Union[str, Tuple[Dict[str, Any], int]]
+
+SCORING_THREADS = int(os.getenv("SCORING_THREADS", "2"))
+ASYNC_POOL_SIZE = int(os.getenv("ASYNC_POOL_SIZE", "100"))
+
+scoring_executor = ThreadPoolExecutor(max_workers=SCORING_THREADS, thread_name_prefix="bfilter-score")
+sfilter_client = AsyncServiceClient(server.SFILTER_URL, pool_size=ASYNC_POOL_SIZE)
+llmstub_client = AsyncServiceClient(server.LLMSTUB_URL, pool_size=ASYNC_POOL_SIZE)
+flask_app = WsgiToAsgi(server.app)
+
+
+# --- Retry Logic with non-blocking Exponential Backoff ---
+def async_retry_with_backoff(max_retries: int = 3, base_delay: float = 1.0, max_delay: float = 60.0):
+    """asyncio counterpart of server.retry_with_backoff. 4xx answers are verdicts, not failures, and aren't retried."""
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            for attempt in range(max_retries + 1):
+                try:
+                    return await func(*args, **kwargs)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    if isinstance(e, aiohttp.ClientResponseError) and e.status < 500:
+                        raise e
+                    if attempt == max_retries:
+                        structured_logger.error(
+                            "Max retry attempts reached",
+                            function=func.__name__,
+                            attempts=attempt + 1,
+                            error=str(e)
+                        )
+                        raise e
+                    delay = min(base_delay * (2 ** attempt) + random.uniform(0, 1), max_delay)
+                    structured_logger.warning(
+                        "Request failed, retrying",
+                        function=func.__name__,
+                        attempt=attempt + 1,
+                        delay=delay,
+                        error=str(e)
+                    )
+                    await asyncio.sleep(delay)
+            return None
+        return wrapper
+    return decorator
+
+
+@async_retry_with_backoff(max_retries=3, base_delay=1.0)
+async def make_authenticated_post_request(client: AsyncServiceClient, path: str = "",
+                                          data: Dict[str, str] = None,
+                                          json_payload: Dict[str, Any] = None) -> AsyncResponse:
+    return await client.post(path, data=data, json_payload=json_payload)
+
+async def call_sfilter_with_breaker(data: Dict[str, str]) -> AsyncResponse:
+    start = time.perf_counter()
+    try:
+        return await server.sfilter_breaker.call_async(make_authenticated_post_request, sfilter_client, data=data)
+    finally:
+        server.SFILTER_LATENCY.observe(time.perf_counter() - start)
+
+async def call_sfilter_batch_with_breaker(messages: List[str]) -> AsyncResponse:
+    start = time.perf_counter()
+    try:
+        return await server.sfilter_breaker.call_async(make_authenticated_post_request, sfilter_client, "/batch",
+                                                       json_payload={"messages": messages})
+    finally:
+        server.SFILTER_BATCH_LATENCY.observe(time.perf_counter() - start)
+
+async def call_llmstub_with_breaker(data: Dict[str, str]) -> AsyncResponse:
+    start = time.perf_counter()
+    try:
+        return await server.llmstub_breaker.call_async(make_authenticated_post_request, llmstub_client, data=data)
+    finally:
+        server.LLMSTUB_LATENCY.observe(time.perf_counter() - start)
+
+
+async def call_llmstub_speculative(data: Dict[str, str]) -> server.SpeculativeResult:
+    """See server.call_llmstub_speculative"""
+    start = time.perf_counter()
+    try:
+        response = await make_authenticated_post_request(llmstub_client, data=data)
+        return response, None, time.perf_counter() - start
+    except Exception as e:
+        return None, e, time.perf_counter() - start
+
+
+async def run_blocking(func, *args, executor: ThreadPoolExecutor = None) -> Any:
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+
+async def ensure_models() -> None:
+    if not server.models_loaded():
+        await run_blocking(server.load_models, executor=scoring_executor)
+    server.scorer_watcher.ensure_running()
+
+
+async def handle_message(userMessage: str, route: str = "/handle") -> ResponseValue:
+    """Async version of server.main, same decisions and responses. route is the request path."""
+    await ensure_models()
+    validation_error = server.validate_message(userMessage)
+    if validation_error is not None:
+        return validation_error
+    userMessage = userMessage.strip()
+    try:
+        model = server.serving
+        message_hash, score = await run_blocking(server.bayesian_score, userMessage, model, executor=scoring_executor)
+        score_zone = server.cascade_zone(score, model)
+        if score_zone == server.ZONE_BLOCK:
+            server.VERDICTS.labels("blocked").inc()
+            return "I don't understand your message, can you say it another way?"
+        cached_verdict = None
+        if score_zone == server.ZONE_ESCALATE:
+            cached_verdict = await run_blocking(server.get_cached_verdict, message_hash)
+        if cached_verdict == server.VERDICT_JAILBREAK:
+            server.VERDICTS.labels("blocked_secondary").inc()
+            return "I don't understand your message, can you say it another way? (secondary)"
+        speculative_llm = None
+        if score_zone == server.ZONE_ESCALATE and cached_verdict is None:
+            if server.speculation_allowed(route, score):
+                # Start the LLM call now, it is cancelled if sfilter rejects the message
+                speculative_llm = asyncio.create_task(call_llmstub_speculative({"message": userMessage}))
+            try:
+                await call_sfilter_with_breaker({"message": userMessage})
+                await run_blocking(server.cache_verdict, message_hash, server.VERDICT_OK)
+            except BaseException as e:
+                if speculative_llm is not None:
+                    server.SPECULATIVE_CALLS.labels("discarded").inc()
+                    speculative_llm.cancel()
+                if not isinstance(e, aiohttp.ClientResponseError):
+                    raise
+                if e.status == 401:
+                    await run_blocking(server.cache_verdict, message_hash, server.VERDICT_JAILBREAK)
+                    server.publish_secondary_filter_event(userMessage)
+                    structured_logger.info("sfilter service detected a jailbreak.")
+                    server.VERDICTS.labels("blocked_secondary").inc()
+                    return "I don't understand your message, can you say it another way? (secondary)"
+                structured_logger.error("HTTP error during sfilter check", url=server.SFILTER_URL, error=str(e))
+                return {"error": f"Error communicating with the secondary filter. {e.status}"}, 503
+        try:
+            if speculative_llm is not None:
+                llmstub_response = server.use_speculative(await speculative_llm)
+            else:
+                llmstub_response = await call_llmstub_with_breaker({"message": userMessage})
+            server.VERDICTS.labels("passed").inc()
+            return llmstub_response.text
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            structured_logger.error("Error calling llmstub service", url=server.LLMSTUB_URL, error=str(e))
+            return {"error": "Error communicating with the primary service."}, 503
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        structured_logger.error("Request to downstream failed", error=str(e))
+        return {"error": "Service temporarily unavailable"}, 503
+    except Exception as e:
+        structured_logger.error("Unexpected error in main handler", error=str(e))
+        return {"error": "Internal server error"}, 500
+
+
+async def handle_batch(payload: Any) -> ResponseValue:
+    """Async version of server.handle_batch"""
+    await ensure_models()
+    messages = payload.get("messages") if isinstance(payload, dict) else None
+    validation_error = server.validate_batch(messages)
+    if validation_error is not None:
+        return validation_error
+    messages = [userMessage.strip() for userMessage in messages]
+    try:
+        model = server.serving
+        message_hashes, scores = await run_blocking(server.bayesian_score_batch, messages, model,
+                                                    executor=scoring_executor)
+        verdicts, escalated = await run_blocking(server.batch_verdicts, message_hashes, scores, model)
+        if escalated:
+            try:
+                response = await call_sfilter_batch_with_breaker([messages[i] for i in escalated])
+                sfilter_results = json.loads(response.text)["results"]
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                structured_logger.error("Error calling sfilter batch endpoint", url=server.SFILTER_URL, error=str(e))
+                return {"error": "Error communicating with the secondary filter."}, 503
+            await run_blocking(server.apply_sfilter_batch_results, messages, message_hashes, verdicts,
+                               escalated, sfilter_results)
+        server.record_verdicts(verdicts)
+        return {"results": [{"score": score, "verdict": verdict} for score, verdict in zip(scores, verdicts)]}, 200
+    except Exception as e:
+        structured_logger.error("Unexpected error in batch handler", error=str(e))
+        return {"error": "Internal server error"}, 500
+
+
+# --- ASGI plumbing ---
+async def read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def send_response(send, value: ResponseValue) -> None:
+    """Encodes handler results the way Flask does: str as HTML, (dict, status) as JSON"""
+    if isinstance(value, tuple):
+        payload, status = value
+        body = json.dumps(payload).encode("utf-8")
+        content_type = b"application/json"
+    else:
+        status = 200
+        body = value.encode("utf-8")
+        content_type = b"text/html; charset=utf-8"
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await ensure_models()
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await sfilter_client.close()
+            await llmstub_client.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send) -> None:
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] in ("/handle", "/handle/batch"):
+        start = time.perf_counter()
+        server.app.request_count += 1
+        body = await read_body(receive)
+        if scope["path"] == "/handle":
+            form = parse_qs(body.decode("utf-8", "replace"), keep_blank_values=True)
+            response = await handle_message(form.get("message", [""])[0], scope["path"])
+        else:
+            try:
+                payload = json.loads(body or b"{}")
+            except ValueError:
+                payload = {}
+            response = await handle_batch(payload)
+        await send_response(send, response)
+        duration = time.perf_counter() - start
+        server.record_request(duration, response[1] if isinstance(response, tuple) else 200)
+        structured_logger.info("Request duration", duration=duration)
+        return
+    await flask_app(scope, receive, send)
@@ -0,0 +1,175 @@
+"""
+Three-zone cascade thresholds for the NB score.
+
+- score >= block_threshold: blocked by bfilter alone (confident-block)
+- score < pass_threshold: sent straight to llmstub, sfilter is skipped
+  (confident-pass)
+- anything in between is escalated to sfilter (uncertain)
+
+A message with nothing left to score after normalizing gets UNSCORED
+rather than a probability. The model has no evidence about it either way,
+so it is always escalated, whatever the thresholds.
+
+dataprep.py calibrates both thresholds on out-of-fold scores of
+jailbreaks.csv. pass_threshold is the highest value that lets at most
+target_fnr of the jailbreaks skip sfilter, and block_threshold the lowest
+value that blocks at most target_fpr of the benign messages, both over the
+scored messages only. The result is
+written to cascade.json next to the model, and the out-of-fold scores it
+was calibrated on to cascade_scores.npz.
+
+threshold_sweep.py reads those scores back to trace every threshold's
+error rates, escalation rate and expected latency (sweep, cascade_grid),
+picks thresholds for an sfilter load or latency budget, and can fit an
+isotonic or Platt score calibration. A score_calibration entry in
+cascade.json maps the model's scores to calibrated probabilities before
+they are compared with the thresholds (apply_score_calibration).
+"""
+
+import json
+import os
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+CASCADE_FILE = "cascade.json"
+SCORES_FILE = "cascade_scores.npz"
+SCORE_CALIBRATION_METHODS = ("isotonic", "platt")
+# Score of a message normalize() reduces to "", outside [0, 1] so no threshold applies to it
+UNSCORED = -1.0
+ZONE_BLOCK = "block"
+ZONE_PASS = "pass"
+ZONE_ESCALATE = "escalate"
+
+
+def calibrate_thresholds(positive_scores: np.ndarray, negative_scores: np.ndarray,
+                         target_fnr: float = 0.01, target_fpr: float = 0.01) -> Dict[str, Any]:
+    """Thresholds and their expected error and offload rates from held-out scores"""
+    positive_scores = np.sort(np.asarray(positive_scores, dtype=np.float64))
+    negative_scores = np.sort(np.asarray(negative_scores, dtype=np.float64))[::-1]
+    if not len(positive_scores) or not len(negative_scores):
+        raise ValueError("Calibration needs both jailbreak and benign scores")
+
+    # At most floor(target * n) jailbreaks may score below the pass threshold
+    allowed_fn = int(np.floor(target_fnr * len(positive_scores)))
+    pass_threshold = float(positive_scores[min(allowed_fn, len(positive_scores) - 1)])
+    # And at most floor(target * n) benign messages at or above the block threshold
+    allowed_fp = int(np.floor(target_fpr * len(negative_scores)))
+    if allowed_fp >= len(negative_scores):
+        block_threshold = float(negative_scores[-1])
+    else:
+        block_threshold = float(np.nextafter(negative_scores[allowed_fp], np.inf))
+    pass_threshold = min(pass_threshold, block_threshold)
+
+    return {
+        "pass_threshold": pass_threshold,
+        "block_threshold": block_threshold,
+        "target_fnr": target_fnr,
+        "target_fpr": target_fpr,
+        "fnr": float(np.mean(positive_scores < pass_threshold)),
+        "fpr": float(np.mean(negative_scores >= block_threshold)),
+        "benign_offload_rate": float(np.mean(negative_scores < pass_threshold)),
+        "escalation_rate": float(np.mean(np.concatenate([
+            (positive_scores >= pass_threshold) & (positive_scores < block_threshold),
+            (negative_scores >= pass_threshold) & (negative_scores < block_threshold),
+        ]))),
+        "positives": int(len(positive_scores)),
+        "negatives": int(len(negative_scores)),
+    }
+
+
+def save_thresholds(calibration: Dict[str, Any], path: str = CASCADE_FILE) -> None:
+    with open(path, "w") as f:
+        json.dump(calibration, f, indent=2)
+
+
+def load_thresholds(path: str = CASCADE_FILE) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_scores(scores: np.ndarray, is_spam: np.ndarray, path: str = SCORES_FILE, **metadata: Any) -> None:
+    with open(path, "wb") as f:
+        np.savez(f, scores=np.asarray(scores, dtype=np.float64), is_spam=np.asarray(is_spam, dtype=bool),
+                 metadata=np.str_(json.dumps(metadata)))
+
+
+def load_scores(path: str = SCORES_FILE) -> Tuple[np.ndarray, np.ndarray, Dict[str, Any]]:
+    """Scores, spam labels and the metadata they were saved with"""
+    with np.load(path) as saved:
+        return saved["scores"], saved["is_spam"], json.loads(str(saved["metadata"]))
+
+
+def apply_score_calibration(scores: np.ndarray, calibration: Optional[Dict[str, Any]]) -> np.ndarray:
+    """
+    Calibrated probabilities of raw scores: a sigmoid of the score's logit
+    for platt, piecewise linear between fitted points (as
+    IsotonicRegression.predict) for isotonic. No calibration returns the scores.
+    """
+    if not calibration:
+        return scores
+    if calibration["method"] == "platt":
+        clipped = np.clip(scores, 1e-15, 1 - 1e-15)
+        logits = calibration["a"] * np.log(clipped / (1 - clipped)) + calibration["b"]
+        return 0.5 * (1.0 + np.tanh(0.5 * logits))
+    if calibration["method"] == "isotonic":
+        return np.interp(scores, calibration["x"], calibration["y"])
+    raise ValueError(f"Unknown score calibration {calibration['method']!r}, "
+                     f"expected one of {', '.join(SCORE_CALIBRATION_METHODS)}")
+
+
+def sweep(positive_scores: np.ndarray, negative_scores: np.ndarray, thresholds: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Rates of every threshold t at once, from two sorted searches per class:
+    jailbreaks and benign messages scoring >= t (blocked, or at least
+    escalated when t is the pass threshold) and below it.
+    """
+    positive_scores = np.sort(positive_scores)
+    negative_scores = np.sort(negative_scores)
+    positives_above = len(positive_scores) - np.searchsorted(positive_scores, thresholds, side="left")
+    negatives_above = len(negative_scores) - np.searchsorted(negative_scores, thresholds, side="left")
+    flagged = positives_above + negatives_above
+    return {
+        "threshold": thresholds,
+        "recall": positives_above / len(positive_scores),
+        "precision": np.divide(positives_above, flagged, out=np.ones(len(thresholds)), where=flagged > 0),
+        "fpr": negatives_above / len(negative_scores),
+        "fnr": 1.0 - positives_above / len(positive_scores),
+        "benign_offload_rate": 1.0 - negatives_above / len(negative_scores),
+        "flagged_rate": flagged / (len(positive_scores) + len(negative_scores)),
+    }
+
+
+def cascade_grid(positive_scores: np.ndarray, negative_scores: np.ndarray, thresholds: np.ndarray,
+                 bfilter_ms: float, sfilter_ms: float) -> Dict[str, np.ndarray]:
+    """
+    Every (pass, block) pair of thresholds, as matrices indexed [pass, block]:
+    jailbreaks skipping sfilter (fnr), benign messages blocked (fpr), the
+    share escalated to sfilter and the expected filtering latency per
+    message. Pairs with pass > block are nan. Escalated messages are left
+    to sfilter, so they count as neither error.
+    """
+    rates = sweep(positive_scores, negative_scores, thresholds)
+    fnr = np.broadcast_to(rates["fnr"][:, None], (len(thresholds), len(thresholds)))
+    fpr = np.broadcast_to(rates["fpr"][None, :], (len(thresholds), len(thresholds)))
+    # Flagged at the pass threshold and not yet at the block threshold
+    escalation = rates["flagged_rate"][:, None] - rates["flagged_rate"][None, :]
+    valid = thresholds[:, None] <= thresholds[None, :]
+    escalation = np.where(valid, escalation, np.nan)
+    return {
+        "pass_threshold": thresholds, "block_threshold": thresholds,
+        "fnr": np.where(valid, fnr, np.nan), "fpr": np.where(valid, fpr, np.nan),
+        "escalation_rate": escalation, "latency_ms": bfilter_ms + escalation * sfilter_ms,
+    }
+
+
+def zone(score: float, pass_threshold: float, block_threshold: float) -> str:
+    if score == UNSCORED:
+        return ZONE_ESCALATE
+    if score >= block_threshold:
+        return ZONE_BLOCK
+    if score < pass_threshold:
+        return ZONE_PASS
+    return ZONE_ESCALATE
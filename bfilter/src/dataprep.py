@@ -1,15 +1,23 @@
 #!/usr/bin/env python3
-import pandas as pd
-from sklearn.naive_bayes import MultinomialNB
+import argparse
+import datetime
+import hashlib
+import itertools
+import os
+from multiprocessing import Pool
+from typing import Callable, Dict, Iterator, List, Tuple
 
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import sparse
 from sklearn.feature_extraction.text import CountVectorizer
-# from sklearn.feature_extraction.text import HashingVectorizer
-# from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.naive_bayes import MultinomialNB
 
-import joblib
-import hashlib
-import datetime
-import os
+from cascade import CASCADE_FILE, SCORES_FILE, calibrate_thresholds, save_scores, save_thresholds
+from lookup_scorer import LookupScorer, SCORER_FILE, token_hash
+from normalize import normalize
+from online_train import CLASSES, MODELS, OnlineTrainer, STATE_FILE
 
 
 # #STARTUP CHECK, HAVE THE ENVIRONMENT VARIABLES BEEN SET
@@ -21,86 +29,308 @@ import os
 # if not SECONDARYSTUB_URL:
 #     raise ValueError("SECONDARYSTUB_URL environment variable is not set.")
 
-def process_text(text: str) -> list[str]:
-    #Break into words
-    words = text.split(" ")
-    for word in words:
-        #Remove words that are less than 3 characters
-        if len(word) == 1:
-            words.remove(word)
-        else:
-            #Remove all vowels
-            word = word.replace("aeiou", "")
-            #Remove all numbers
-            word = word.replace("0123456789", "")
-        
-    #Rejoin the words
-    text = " ".join(words)
-    
-    #reverse the text
-    textReversed = text[::-1]
-    
-    #Save the text
-    return [text, textReversed]
+N_FOLDS = 5
+# Feature backends of the model shipped as scorer.bin, see --features
+FEATURES = ("vocabulary", "hashed")
+# Rows kept from the first chunk to check the lookup scorer against predict_proba
+VERIFY_ROWS = 2000
+
 
 ####################
 # Vectorize and model builder
 # Simple process to load the dataset, vectorize it, and train a model
 # then save the vectors and model to disk as part of the docker image
+#
+# The corpus is streamed in chunks of --chunk-size rows, twice:
+# 1. Token counts per (fold, class) for the CountVectorizer model, which
+#    are all MultinomialNB learns, and partial_fit of the hashed online
+#    model and its fold models. Nothing else is kept, so memory follows
+#    the vocabulary and not the number of rows.
+# 2. Out-of-fold scores for the cascade calibration, each row scored by
+#    the fold models that never saw it. They are saved to
+#    cascade_scores.npz for threshold_sweep.py.
+# Chunks are normalized (normalize.py) on a pool of --workers processes.
 
 
 ####################
 # Notes to future self:
 # - This is the same as exp003 except we dump the model and vectorizer to disk
 # - Scale will be a problem as the dataset grows, could incremental training help?
+#   -> online_train.py now folds new messages into online_state.pkl with partial_fit
 #
 
 
-####################
-# Dataset load
-dataset = pd.read_csv("jailbreaks.csv")
+def read_chunks(path: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    yield from pd.read_csv(path, usecols=["class", "text"], chunksize=chunk_size)
 
-dataset["text"] = dataset["text"].str.lower()
 
-reversedText = []
+def normalized_chunk(chunk: pd.DataFrame) -> Tuple[List[str], np.ndarray]:
+    """Texts as the model is trained on them and the server scores them (normalize.py), and their labels"""
+    return [normalize(text) for text in chunk["text"].astype(str)], chunk["class"].to_numpy()
 
-####################
-#Loop through dataset text
-for i in range(len(dataset["text"])):
-    #Get the text
-    textProcessed = process_text(dataset["text"][i])
-    dataset.loc[i, "text"] = textProcessed[0]
-    reversedText.append(textProcessed[1])
-    
-#Add the reversed text to the dataset
-dataset["text"] = dataset["text"] + pd.Series(reversedText)
 
-####################
-# Vectorize
-cv = CountVectorizer()
-# cv = HashingVectorizer()
-# cv = TfidfVectorizer()
-X = cv.fit_transform(dataset["text"])
+def preprocessed_chunks(path: str, chunk_size: int, workers: int,
+                        preprocess: Callable[[pd.DataFrame], Tuple[List[str], np.ndarray]]):
+    chunks = read_chunks(path, chunk_size)
+    if workers <= 1:
+        yield from map(preprocess, chunks)
+        return
+    with Pool(workers) as pool:
+        # Pool.imap would read the whole file ahead, so feed it a bounded window
+        while True:
+            window = list(itertools.islice(chunks, 2 * workers))
+            if not window:
+                return
+            yield from pool.imap(preprocess, window)
 
 
-####################
-# Train
-clf = MultinomialNB()
-clf.fit(X, dataset["class"])
+class FoldAssigner:
+    """Stratified folds for a stream: the n-th row of a class goes to fold n % n_folds"""
+    def __init__(self, n_folds: int = N_FOLDS):
+        self.n_folds = n_folds
+        self.seen: Dict[str, int] = {}
 
-####################
-# Save
-joblib.dump(clf, "model.pkl")
-joblib.dump(cv, "cv.pkl")
+    def assign(self, labels: np.ndarray) -> np.ndarray:
+        folds = np.zeros(len(labels), dtype=np.intp)
+        for label in np.unique(labels):
+            mask = labels == label
+            start = self.seen.get(label, 0)
+            folds[mask] = (start + np.arange(mask.sum())) % self.n_folds
+            self.seen[label] = start + int(mask.sum())
+        return folds
 
-####################
-# Calculate the hash of the model.pkl and cv.pkl files
-# to see if they have changed
-modelHash = hashlib.md5(open("model.pkl","rb").read()).hexdigest()
-sourceHash = hashlib.md5(open("server.py","rb").read()).hexdigest()
-timehash = hashlib.md5(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S").encode("utf-8")).hexdigest()
-thishash = hashlib.md5(open(__file__,"rb").read()).hexdigest()
 
-deployHash = hashlib.md5((modelHash + sourceHash + thishash + timehash).encode("utf-8")).hexdigest()
+class TokenCounts:
+    """Token counts per fold and class, the sufficient statistics of MultinomialNB"""
+    def __init__(self, n_folds: int = N_FOLDS):
+        self.n_folds = n_folds
+        self.vocabulary: Dict[str, int] = {}
+        self.counts = np.zeros((n_folds * len(CLASSES), 1024))
+        self.class_counts = np.zeros((n_folds, len(CLASSES)))
+        self.vectorizer = CountVectorizer()
+
+    @staticmethod
+    def class_index(labels: np.ndarray) -> np.ndarray:
+        unknown = set(np.unique(labels)) - set(CLASSES)
+        if unknown:
+            raise ValueError(f"Unexpected classes {sorted(map(str, unknown))}, expected {list(CLASSES)}")
+        return np.searchsorted(CLASSES, labels)
+
+    def add(self, texts: List[str], labels: np.ndarray, folds: np.ndarray) -> None:
+        classIdx = self.class_index(labels)
+        groups = folds * len(CLASSES) + classIdx
+        np.add.at(self.class_counts, (folds, classIdx), 1)
+        try:
+            chunkCounts = self.vectorizer.fit_transform(texts)
+        except ValueError:
+            # Nothing but empty and one-character texts in this chunk
+            return
+        terms = self.vectorizer.get_feature_names_out()
+        columns = np.fromiter((self.vocabulary.setdefault(term, len(self.vocabulary)) for term in terms),
+                              dtype=np.intp, count=len(terms))
+        if len(self.vocabulary) > self.counts.shape[1]:
+            grown = np.zeros((self.counts.shape[0], max(2 * self.counts.shape[1], len(self.vocabulary))))
+            grown[:, :self.counts.shape[1]] = self.counts
+            self.counts = grown
+        membership = sparse.csr_matrix((np.ones(len(groups)), (groups, np.arange(len(groups)))),
+                                       shape=(self.counts.shape[0], len(groups)))
+        self.counts[:, columns] += (membership @ chunkCounts).toarray()
+
+    def per_fold(self) -> np.ndarray:
+        """(fold, class, token) counts"""
+        return self.counts[:, :len(self.vocabulary)].reshape(self.n_folds, len(CLASSES), -1)
+
+    def terms(self) -> np.ndarray:
+        return np.array(list(self.vocabulary), dtype=object)
+
+
+def nb_table(featureCounts: np.ndarray, classCounts: np.ndarray, alpha: float = 1.0) -> Tuple[np.ndarray, float]:
+    """Token weights and bias of a binary MultinomialNB with these counts, as LookupScorer.from_model computes them"""
+    smoothed = featureCounts + alpha
+    featureLogProb = np.log(smoothed) - np.log(smoothed.sum(axis=1, keepdims=True))
+    classLogPrior = np.log(classCounts) - np.log(classCounts.sum())
+    return featureLogProb[1] - featureLogProb[0], float(classLogPrior[1] - classLogPrior[0])
+
+
+def fold_scorer(counts: TokenCounts, fold: int, hashes: np.ndarray) -> LookupScorer:
+    """Lookup scorer of the CountVectorizer model trained on every fold but this one"""
+    perFold = counts.per_fold()
+    trainCounts = perFold.sum(axis=0) - perFold[fold]
+    trainClasses = counts.class_counts.sum(axis=0) - counts.class_counts[fold]
+    # Tokens only seen in the held-out fold are not in that model's vocabulary
+    seen = trainCounts.sum(axis=0) > 0
+    weights, bias = nb_table(trainCounts[:, seen], trainClasses)
+    order = np.argsort(hashes[seen])
+    return LookupScorer(hashes[seen][order], np.ascontiguousarray(weights[order]), bias,
+                        counts.vectorizer.token_pattern, counts.vectorizer.lowercase)
+
+
+def verify_scorer(scorer: LookupScorer, texts: List[str], expected: np.ndarray) -> None:
+    """Makes sure a compiled scorer reproduces its model's predict_proba before it is shipped"""
+    maxError = float(np.abs(expected - scorer.score_batch(texts)).max())
+    if maxError > 1e-9:
+        raise ValueError(f"{type(scorer).__name__} disagrees with predict_proba, max error {maxError}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the bfilter models and calibrate the cascade")
+    parser.add_argument("--data", default="jailbreaks.csv")
+    parser.add_argument("--output-dir", default=".")
+    parser.add_argument("--chunk-size", type=int, default=int(os.getenv("DATAPREP_CHUNK_SIZE", "50000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("DATAPREP_WORKERS", str(os.cpu_count() or 1))))
+    parser.add_argument("--features", choices=FEATURES, default=os.getenv("DATAPREP_FEATURES", "vocabulary"),
+                        help="Model shipped as scorer.bin: the CountVectorizer one or the hashed online one")
+    parser.add_argument("--hash-bits", type=int, default=int(os.getenv("DATAPREP_HASH_BITS", "20")),
+                        help="The hashed model has 2^k feature buckets")
+    parser.add_argument("--ngram-max", type=int, default=int(os.getenv("DATAPREP_NGRAM_MAX", "1")),
+                        help="The hashed model sees word n-grams up to this length")
+    parser.add_argument("--signed", action="store_true", default=os.getenv("DATAPREP_SIGNED", "false").lower() == "true",
+                        help="Signed hashing for the hashed model, needs --model linear")
+    parser.add_argument("--model", choices=MODELS, default=os.getenv("DATAPREP_MODEL", "nb"),
+                        help="Classifier of the hashed model")
+    parser.add_argument("--epochs", type=int, default=int(os.getenv("DATAPREP_EPOCHS", "5")),
+                        help="Passes over the data for --model linear, MultinomialNB always takes one")
+    args = parser.parse_args()
+    os.makedirs(args.output_dir, exist_ok=True)
+    useVocabulary = args.features == "vocabulary"
+
+    def hashed_trainer() -> OnlineTrainer:
+        return OnlineTrainer(2 ** args.hash_bits, ngram_range=(1, args.ngram_max), alternate_sign=args.signed,
+                             model=args.model)
+
+    try:
+        onlineTrainer = hashed_trainer()
+    except ValueError as e:
+        parser.error(str(e))
+
+    ####################
+    # Pass 1: count tokens and fit the online models chunk by chunk. The
+    # linear model takes --epochs passes, the later ones only update it.
+    counts = TokenCounts()
+    onlineFolds = [hashed_trainer() for _ in range(N_FOLDS)]
+    verifyTexts: List[str] = []
+    rows = 0
+    for epoch in range(args.epochs if args.model == "linear" else 1):
+        assigner = FoldAssigner()
+        rng = np.random.default_rng(epoch)
+        for texts, labels in preprocessed_chunks(args.data, args.chunk_size, args.workers, normalized_chunk):
+            folds = assigner.assign(labels)
+            if epoch == 0:
+                if useVocabulary:
+                    counts.add(texts, labels, folds)
+                if len(verifyTexts) < VERIFY_ROWS:
+                    verifyTexts.extend(texts[:VERIFY_ROWS - len(verifyTexts)])
+                rows += len(texts)
+            # Hashed once, then shared by the full model and the fold models
+            hashed = onlineTrainer.vectorizer.transform(texts)
+            if args.model == "linear":
+                # SGD follows the row order, so it is reshuffled every epoch
+                order = rng.permutation(len(labels))
+                hashed, labels, folds = hashed[order], labels[order], folds[order]
+            onlineTrainer.partial_fit_features(hashed, labels)
+            for fold, foldTrainer in enumerate(onlineFolds):
+                foldTrainer.partial_fit_features(hashed[folds != fold], labels[folds != fold])
+            print(f"Pass 1, epoch {epoch + 1}: {rows} rows" +
+                  (f", {len(counts.vocabulary)} tokens" if useVocabulary else ""))
+
+    onlineScorer = onlineTrainer.scorer()
+    verify_scorer(onlineScorer, verifyTexts,
+                  onlineTrainer.clf.predict_proba(onlineTrainer.vectorizer.transform(verifyTexts))[:, 1])
+
+    if useVocabulary:
+        ####################
+        # Train: the CountVectorizer + MultinomialNB pair server.py falls back
+        # on, rebuilt from the counts. Each class row is passed once, divided
+        # by its message count and weighted by it, so feature_count_ and
+        # class_count_ come out as the totals.
+        terms = counts.terms()
+        order = np.argsort(terms)
+        featureCounts = counts.per_fold().sum(axis=0)[:, order]
+        classCounts = counts.class_counts.sum(axis=0)
+        cv = CountVectorizer(vocabulary={term: i for i, term in enumerate(terms[order])})
+        cv.fit([])
+        clf = MultinomialNB()
+        clf.fit(sparse.csr_matrix(featureCounts / classCounts[:, None]), CLASSES, sample_weight=classCounts)
+
+        ####################
+        # Compile the token lookup table used by server.py
+        scorer = LookupScorer.from_model(cv, clf)
+        verify_scorer(scorer, verifyTexts, clf.predict_proba(cv.transform(verifyTexts))[:, 1])
+        hashes = np.fromiter((token_hash(term) for term in terms), dtype=np.uint64, count=len(terms))
+        foldScorers = [fold_scorer(counts, fold, hashes) for fold in range(N_FOLDS)]
+    else:
+        # The hashed model is shipped, with no vocabulary built at all
+        cv, clf, scorer = onlineTrainer.vectorizer, onlineTrainer.clf, onlineScorer
+        foldScorers = []
+
+    ####################
+    # Pass 2: calibrate the cascade thresholds on out-of-fold scores, so
+    # every message is scored by a model that never saw it
+    targetFnr = float(os.getenv("CASCADE_TARGET_FNR", "0.01"))
+    targetFpr = float(os.getenv("CASCADE_TARGET_FPR", "0.01"))
+    onlineFoldScorers = [foldTrainer.scorer() for foldTrainer in onlineFolds]
+    del onlineFolds
+    assigner = FoldAssigner()
+    oofScores, onlineOofScores, oofLabels = [], [], []
+    for texts, labels in preprocessed_chunks(args.data, args.chunk_size, args.workers, normalized_chunk):
+        folds = assigner.assign(labels)
+        texts = np.array(texts, dtype=object)
+        chunkScores = np.zeros(len(texts))
+        chunkOnlineScores = np.zeros(len(texts))
+        for fold in range(N_FOLDS):
+            inFold = folds == fold
+            if foldScorers:
+                chunkScores[inFold] = foldScorers[fold].score_batch(texts[inFold])
+            chunkOnlineScores[inFold] = onlineFoldScorers[fold].score_batch(texts[inFold])
+        # Messages with nothing left after normalizing are always escalated
+        # by the server, so they take no part in placing the thresholds
+        scored = texts != ""
+        oofScores.append(chunkScores[scored])
+        onlineOofScores.append(chunkOnlineScores[scored])
+        oofLabels.append((labels == "spam")[scored])
+    oofScores = np.concatenate(oofScores)
+    onlineOofScores = np.concatenate(onlineOofScores)
+    isSpam = np.concatenate(oofLabels)
+    # The hashed feature space smooths over far more features, so the online
+    # model's scores sit on their own scale and get their own thresholds
+    onlineTrainer.calibration = calibrate_thresholds(onlineOofScores[isSpam], onlineOofScores[~isSpam],
+                                                     target_fnr=targetFnr, target_fpr=targetFpr)
+    onlineScorer.calibration = onlineTrainer.calibration
+    print(f"Online model cascade thresholds: {onlineTrainer.calibration}")
+    if useVocabulary:
+        calibration = calibrate_thresholds(oofScores[isSpam], oofScores[~isSpam],
+                                           target_fnr=targetFnr, target_fpr=targetFpr)
+        print(f"Cascade thresholds: {calibration}")
+    else:
+        calibration = onlineTrainer.calibration
+
+    ####################
+    # Save
+    def output(name: str) -> str:
+        return os.path.join(args.output_dir, name)
+
+    joblib.dump(clf, output("model.pkl"))
+    joblib.dump(cv, output("cv.pkl"))
+    scorer.save(output(SCORER_FILE))
+    save_thresholds(calibration, output(CASCADE_FILE))
+    # The shipped model's out-of-fold scores, for threshold_sweep.py
+    save_scores(oofScores if useVocabulary else onlineOofScores, isSpam, output(SCORES_FILE),
+                version=scorer.version, data=os.path.basename(args.data))
+    onlineTrainer.save(output(STATE_FILE))
+
+    ####################
+    # Calculate the hash of the model.pkl and cv.pkl files
+    # to see if they have changed
+    modelHash = hashlib.md5(open(output("model.pkl"), "rb").read()).hexdigest()
+    serverPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+    sourceHash = hashlib.md5(open(serverPath, "rb").read()).hexdigest() if os.path.exists(serverPath) else ""
+    timehash = hashlib.md5(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S").encode("utf-8")).hexdigest()
+    thishash = hashlib.md5(open(__file__, "rb").read()).hexdigest()
+
+    deployHash = hashlib.md5((modelHash + sourceHash + thishash + timehash).encode("utf-8")).hexdigest()
+
+    joblib.dump(deployHash, output("deployHash.txt"))
+
 
-joblib.dump(deployHash, "deployHash.txt")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Fire-and-forget Pub/Sub publishing for messages rejected by sfilter.
+
+One long-lived PublisherClient per process batches messages according to
+PUBSUB_MAX_MESSAGES / PUBSUB_MAX_BYTES / PUBSUB_MAX_LATENCY_MS. publish()
+never waits for the broker: outcomes are counted from done-callbacks. When
+more than max_in_flight publishes are outstanding, new events go to a
+bounded local spill queue that drains as publishes complete; once the spill
+queue is full the oldest events are dropped and counted.
+
+PUBSUB_PUBLISHER=fake swaps the Google client for FakePublisherClient, an
+in-process stand-in that records what was published, for tests and local
+runs without a project.
+"""
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from google.cloud import pubsub_v1
+
+
+class FakePublisherClient:
+    """In-process stand-in for pubsub_v1.PublisherClient"""
+    def __init__(self, batch_settings: Any = None):
+        self.batch_settings = batch_settings
+        self.published: List[Tuple[str, bytes]] = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def topic_path(project: str, topic: str) -> str:
+        return f"projects/{project}/topics/{topic}"
+
+    def publish(self, topic: str, data: bytes, **attrs) -> Future:
+        future: Future = Future()
+        with self._lock:
+            self.published.append((topic, data))
+            future.set_result(str(len(self.published)))
+        return future
+
+
+def google_publisher_factory(max_messages: int, max_bytes: int, max_latency: float):
+    return pubsub_v1.PublisherClient(batch_settings=pubsub_v1.types.BatchSettings(
+        max_messages=max_messages, max_bytes=max_bytes, max_latency=max_latency))
+
+
+def default_publisher_factory() -> Callable[[int, int, float], Any]:
+    if os.getenv("PUBSUB_PUBLISHER", "google").lower() == "fake":
+        return lambda max_messages, max_bytes, max_latency: FakePublisherClient()
+    return google_publisher_factory
+
+
+class EventPublisher:
+    def __init__(self, project_id: Optional[str], topic_id: str,
+                 client_factory: Optional[Callable[[int, int, float], Any]] = None,
+                 max_messages: int = 100, max_bytes: int = 1024 * 1024, max_latency_ms: float = 50.0,
+                 max_in_flight: int = 1000, spill_capacity: int = 10000):
+        self.project_id = project_id
+        self.topic_id = topic_id
+        self.client_factory = client_factory or default_publisher_factory()
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_latency = max_latency_ms / 1000.0
+        self.max_in_flight = max_in_flight
+        self.spill: Deque[bytes] = deque()
+        self.spill_capacity = spill_capacity
+        self.published = 0
+        self.failed = 0
+        self.dropped = 0
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._client = None
+        self._client_pid = None
+        self._topic_path = None
+
+    def _publisher(self):
+        # gRPC channels don't survive a fork, each gunicorn worker builds its own client
+        if self._client is None or self._client_pid != os.getpid():
+            self._client = self.client_factory(self.max_messages, self.max_bytes, self.max_latency)
+            self._client_pid = os.getpid()
+            self._topic_path = self._client.topic_path(self.project_id, self.topic_id)
+        return self._client
+
+    @property
+    def topic_path(self) -> str:
+        self._publisher()
+        return self._topic_path
+
+    def publish(self, data: bytes) -> None:
+        """Queue data for publishing without waiting for the broker"""
+        with self._lock:
+            if self.in_flight >= self.max_in_flight:
+                if len(self.spill) >= self.spill_capacity:
+                    self.spill.popleft()
+                    self.dropped += 1
+                self.spill.append(data)
+                return
+            self.in_flight += 1
+        self._send(data)
+
+    def _send(self, data: Optional[bytes]) -> None:
+        # Publishes that fail or finish straight away hand their slot on in
+        # this loop, a recursion through _on_done could go a spill queue deep
+        while data is not None:
+            try:
+                future = self._publisher().publish(self._topic_path, data)
+            except Exception:
+                data = self._finish(failed=True)
+                continue
+            if not future.done():
+                future.add_done_callback(self._on_done)
+                return
+            data = self._finish(failed=future.exception() is not None)
+
+    def _on_done(self, future: Future) -> None:
+        self._send(self._finish(failed=future.exception() is not None))
+
+    def _finish(self, failed: bool) -> Optional[bytes]:
+        """Counts a finished publish, and returns the oldest spilled event to hand its slot to"""
+        with self._lock:
+            if failed:
+                self.failed += 1
+            else:
+                self.published += 1
+            next_data = self.spill.popleft() if self.spill else None
+            if next_data is None:
+                self.in_flight -= 1
+        return next_data
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "published": self.published,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "in_flight": self.in_flight,
+                "spilled": len(self.spill),
+            }
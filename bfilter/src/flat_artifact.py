@@ -0,0 +1,75 @@
+"""
+Flat, memory-mappable model artifacts.
+
+A file holds named numpy arrays and a small JSON metadata dict:
+
+    b"BFMODEL1" | uint64 header length | JSON header | arrays
+
+The header records each array's dtype, shape and byte offset. Offsets are
+64-byte aligned, and the file is mapped read-only with np.memmap, the same
+mapping np.load(mmap_mode="r") makes for a .npy. Loading is therefore
+parsing a few hundred bytes of JSON: the arrays are paged in from the page
+cache on first use, and every process that maps the file (each gunicorn
+worker, the master with --preload) shares the same physical pages instead
+of holding a private unpickled copy.
+
+save_arrays writes to a temporary file and renames it into place. A
+reader that has the old file mapped keeps a valid mapping of the old
+inode, so a model can be replaced under a running server.
+"""
+
+import json
+import os
+import struct
+from typing import Any, Dict, Tuple
+
+import numpy as np
+
+MAGIC = b"BFMODEL1"
+ALIGNMENT = 64
+
+
+def _aligned(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def save_arrays(path: str, arrays: Dict[str, np.ndarray], metadata: Dict[str, Any]) -> None:
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset = _aligned(offset + array.nbytes)
+    header = json.dumps({"metadata": metadata, "arrays": layout}).encode("utf-8")
+    # Pad the header so the data section, and with it every array, starts aligned
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+    header += b" " * (data_start - len(MAGIC) - 8 - len(header))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def load_arrays(path: str) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """Read-only array views into the mapped file, and its metadata"""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a flat model artifact")
+        (header_length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_length))
+    data_start = len(MAGIC) + 8 + header_length
+    mapped = np.memmap(path, dtype=np.uint8, mode="r")
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        start = data_start + spec["offset"]
+        arrays[name] = mapped[start:start + count * dtype.itemsize].view(dtype).reshape(spec["shape"])
+    return arrays, header["metadata"]
@@ -0,0 +1,251 @@
+"""
+Precompiled lookup scorer for the bfilter MultinomialNB model.
+
+For a two class MultinomialNB the spam probability of a message is
+
+    sigmoid(bias + sum(count(w) * weight(w)))
+
+with weight(w) = log P(w|spam) - log P(w|ham) and bias the difference of the
+class log priors. dataprep.py compiles that table once from the fitted
+CountVectorizer + MultinomialNB and server.py scores messages by looking
+tokens up in it, without going through the sklearn transform/predict_proba
+stack.
+
+Tokens are keyed by a stable 64-bit blake2b hash and stored as a sorted
+uint64 array with a parallel float64 weight array, so a lookup is a single
+vectorized np.searchsorted and no vocabulary dict is kept in memory.
+
+HashedScorer is the same table for a model trained on a fixed
+HashingVectorizer feature space (see online_train.py): a token's weight is
+read straight from its murmurhash bucket, so there is no vocabulary to
+match against and a model updated with partial_fit keeps the same layout.
+Word n-grams are hashed like single tokens, and with signed hashing
+(alternate_sign) a token whose hash is negative counts -1 in its bucket.
+The table holds the MultinomialNB log-likelihood ratios or, for a linear
+model, its coefficients, which have the same sigmoid(bias + sum) form. It
+carries the cascade thresholds calibrated for it, since its scores are not
+on the same scale as the CountVectorizer model's.
+
+Both are stored as flat artifacts (flat_artifact.py) and loaded by mapping
+the file, so loading takes milliseconds and workers share one copy.
+"""
+
+import hashlib
+import math
+import os
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import joblib
+import numpy as np
+from sklearn.utils import murmurhash3_32
+
+from flat_artifact import load_arrays, save_arrays
+
+SCORER_FILE = "scorer.bin"
+ONLINE_SCORER_FILE = "online_scorer.bin"
+
+
+def token_hash(token: str) -> int:
+    """Stable 64-bit hash of a token, identical across processes and builds"""
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class LookupScorer:
+    def __init__(self, hashes: np.ndarray, weights: np.ndarray, bias: float,
+                 token_pattern: str, lowercase: bool = True, version: str = ""):
+        self.hashes = hashes
+        self.weights = weights
+        self.bias = float(bias)
+        self.token_pattern = token_pattern
+        self.lowercase = bool(lowercase)
+        self._token_re = re.compile(token_pattern)
+        # Identifies the table in cache keys and /metrics
+        self.version = version or hashlib.blake2b(weights.tobytes(), digest_size=6).hexdigest()
+
+    @classmethod
+    def from_model(cls, cv, clf) -> "LookupScorer":
+        """Compile the lookup table from a fitted CountVectorizer and MultinomialNB"""
+        if len(clf.classes_) != 2:
+            raise ValueError(f"Expected a binary classifier, got classes {list(clf.classes_)}")
+        if (cv.analyzer != "word" or tuple(cv.ngram_range) != (1, 1) or cv.tokenizer is not None
+                or cv.preprocessor is not None or cv.stop_words is not None
+                or cv.strip_accents is not None or cv.binary):
+            raise ValueError("Only plain unigram word CountVectorizers can be compiled")
+
+        terms = cv.get_feature_names_out()
+        llr = clf.feature_log_prob_[1] - clf.feature_log_prob_[0]
+        hashes = np.fromiter((token_hash(t) for t in terms), dtype=np.uint64, count=len(terms))
+        order = np.argsort(hashes)
+        hashes = hashes[order]
+        if len(hashes) > 1 and np.any(hashes[1:] == hashes[:-1]):
+            raise ValueError("Token hash collision while compiling the lookup table")
+        bias = clf.class_log_prior_[1] - clf.class_log_prior_[0]
+        return cls(hashes, np.ascontiguousarray(llr[order]), bias, cv.token_pattern, cv.lowercase)
+
+    @classmethod
+    def load(cls, path: str = SCORER_FILE) -> "LookupScorer":
+        """Maps the table read-only, see flat_artifact.py"""
+        return cls.from_artifact(*load_arrays(path))
+
+    @classmethod
+    def from_artifact(cls, arrays: Dict[str, np.ndarray], metadata: Dict[str, Any]) -> "LookupScorer":
+        return cls(arrays["hashes"], arrays["weights"], metadata["bias"], metadata["token_pattern"],
+                   metadata["lowercase"], metadata["version"])
+
+    def metadata(self) -> Dict[str, Any]:
+        return {"kind": "lookup", "bias": self.bias, "token_pattern": self.token_pattern,
+                "lowercase": self.lowercase, "version": self.version}
+
+    def save(self, path: str = SCORER_FILE) -> None:
+        save_arrays(path, {"hashes": self.hashes, "weights": self.weights}, self.metadata())
+
+    def tokenize(self, text: str) -> List[str]:
+        """Same tokens the CountVectorizer analyzer would produce"""
+        if self.lowercase:
+            text = text.lower()
+        return self._token_re.findall(text)
+
+    def _match(self, tokens: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Table positions of the tokens and a mask of which ones are in the vocabulary"""
+        keys = np.fromiter((token_hash(t) for t in tokens), dtype=np.uint64, count=len(tokens))
+        idx = np.searchsorted(self.hashes, keys)
+        idx[idx == len(self.hashes)] = 0
+        return idx, self.hashes[idx] == keys
+
+    def _weights(self, tokens: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Mask of the in-vocabulary tokens and their weights"""
+        idx, hit = self._match(tokens)
+        return hit, self.weights[idx[hit]]
+
+    def _lookup(self, tokens: Sequence[str]) -> np.ndarray:
+        """Weights of the in-vocabulary tokens, out-of-vocabulary tokens are dropped"""
+        return self._weights(tokens)[1]
+
+    def vectorize_batch(self, texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Row index and weight of every in-vocabulary token of a batch of processed messages"""
+        rows = []
+        tokens = []
+        for row, text in enumerate(texts):
+            row_tokens = self.tokenize(text)
+            tokens.extend(row_tokens)
+            rows.extend([row] * len(row_tokens))
+        if not tokens:
+            return np.zeros(0, dtype=np.intp), np.zeros(0)
+        hit, weights = self._weights(tokens)
+        return np.asarray(rows, dtype=np.intp)[hit], weights
+
+    def predict_batch(self, rows: np.ndarray, weights: np.ndarray, n_texts: int) -> np.ndarray:
+        """
+        Spam probabilities from vectorize_batch output. The weights are summed
+        per row with np.bincount, the equivalent of one sparse matrix-vector product.
+        """
+        logits = self.bias + np.bincount(rows, weights=weights, minlength=n_texts)
+        return 0.5 * (1.0 + np.tanh(0.5 * logits))
+
+    def score_batch(self, texts: Sequence[str]) -> np.ndarray:
+        """Spam probabilities for a batch of processed messages, hashed and looked up in one pass"""
+        rows, weights = self.vectorize_batch(texts)
+        return self.predict_batch(rows, weights, len(texts))
+
+    @staticmethod
+    def _sigmoid(logit: float) -> float:
+        if logit >= 0:
+            return 1.0 / (1.0 + math.exp(-logit))
+        z = math.exp(logit)
+        return z / (1.0 + z)
+
+    def vectorize(self, text: str) -> np.ndarray:
+        """Weights of the in-vocabulary tokens of a processed message"""
+        tokens = self.tokenize(text)
+        if not tokens:
+            return np.zeros(0)
+        return self._lookup(tokens)
+
+    def predict(self, weights: np.ndarray) -> float:
+        return self._sigmoid(self.bias + float(weights.sum()))
+
+    def score(self, text: str) -> float:
+        """Spam probability of a processed message, equal to clf.predict_proba(...)[0][1]"""
+        return self.predict(self.vectorize(text))
+
+
+class HashedScorer(LookupScorer):
+    def __init__(self, weights: np.ndarray, bias: float, token_pattern: str, lowercase: bool = True,
+                 version: str = "", calibration: Optional[Dict[str, Any]] = None,
+                 ngram_range: Tuple[int, int] = (1, 1), alternate_sign: bool = False):
+        super().__init__(np.zeros(0, dtype=np.uint64), weights, bias, token_pattern, lowercase, version)
+        self.n_features = len(weights)
+        self.calibration = calibration
+        self.ngram_range = (int(ngram_range[0]), int(ngram_range[1]))
+        self.alternate_sign = bool(alternate_sign)
+
+    @classmethod
+    def from_model(cls, hv, clf, calibration: Optional[Dict[str, Any]] = None) -> "HashedScorer":
+        """Compile the table from a HashingVectorizer and a MultinomialNB or linear model fitted on its output"""
+        if len(clf.classes_) != 2:
+            raise ValueError(f"Expected a binary classifier, got classes {list(clf.classes_)}")
+        if (hv.analyzer != "word" or hv.tokenizer is not None or hv.preprocessor is not None
+                or hv.stop_words is not None or hv.strip_accents is not None or hv.binary or hv.norm is not None):
+            raise ValueError("Only plain word count HashingVectorizers can be compiled")
+        if hasattr(clf, "feature_log_prob_"):
+            weights = clf.feature_log_prob_[1] - clf.feature_log_prob_[0]
+            bias = clf.class_log_prior_[1] - clf.class_log_prior_[0]
+        else:
+            weights = clf.coef_[0]
+            bias = clf.intercept_[0]
+        return cls(np.ascontiguousarray(weights, dtype=np.float64), bias, hv.token_pattern, hv.lowercase,
+                   calibration=calibration, ngram_range=hv.ngram_range, alternate_sign=hv.alternate_sign)
+
+    @classmethod
+    def from_artifact(cls, arrays: Dict[str, np.ndarray], metadata: Dict[str, Any]) -> "HashedScorer":
+        return cls(arrays["weights"], metadata["bias"], metadata["token_pattern"], metadata["lowercase"],
+                   metadata["version"], metadata.get("calibration"), metadata.get("ngram_range", (1, 1)),
+                   metadata.get("alternate_sign", False))
+
+    def metadata(self) -> Dict[str, Any]:
+        return {"kind": "hashed", "bias": self.bias, "token_pattern": self.token_pattern,
+                "lowercase": self.lowercase, "version": self.version, "calibration": self.calibration,
+                "ngram_range": list(self.ngram_range), "alternate_sign": self.alternate_sign}
+
+    def save(self, path: str) -> None:
+        """Written to a temporary file and renamed into place, so readers never see a partial file"""
+        save_arrays(path, {"weights": self.weights}, self.metadata())
+
+    def tokenize(self, text: str) -> List[str]:
+        """The tokens followed by their word n-grams, as HashingVectorizer's analyzer builds them"""
+        tokens = super().tokenize(text)
+        min_n, max_n = self.ngram_range
+        if max_n == 1:
+            return tokens
+        grams = list(tokens) if min_n == 1 else []
+        for n in range(max(min_n, 2), min(max_n, len(tokens)) + 1):
+            grams.extend(" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+        return grams
+
+    def _weights(self, tokens: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Same buckets and signs HashingVectorizer assigns, every token has one"""
+        hashes = np.fromiter((murmurhash3_32(t, seed=0) for t in tokens), dtype=np.int64, count=len(tokens))
+        weights = self.weights[np.abs(hashes) % self.n_features]
+        if self.alternate_sign:
+            weights = np.where(hashes < 0, -weights, weights)
+        return np.ones(len(tokens), dtype=bool), weights
+
+
+def load_scorer(path: str) -> LookupScorer:
+    """LookupScorer or HashedScorer, whichever the file holds"""
+    arrays, metadata = load_arrays(path)
+    scorer_class = HashedScorer if metadata.get("kind") == "hashed" else LookupScorer
+    return scorer_class.from_artifact(arrays, metadata)
+
+
+def load_model_files(model_dir: str = ".") -> Tuple[Optional[LookupScorer], Any, Any]:
+    """
+    The model dataprep.py wrote to model_dir, as (scorer, clf, cv): its
+    scorer.bin when there is one, else the pickled classifier and vectorizer.
+    server.py loads its built-in model with it, as do offline tools.
+    """
+    path = os.path.join(model_dir, SCORER_FILE)
+    if os.path.exists(path):
+        return load_scorer(path), None, None
+    return None, joblib.load(os.path.join(model_dir, "model.pkl")), joblib.load(os.path.join(model_dir, "cv.pkl"))
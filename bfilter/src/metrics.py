@@ -0,0 +1,353 @@
+"""
+Low-overhead Prometheus counters and histograms shared across gunicorn workers.
+
+All metrics are declared up front, which fixes a flat layout of float64
+slots. Each process writes its slots into its own file in METRICS_DIR
+(or an anonymous mapping when no directory is configured), and every thread
+gets its own row of that file, so recording a value is a plain in-place add
+with no lock and no cross-process coordination. /metrics sums the rows of
+every file in the directory, so counts survive worker restarts
+(--max-requests) and add up across workers.
+
+A worker opening its file first folds the files of processes that have
+exited into one aggregate row ({prefix}-exited.db) and deletes them, so the
+directory holds one file per live worker plus the aggregate, however often
+workers are recycled. Folding and reading the directory are serialized by
+an flock on {prefix}.lock, so a scrape never counts a file twice.
+
+Threads beyond the number of rows share a last row guarded by a lock.
+METRICS_DIR must be empty when the service starts.
+
+bfilter/src holds the copy to edit; shared_modules.py at the repository
+root copies it into sfilter/src and checks that the copies match.
+"""
+
+import abc
+import bisect
+import contextlib
+import fcntl
+import glob
+import mmap
+import os
+import threading
+import weakref
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+SLOT_BYTES = 8
+DEFAULT_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Shard:
+    """A thread's row in the process file, handed back when the thread exits"""
+    def __init__(self, base: int, lock: Optional[threading.Lock]):
+        self.base = base
+        self.lock = lock
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class CounterChild:
+    def __init__(self, registry: "MetricsRegistry", slot: int):
+        self.registry = registry
+        self.slot = slot
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.registry.add(self.slot, amount)
+
+
+class HistogramChild:
+    def __init__(self, registry: "MetricsRegistry", slot: int, buckets: Sequence[float]):
+        self.registry = registry
+        self.slot = slot
+        self.buckets = buckets
+        # Slots: one per bucket plus +Inf, then sum, then count
+        self.sum_slot = slot + len(buckets) + 1
+        self.count_slot = self.sum_slot + 1
+
+    def observe(self, value: float) -> None:
+        self.registry.observe(self.slot + bisect.bisect_left(self.buckets, value), self.sum_slot, self.count_slot, value)
+
+
+class Metric(abc.ABC):
+    kind = ""
+    slots_per_child = 1
+
+    def __init__(self, registry: "MetricsRegistry", name: str, documentation: str,
+                 labelnames: Sequence[str], label_values: Sequence[Tuple[str, ...]]):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children: Dict[Tuple[str, ...], object] = {}
+        for values in (label_values or [()]):
+            self.children[tuple(values)] = self._make_child(registry.allocate(self.slots_per_child))
+
+    @abc.abstractmethod
+    def _make_child(self, slot: int):
+        """The child recording into the slots allocated from slot on"""
+
+    def labels(self, *values: str):
+        return self.children[tuple(values)]
+
+    @abc.abstractmethod
+    def render(self, totals: np.ndarray) -> List[str]:
+        """Exposition lines of the metric, from the summed slots of every process"""
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _make_child(self, slot: int) -> CounterChild:
+        return CounterChild(self.registry, slot)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.children[()].inc(amount)
+
+    def value(self, totals: np.ndarray, *values: str) -> float:
+        return float(totals[self.children[tuple(values)].slot])
+
+    def render(self, totals: np.ndarray) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {totals[child.slot]:g}"
+                for values, child in self.children.items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, registry: "MetricsRegistry", name: str, documentation: str,
+                 labelnames: Sequence[str], label_values: Sequence[Tuple[str, ...]],
+                 buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.slots_per_child = len(self.buckets) + 3
+        super().__init__(registry, name, documentation, labelnames, label_values)
+
+    def _make_child(self, slot: int) -> HistogramChild:
+        return HistogramChild(self.registry, slot, self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.children[()].observe(value)
+
+    def sum_and_count(self, totals: np.ndarray, *values: str) -> Tuple[float, float]:
+        child = self.children[tuple(values)]
+        return float(totals[child.sum_slot]), float(totals[child.count_slot])
+
+    def render(self, totals: np.ndarray) -> List[str]:
+        lines = []
+        for values, child in self.children.items():
+            cumulative = np.cumsum(totals[child.slot:child.sum_slot])
+            bounds = [f"{bound:g}" for bound in self.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, cumulative):
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {count:g}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {totals[child.sum_slot]:.6f}")
+            lines.append(f"{self.name}_count{labels} {totals[child.count_slot]:g}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self, directory: Optional[str] = None, prefix: str = "metrics", shards: int = 64):
+        self.directory = directory
+        self.prefix = prefix
+        self.shards = shards
+        self.metrics: List[Metric] = []
+        self.size = 0
+        self._pid: Optional[int] = None
+        self._map: Optional[mmap.mmap] = None
+        self._view: Optional[memoryview] = None
+        self._free: List[int] = []
+        self._local = threading.local()
+        self._open_lock = threading.Lock()
+        self._overflow_lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def allocate(self, slots: int) -> int:
+        if self._map is not None:
+            raise RuntimeError("Metrics must be declared before the first value is recorded")
+        start = self.size
+        self.size += slots
+        return start
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                label_values: Sequence[Tuple[str, ...]] = ()) -> Counter:
+        metric = Counter(self, name, documentation, labelnames, label_values)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  label_values: Sequence[Tuple[str, ...]] = (),
+                  buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(self, name, documentation, labelnames, label_values, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"{self.prefix}-{pid}.db")
+
+    def _exited_path(self) -> str:
+        return os.path.join(self.directory, f"{self.prefix}-exited.db")
+
+    @contextlib.contextmanager
+    def _locked(self, operation: int) -> Iterator[None]:
+        with open(os.path.join(self.directory, f"{self.prefix}.lock"), "a") as f:
+            fcntl.flock(f, operation)
+            yield
+
+    def _process_files(self) -> Dict[int, str]:
+        files = {}
+        for path in glob.glob(os.path.join(self.directory, f"{self.prefix}-*.db")):
+            pid = os.path.basename(path)[len(self.prefix) + 1:-len(".db")]
+            if pid.isdigit():
+                files[int(pid)] = path
+        return files
+
+    def _read_rows(self, path: str) -> Optional[np.ndarray]:
+        """A process file summed over its rows, None when it is missing or not of the current layout"""
+        try:
+            if os.path.getsize(path) != self.shards * self.size * SLOT_BYTES:
+                return None
+            return np.fromfile(path, dtype=np.float64).reshape(self.shards, self.size).sum(axis=0)
+        except OSError:
+            return None
+
+    def _read_exited(self) -> np.ndarray:
+        try:
+            exited = np.fromfile(self._exited_path(), dtype=np.float64)
+        except OSError:
+            return np.zeros(self.size)
+        return exited if len(exited) == self.size else np.zeros(self.size)
+
+    def _fold_exited(self) -> None:
+        """Adds the files of processes that have exited to the aggregate and deletes them"""
+        pid = os.getpid()
+        # A file under this pid is left by an earlier process the pid was reused from
+        exited = [path for file_pid, path in self._process_files().items() if file_pid == pid or not _alive(file_pid)]
+        if not exited:
+            return
+        totals = self._read_exited()
+        for path in exited:
+            rows = self._read_rows(path)
+            if rows is not None:
+                totals += rows
+        temporary = f"{self._exited_path()}.{pid}"
+        totals.tofile(temporary)
+        os.replace(temporary, self._exited_path())
+        for path in exited:
+            os.unlink(path)
+
+    def _after_fork(self) -> None:
+        # Forked workers must not write into the parent's rows, they open their own file on first use
+        self._map = None
+        self._view = None
+        self._pid = None
+        self._free = []
+        self._local = threading.local()
+        self._open_lock = threading.Lock()
+        self._overflow_lock = threading.Lock()
+
+    def _open(self) -> None:
+        with self._open_lock:
+            if self._map is not None:
+                return
+            pid = os.getpid()
+            nbytes = self.shards * self.size * SLOT_BYTES
+            if self.directory:
+                os.makedirs(self.directory, exist_ok=True)
+                with self._locked(fcntl.LOCK_EX):
+                    self._fold_exited()
+                    with open(self._path(pid), "w+b") as f:
+                        f.truncate(nbytes)
+                        self._map = mmap.mmap(f.fileno(), nbytes)
+            else:
+                self._map = mmap.mmap(-1, nbytes)
+            self._view = memoryview(self._map).cast("d")
+            self._free = list(range(self.shards - 2, -1, -1))
+            self._pid = pid
+
+    def _release(self, pid: int, shard: int) -> None:
+        if pid == self._pid:
+            self._free.append(shard)
+
+    def _shard(self) -> _Shard:
+        try:
+            return self._local.shard
+        except AttributeError:
+            return self._new_shard()
+
+    def _new_shard(self) -> _Shard:
+        if self._map is None:
+            self._open()
+        pid = self._pid
+        try:
+            index = self._free.pop()
+            shard = _Shard(index * self.size, None)
+            weakref.finalize(shard, self._release, pid, index)
+        except IndexError:
+            shard = _Shard((self.shards - 1) * self.size, self._overflow_lock)
+        self._local.shard = shard
+        return shard
+
+    def add(self, slot: int, amount: float) -> None:
+        shard = self._shard()
+        if shard.lock is None:
+            self._view[shard.base + slot] += amount
+        else:
+            with shard.lock:
+                self._view[shard.base + slot] += amount
+
+    def observe(self, bucket_slot: int, sum_slot: int, count_slot: int, value: float) -> None:
+        shard = self._shard()
+        view = self._view
+        base = shard.base
+        if shard.lock is None:
+            view[base + bucket_slot] += 1.0
+            view[base + sum_slot] += value
+            view[base + count_slot] += 1.0
+        else:
+            with shard.lock:
+                view[base + bucket_slot] += 1.0
+                view[base + sum_slot] += value
+                view[base + count_slot] += 1.0
+
+    def totals(self) -> np.ndarray:
+        """Every slot summed over all threads of all processes"""
+        if self._map is None:
+            self._open()
+        if not self.directory:
+            return np.frombuffer(self._map, dtype=np.float64).reshape(self.shards, self.size).sum(axis=0)
+        with self._locked(fcntl.LOCK_SH):
+            totals = self._read_exited()
+            for path in self._process_files().values():
+                rows = self._read_rows(path)
+                if rows is not None:
+                    totals += rows
+        return totals
+
+    def render(self, totals: Optional[np.ndarray] = None) -> str:
+        """Prometheus text exposition of every declared metric"""
+        if totals is None:
+            totals = self.totals()
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render(totals))
+            lines.append("")
+        return "\n".join(lines)
@@ -0,0 +1,28 @@
+"""
+Text normalization shared by training and serving.
+
+dataprep.py and online_train.py train on normalize(text), and server.py
+scores normalize(message), so the model is asked about exactly the
+features it learned. A normalized text is the message stripped and
+lowercased, split into words on single spaces, with the words of fewer
+than two characters (including the empty ones between repeated spaces)
+dropped and the rest joined by single spaces. A message with no word left
+normalizes to "". The server does not consult the model about it and
+always escalates it to sfilter (cascade.UNSCORED).
+
+The two sides used to differ. Training removed one-character words while
+iterating over the same list, which skipped the word after each one
+removed, and appended the reversed text, fusing the last word and its
+mirror image into one token. The reversed half only ever added tokens that
+no message contains, about half of the vocabulary. Serving also called
+replace("aeiou0123456789", ""), which only removes that literal string.
+
+Lists of messages are normalized one message at a time. The per-message
+split/filter/join already runs in C; regex findall, a single lower() over
+the joined batch and a search for messages that need no filtering all
+measured slower on the corpus (see benchmarks/bench_normalize.py).
+"""
+
+
+def normalize(text: str) -> str:
+    return " ".join([word for word in text.strip().lower().split(" ") if len(word) > 1])
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Incremental training for the bfilter model, without a full retrain or an
+image rebuild.
+
+The online model is a MultinomialNB on a fixed HashingVectorizer feature
+space. partial_fit only adds the token and class counts of the new messages
+to the ones already learned, so folding a batch in gives the same model as
+retraining on everything seen so far, and the feature space never changes
+shape. dataprep.py can also build it with word n-grams, signed hashing and
+a logistic regression trained by SGD (MODELS), whose partial_fit takes
+gradient steps on the new messages instead; the choice is stored in the
+state and kept by every update. dataprep.py fits the initial state on jailbreaks.csv, calibrates
+its cascade thresholds out-of-fold and bakes both into the image as
+online_state.pkl. The thresholds travel with every scorer published from
+it.
+
+Each run loads the latest state, folds in newly labelled messages and
+writes both the state and a compiled HashedScorer into --model-dir
+(BFILTER_MODEL_DIR, /storage/models by default). Both files are written to
+a temporary name and renamed into place. Running bfilter workers watch the
+scorer file and swap it in between requests (see model_watcher.py).
+
+Labelled messages come from:
+- --subscription: a Pub/Sub subscription on the secondary-filter topic.
+  Events are {"message": ..., "label": ...}, and events without a label are
+  dropped. Messages are acked only once the updated model has been
+  written, so a failed run gets them again.
+- --file: a CSV with the class,text columns of jailbreaks.csv.
+
+The topic only carries sfilter rejections, so folding the events in alone
+would only ever add spam, drifting the class prior and the token counts.
+Each batch is brought back to the class mix of --replay, a labelled CSV
+(the training set), with messages of the missing class drawn from it.
+
+The thresholds calibrated by dataprep.py no longer fit once the model has
+moved, so before every publish they are recalibrated on --calibration, a
+labelled CSV held out from training, at the state's target error rates.
+Without it nothing is published.
+
+    python online_train.py --subscription projects/p/subscriptions/secondary-filter-train \
+        --replay jailbreaks.csv --calibration holdout.csv --follow
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+from sklearn.naive_bayes import MultinomialNB
+
+from cascade import calibrate_thresholds
+from lookup_scorer import ONLINE_SCORER_FILE, HashedScorer
+from normalize import normalize
+
+CLASSES = np.array(["ham", "spam"])
+HASH_FEATURES = 2 ** 20
+# Laplace smoothing is spread over every bucket of the hashed space, so the
+# default alpha=1 flattens the scores; on jailbreaks.csv 0.02 offloads 43% of
+# benign messages at the 1% cascade targets, against 14% with alpha=1
+ALPHA = 0.02
+# L2 penalty of the linear model, on a held-out fifth of jailbreaks.csv the
+# AUC with 2^18 signed unigram+bigram buckets is 0.983, against 0.969 at 1e-5
+LINEAR_ALPHA = 1e-4
+MODELS = ("nb", "linear")
+STATE_FILE = "online_state.pkl"
+DEFAULT_MODEL_DIR = "/storage/models"
+
+
+def hashed_classifier(model: str, alternate_sign: bool = False):
+    if model not in MODELS:
+        raise ValueError(f"Unknown model {model!r}, expected one of {', '.join(MODELS)}")
+    if model == "linear":
+        return SGDClassifier(loss="log_loss", alpha=LINEAR_ALPHA, random_state=0)
+    if alternate_sign:
+        raise ValueError("MultinomialNB needs non-negative counts, signed hashing requires the linear model")
+    return MultinomialNB(alpha=ALPHA)
+
+
+class OnlineTrainer:
+    def __init__(self, n_features: int = HASH_FEATURES, clf: Any = None,
+                 calibration: Optional[Dict[str, Any]] = None, ngram_range: Tuple[int, int] = (1, 1),
+                 alternate_sign: bool = False, model: str = "nb", n_samples: int = 0):
+        self.vectorizer = HashingVectorizer(n_features=n_features, ngram_range=tuple(ngram_range),
+                                            alternate_sign=alternate_sign, norm=None)
+        self.clf = clf if clf is not None else hashed_classifier(model, alternate_sign)
+        self.calibration = calibration
+        self._n_samples = n_samples
+
+    @property
+    def model(self) -> str:
+        return "nb" if isinstance(self.clf, MultinomialNB) else "linear"
+
+    @property
+    def n_samples(self) -> int:
+        if isinstance(self.clf, MultinomialNB):
+            return int(self.clf.class_count_.sum()) if hasattr(self.clf, "class_count_") else 0
+        return self._n_samples
+
+    def partial_fit(self, texts: Sequence[str], labels: Sequence[str]) -> None:
+        """Folds already processed texts and their ham/spam labels into the model"""
+        if len(texts):
+            self.partial_fit_features(self.vectorizer.transform(texts), labels)
+
+    def partial_fit_features(self, features, labels: Sequence[str]) -> None:
+        """partial_fit for texts already hashed by self.vectorizer"""
+        if features.shape[0]:
+            self.clf.partial_fit(features, np.asarray(labels), classes=CLASSES)
+            self._n_samples += features.shape[0]
+
+    def scorer(self) -> HashedScorer:
+        return HashedScorer.from_model(self.vectorizer, self.clf, self.calibration)
+
+    @classmethod
+    def load(cls, path: str) -> "OnlineTrainer":
+        state = joblib.load(path)
+        return cls(state["n_features"], state["clf"], state.get("calibration"), state.get("ngram_range", (1, 1)),
+                   state.get("alternate_sign", False), n_samples=state.get("n_samples", 0))
+
+    def save(self, path: str) -> None:
+        tmp_path = f"{path}.tmp"
+        # The count matrices are mostly zeros
+        joblib.dump({"n_features": self.vectorizer.n_features, "clf": self.clf, "calibration": self.calibration,
+                     "ngram_range": self.vectorizer.ngram_range, "alternate_sign": self.vectorizer.alternate_sign,
+                     "n_samples": self.n_samples}, tmp_path, compress=3)
+        os.replace(tmp_path, path)
+
+
+def parse_event(data: bytes) -> Optional[Tuple[str, str]]:
+    """(processed text, label) of a secondary-filter event, None if it carries nothing to learn"""
+    try:
+        event = json.loads(data)
+    except ValueError:
+        return None
+    message = event.get("message") if isinstance(event, dict) else None
+    label = event.get("label") if isinstance(event, dict) else None
+    if not isinstance(message, str) or not message.strip() or label not in CLASSES:
+        return None
+    return normalize(message.strip()), label
+
+
+def pull_events(subscriber, subscription: str, max_messages: int) -> Tuple[List[str], List[str], List[str]]:
+    """Texts, labels and ack ids of up to max_messages pending events"""
+    response = subscriber.pull(request={"subscription": subscription, "max_messages": max_messages},
+                               timeout=30)
+    texts, labels, ack_ids = [], [], []
+    for received in response.received_messages:
+        ack_ids.append(received.ack_id)
+        parsed = parse_event(received.message.data)
+        if parsed is not None:
+            texts.append(parsed[0])
+            labels.append(parsed[1])
+    return texts, labels, ack_ids
+
+
+def load_file(path: str) -> Tuple[List[str], List[str]]:
+    df = pd.read_csv(path)
+    df["class"] = df["class"].str.strip()
+    df = df[df["class"].isin(CLASSES)]
+    return [normalize(text) for text in df["text"].astype(str)], df["class"].tolist()
+
+
+def replay_balance(labels: Sequence[str], replay: Tuple[List[str], List[str]],
+                   rng: np.random.Generator) -> Tuple[List[str], List[str]]:
+    """Replayed texts and labels that bring a batch to the class mix of the replay set"""
+    replay_texts, replay_labels = np.array(replay[0], dtype=object), np.array(replay[1])
+    spam_share = float(np.mean(replay_labels == "spam"))
+    spam = sum(label == "spam" for label in labels)
+    ham = len(labels) - spam
+    # Only ever adds messages, of whichever class is short of the replay share
+    if spam > spam_share * (spam + ham):
+        missing, needed = "ham", int(round(spam / spam_share)) - spam - ham
+    else:
+        missing, needed = "spam", int(round((spam_share * ham - (1 - spam_share) * spam) / (1 - spam_share)))
+    pool = np.flatnonzero(replay_labels == missing)
+    if needed <= 0 or not len(pool):
+        return [], []
+    drawn = rng.choice(pool, size=needed, replace=needed > len(pool))
+    return replay_texts[drawn].tolist(), [missing] * needed
+
+
+def recalibrate(trainer: OnlineTrainer, calibration_set: Tuple[List[str], List[str]]) -> Dict[str, Any]:
+    """Thresholds of the current model on the held-out set, at the targets of the previous ones"""
+    texts, labels = calibration_set
+    previous = trainer.calibration or {}
+    # Messages with nothing left after normalizing are escalated whatever the thresholds
+    scored = np.array([bool(text) for text in texts], dtype=bool)
+    scores = trainer.scorer().score_batch([text for text in texts if text])
+    is_spam = np.array(labels)[scored] == "spam"
+    return calibrate_thresholds(scores[is_spam], scores[~is_spam],
+                                target_fnr=previous.get("target_fnr", float(os.getenv("CASCADE_TARGET_FNR", "0.01"))),
+                                target_fpr=previous.get("target_fpr", float(os.getenv("CASCADE_TARGET_FPR", "0.01"))))
+
+
+def publish(trainer: OnlineTrainer, model_dir: str, calibration_set: Tuple[List[str], List[str]]) -> HashedScorer:
+    """Recalibrates the thresholds, then saves the state and the scorer the servers pick up"""
+    trainer.calibration = recalibrate(trainer, calibration_set)
+    os.makedirs(model_dir, exist_ok=True)
+    trainer.save(os.path.join(model_dir, STATE_FILE))
+    scorer = trainer.scorer()
+    scorer.save(os.path.join(model_dir, ONLINE_SCORER_FILE))
+    return scorer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fold newly labelled messages into the bfilter model")
+    parser.add_argument("--model-dir", default=os.getenv("BFILTER_MODEL_DIR", DEFAULT_MODEL_DIR))
+    parser.add_argument("--base-state", default=STATE_FILE,
+                        help="State to start from when --model-dir has none yet")
+    parser.add_argument("--subscription", help="Pub/Sub subscription to pull labelled events from")
+    parser.add_argument("--file", help="CSV of labelled messages (class,text)")
+    parser.add_argument("--replay", help="Labelled CSV (class,text) to balance the classes of each batch from, "
+                                         "required with --subscription")
+    parser.add_argument("--calibration", required=True,
+                        help="Labelled CSV (class,text) held out from training, to recalibrate the thresholds on")
+    parser.add_argument("--max-messages", type=int, default=1000, help="Events per pull")
+    parser.add_argument("--follow", action="store_true", help="Keep pulling instead of stopping when idle")
+    parser.add_argument("--interval", type=float, default=60.0, help="Seconds between pulls when idle")
+    args = parser.parse_args()
+    if not args.subscription and not args.file:
+        parser.error("Nothing to train on, pass --subscription and/or --file")
+    if args.subscription and not args.replay:
+        parser.error("Subscription events are sfilter rejections, pass --replay to balance them")
+    calibration_set = load_file(args.calibration)
+    replay = load_file(args.replay) if args.replay else None
+    for path, labelled in ((args.calibration, calibration_set), (args.replay, replay)):
+        if labelled is not None and set(labelled[1]) != set(CLASSES):
+            parser.error(f"{path} needs both ham and spam messages")
+
+    state_path = os.path.join(args.model_dir, STATE_FILE)
+    trainer = OnlineTrainer.load(state_path if os.path.exists(state_path) else args.base_state)
+    print(f"Starting from {trainer.n_samples} messages")
+
+    if args.file:
+        texts, labels = load_file(args.file)
+        trainer.partial_fit(texts, labels)
+        scorer = publish(trainer, args.model_dir, calibration_set)
+        print(f"Folded in {len(texts)} messages from {args.file}, model {scorer.version}, "
+              f"thresholds {trainer.calibration}")
+
+    if args.subscription:
+        from google.cloud import pubsub_v1
+        subscriber = pubsub_v1.SubscriberClient()
+        rng = np.random.default_rng()
+        while True:
+            texts, labels, ack_ids = pull_events(subscriber, args.subscription, args.max_messages)
+            if texts:
+                replay_texts, replay_labels = replay_balance(labels, replay, rng)
+                trainer.partial_fit(texts + replay_texts, labels + replay_labels)
+                scorer = publish(trainer, args.model_dir, calibration_set)
+                print(f"Folded in {len(texts)} events and {len(replay_texts)} replayed messages "
+                      f"({trainer.n_samples} total), model {scorer.version}, thresholds {trainer.calibration}")
+            if ack_ids:
+                subscriber.acknowledge(request={"subscription": args.subscription, "ack_ids": ack_ids})
+            elif args.follow:
+                time.sleep(args.interval)
+            else:
+                break
+
+
+if __name__ == "__main__":
+    main()
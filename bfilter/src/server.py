@@ -28,6 +28,10 @@ def retry_with_backoff(max_retries: int = 3, base_delay: float = 1.0, max_delay:
                 try:
                     return func(*args, **kwargs)
                 except requests.exceptions.RequestException as e:
+                    # 4xx answers are verdicts (sfilter's 401 is a rejection), not failures worth retrying
+                    if isinstance(e, requests.exceptions.HTTPError) and e.response is not None \
+                            and e.response.status_code < 500:
+                        raise e
                     if attempt == max_retries:
                         structured_logger.error(
                             "Max retry attempts reached",
@@ -51,128 +55,293 @@ def retry_with_backoff(max_retries: int = 3, base_delay: float = 1.0, max_delay:
 
 
 import json
-import joblib
-from flask import Flask, request, render_template_string, Response
+import numpy as np
+from scipy import sparse
+from lookup_scorer import LookupScorer, ONLINE_SCORER_FILE, load_model_files
+from model_watcher import ScorerWatcher
+from cache import LRUCache
+from shared_cache import PublishedVersion, create_backend, verdict_key
+from service_client import ServiceClient
+from event_publisher import EventPublisher
+from metrics import MetricsRegistry
+from structured_logging import configure
+from normalize import normalize
+from cascade import (CASCADE_FILE, UNSCORED, ZONE_BLOCK, ZONE_ESCALATE, ZONE_PASS, apply_score_calibration,
+                     load_thresholds, zone)
+from flask import Flask, g, request, render_template_string, Response
 import os
 import requests
-from google.auth.transport import requests as auth_requests
-from google.oauth2 import id_token as google_id_token
-from google.cloud import pubsub_v1
 import hashlib
 import time
-import logging
 import sys
 import gc
-from datetime import datetime
-from collections import defaultdict
 from enum import Enum
-from typing import Optional, Dict, Any, Callable, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Dict, Any, Callable, List, NamedTuple, Tuple
 
 LLMSTUB_URL = os.getenv("LLMSTUB_URL")
 SFILTER_URL = os.getenv("SFILTER_URL")
 
 # Configurable parameters
-BFILTER_THRESHOLD = float(os.getenv("BFILTER_THRESHOLD", "0.9"))
+# Three-zone cascade: block at or above BFILTER_THRESHOLD, skip sfilter below
+# BFILTER_PASS_THRESHOLD, escalate in between. Defaults come from the
+# calibration dataprep.py writes to cascade.json, and are the thresholds of
+# the built-in model; a swapped in online model brings its own (ServingModel).
+cascade_calibration = load_thresholds(CASCADE_FILE) or {}
+BFILTER_THRESHOLD = float(os.getenv("BFILTER_THRESHOLD", cascade_calibration.get("block_threshold", 0.9)))
+BFILTER_PASS_THRESHOLD = float(os.getenv("BFILTER_PASS_THRESHOLD", cascade_calibration.get("pass_threshold", 0.0)))
+# Isotonic or Platt map from the built-in model's scores to probabilities,
+# written to cascade.json by threshold_sweep.py. Its thresholds are then
+# calibrated probabilities too. Swapped in online models are not remapped.
+SCORE_CALIBRATION = cascade_calibration.get("score_calibration")
 ENABLE_REQUEST_LOGGING = os.getenv("ENABLE_REQUEST_LOGGING", "false").lower() == "true"
 MAX_MESSAGE_LENGTH = int(os.getenv("MAX_MESSAGE_LENGTH", "10000"))
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "256"))
+# Incrementally trained scorer written by online_train.py, swapped in while
+# serving. Checked every MODEL_RELOAD_INTERVAL seconds, 0 disables it.
+BFILTER_MODEL_DIR = os.getenv("BFILTER_MODEL_DIR", "/storage/models")
+MODEL_RELOAD_INTERVAL = float(os.getenv("MODEL_RELOAD_INTERVAL", "30"))
 
-# Global model variables - loaded lazily
+# Global model variables, loaded by load_models() when the module is imported
 clf = None
 cv = None
 
+
+class ServingModel(NamedTuple):
+    """
+    The scorer serving requests with the thresholds its scores are zoned by.
+    Swapped with one assignment, and a request takes it once, so it never
+    scores with one model and zones with another's thresholds.
+    """
+    # Compiled token lookup table, None when serving clf/cv. scorer.bin holds the
+    # vocabulary table or, when dataprep.py was run with --features hashed, a HashedScorer.
+    scorer: Optional[LookupScorer]
+    # Keys its cached scores, see builtin_model_version()
+    version: str
+    pass_threshold: float
+    block_threshold: float
+    # Applied to the built-in model's scores only
+    score_calibration: Optional[Dict[str, Any]]
+    # An online model swapped in by scorer_watcher
+    online: bool = False
+
+
+# The built-in model until an online one is swapped in, None until load_models()
+serving: Optional[ServingModel] = None
+# clf.feature_log_prob_ transposed to (n_features, n_classes) and made
+# C-contiguous once, so sparse @ dense products never copy it per request.
+# None for a linear clf, which goes through predict_proba.
+feature_log_prob_t = None
+# Seconds the last load_models() took, exported on /metrics
+model_load_seconds = None
+
 def load_models():
-    """Load models lazily to reduce memory footprint during startup"""
-    global clf, cv
-    if clf is None or cv is None:
+    """Loads the models once, a no-op when they already are"""
+    global clf, cv, feature_log_prob_t, serving, model_load_seconds
+    if not models_loaded():
         try:
-            structured_logger.info("Starting lazy model loading", stage="model_init")
-            
-            # Force garbage collection before loading
-            gc.collect()
+            structured_logger.info("Loading models", stage="model_init")
+            start = time.perf_counter()
             
-            structured_logger.info("Loading Bayesian models")
-            clf = joblib.load("model.pkl")
-            cv = joblib.load("cv.pkl")
+            # scorer.bin, or model.pkl and cv.pkl when there is none
+            scorer, clf, cv = load_model_files()
+            serving = ServingModel(scorer, builtin_model_version(scorer), BFILTER_PASS_THRESHOLD, BFILTER_THRESHOLD,
+                                   SCORE_CALIBRATION)
+            if clf is not None and hasattr(clf, "feature_log_prob_"):
+                feature_log_prob_t = np.ascontiguousarray(clf.feature_log_prob_.T)
             
-            # Force garbage collection after loading
-            gc.collect()
+            # Start from the latest online model if one has been trained
+            try:
+                scorer_watcher.check()
+            except Exception as e:
+                structured_logger.error("Failed to load online model, serving the built-in one", error=str(e))
             
+            model_load_seconds = time.perf_counter() - start
             structured_logger.info("Models loaded successfully", 
+                                 load_seconds=model_load_seconds,
                                  clf_type=type(clf).__name__,
-                                 cv_type=type(cv).__name__)
+                                 cv_type=type(cv).__name__,
+                                 scorer_kind=serving.scorer.metadata()["kind"] if serving.scorer is not None else None,
+                                 scorer_weights=len(serving.scorer.weights) if serving.scorer is not None else 0,
+                                 scorer_version=serving.version, online=serving.online)
         except Exception as e:
             structured_logger.error("Failed to load models", error=str(e))
             raise e
 
 
-# Configure structured logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(message)s',
-    handlers=[logging.StreamHandler(sys.stdout)]
-)
+def builtin_model_version(builtin: Optional[LookupScorer]) -> str:
+    """
+    The built-in model's weights digest plus one of SCORE_CALIBRATION, which
+    changes its scores too, so a rebuilt image or a new threshold_sweep.py
+    calibration never reads scores cached by the previous deploy.
+    """
+    if builtin is not None:
+        version = builtin.version
+    else:
+        with open("model.pkl", "rb") as f:
+            version = f"pickle-{hashlib.blake2b(f.read(), digest_size=6).hexdigest()}"
+    calibration = hashlib.blake2b(json.dumps(SCORE_CALIBRATION, sort_keys=True).encode(), digest_size=6).hexdigest()
+    return f"{version}-{calibration}"
+
+
+def models_loaded() -> bool:
+    return serving is not None
+
 
-class StructuredLogger:
-    def __init__(self, name: str):
-        self.logger = logging.getLogger(name)
-        self.service_name = name
-    def _log(self, level: str, message: str, **kwargs) -> None:
-        log_entry = {
-            "timestamp": datetime.utcnow().isoformat(),
-            "level": level,
-            "service": self.service_name,
-            "message": message,
-            **kwargs
-        }
-        self.logger.info(json.dumps(log_entry))
-    def info(self, message: str, **kwargs) -> None:
-        self._log("INFO", message, **kwargs)
-    def error(self, message: str, **kwargs) -> None:
-        self._log("ERROR", message, **kwargs)
-    def warning(self, message: str, **kwargs) -> None:
-        self._log("WARNING", message, **kwargs)
-
-structured_logger = StructuredLogger("bfilter")
+# Structured JSON logs, written off the request path (see structured_logging.py).
+# Per-message events are sampled by default, LOG_SAMPLE_RATES overrides.
+structured_logger = configure("bfilter", sample_rates={
+    "Request duration": 0.01,
+    "BFilter score": 0.1,
+    "Cache hit": 0.1,
+    "Shared verdict cache hit": 0.1,
+})
 
 app = Flask(__name__)
 
-# Cache for processed messages to avoid reprocessing
-prediction_cache = {}
+# --- Instrumentation ---
+# Recorded on the hot path without locks, and summed across gunicorn workers
+# when METRICS_DIR points at a directory shared by them.
+metrics_registry = MetricsRegistry(os.getenv("METRICS_DIR"), prefix="bfilter")
+REQUESTS_TOTAL = metrics_registry.counter("bfilter_requests_total", "Total number of requests")
+REQUEST_ERRORS = metrics_registry.counter(
+    "bfilter_request_errors_total", "Responses with an error status",
+    ("status_class",), [("4xx",), ("5xx",)])
+REQUEST_LATENCY = metrics_registry.histogram("bfilter_request_duration_seconds", "End-to-end request latency")
+STAGE_LATENCY = metrics_registry.histogram(
+    "bfilter_stage_duration_seconds", "Latency of each stage of the request path",
+    ("stage",), [(stage,) for stage in ("preprocess", "vectorize", "predict", "sfilter", "sfilter_batch", "llmstub")])
+PREPROCESS_LATENCY = STAGE_LATENCY.labels("preprocess")
+VECTORIZE_LATENCY = STAGE_LATENCY.labels("vectorize")
+PREDICT_LATENCY = STAGE_LATENCY.labels("predict")
+SFILTER_LATENCY = STAGE_LATENCY.labels("sfilter")
+SFILTER_BATCH_LATENCY = STAGE_LATENCY.labels("sfilter_batch")
+LLMSTUB_LATENCY = STAGE_LATENCY.labels("llmstub")
+VERDICTS = metrics_registry.counter(
+    "bfilter_verdicts_total", "Classified messages by verdict",
+    ("verdict",), [("passed",), ("blocked",), ("blocked_secondary",)])
+CACHE_LOOKUPS = metrics_registry.counter(
+    "bfilter_cache_lookups_total", "Cache lookups by cache and outcome",
+    ("cache", "outcome"), [(cache, outcome) for cache in ("prediction", "shared_prediction", "verdict")
+                           for outcome in ("hit", "miss")])
+CASCADE_ZONES = metrics_registry.counter(
+    "bfilter_cascade_zone_total", "Scored messages by cascade zone, pass skips sfilter",
+    ("zone",), [(ZONE_BLOCK,), (ZONE_PASS,), (ZONE_ESCALATE,)])
+BREAKER_TRANSITIONS = metrics_registry.counter(
+    "bfilter_circuit_breaker_transitions_total", "Circuit breaker state changes",
+    ("breaker", "state"), [(breaker, state) for breaker in ("sfilter", "llmstub")
+                           for state in ("closed", "open", "half_open")])
+MODEL_SWAPS = metrics_registry.counter("bfilter_model_swaps_total", "Online models swapped in while serving")
+SPECULATIVE_CALLS = metrics_registry.counter(
+    "bfilter_speculative_llmstub_total", "Speculative llmstub calls by outcome, only used ones count as llmstub calls",
+    ("outcome",), [("used",), ("discarded",)])
 
+def record_request(duration: float, status_code: int) -> None:
+    REQUESTS_TOTAL.inc()
+    REQUEST_LATENCY.observe(duration)
+    if status_code >= 500:
+        REQUEST_ERRORS.labels("5xx").inc()
+    elif status_code >= 400:
+        REQUEST_ERRORS.labels("4xx").inc()
 
-def get_cached_prediction(message_hash: str) -> Optional[float]:
-    """Get cached prediction for a message hash"""
-    return prediction_cache.get(message_hash)
+# Cache for processed messages to avoid reprocessing. LRU bounded by entry
+# count and an estimated byte budget, with an optional TTL (0 disables it)
+prediction_cache = LRUCache(
+    max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "10000")),
+    max_bytes=int(os.getenv("CACHE_MAX_BYTES", str(4 * 1024 * 1024))),
+    ttl_seconds=float(os.getenv("CACHE_TTL_SECONDS", "0"))
+)
 
 
-def cache_prediction(message_hash: str, score: float) -> None:
-    """Cache a prediction result with aggressive memory management"""
-    # More aggressive cache cleanup to prevent memory issues
-    if len(prediction_cache) > 500:  # Reduced from 1000
-        keys = list(prediction_cache.keys())
-        # Remove 60% of cache when limit reached
-        for key in keys[:300]:  # Increased from 100
-            del prediction_cache[key]
-        structured_logger.info("Cache cleanup performed", 
-                             remaining_size=len(prediction_cache),
-                             removed_count=300)
-    prediction_cache[message_hash] = score
+# Cache shared across gunicorn workers and instances (disabled unless
+# SHARED_CACHE_URL is set). Holds bfilter scores and final sfilter verdicts.
+shared_cache = create_backend(os.getenv("SHARED_CACHE_URL"))
+SHARED_CACHE_TTL_SECONDS = float(os.getenv("SHARED_CACHE_TTL_SECONDS", "3600"))
+VERDICT_OK = "ok"
+VERDICT_JAILBREAK = "jailbreak"
+# Verdicts are keyed by the sfilter model version, which sfilter publishes in
+# the shared cache; until one is seen no verdict is looked up or stored
+sfilter_version = PublishedVersion(shared_cache)
+
+
+def prediction_key(message_hash: str, model: ServingModel) -> str:
+    """Cache key of a score, tied to the model version so a swap or a deploy never serves stale scores"""
+    return f"bfilter:{model.version}:{message_hash}"
+
+
+def get_cached_prediction(message_hash: str, model: ServingModel) -> Optional[float]:
+    """Get cached prediction for a message hash, local LRU first then the shared cache"""
+    key = prediction_key(message_hash, model)
+    score = prediction_cache.get(key)
+    if score is not None:
+        CACHE_LOOKUPS.labels("prediction", "hit").inc()
+        return score
+    CACHE_LOOKUPS.labels("prediction", "miss").inc()
+    shared = shared_cache.get(key)
+    if shared is None:
+        CACHE_LOOKUPS.labels("shared_prediction", "miss").inc()
+        return None
+    CACHE_LOOKUPS.labels("shared_prediction", "hit").inc()
+    score = float(shared)
+    prediction_cache.set(key, score)
+    return score
+
+
+def cache_prediction(message_hash: str, score: float, model: ServingModel) -> None:
+    """Cache a prediction result, evicting least recently used entries past the budget"""
+    key = prediction_key(message_hash, model)
+    prediction_cache.set(key, score)
+    shared_cache.set(key, repr(score).encode(), SHARED_CACHE_TTL_SECONDS)
+
+
+def get_cached_verdict(message_hash: str) -> Optional[str]:
+    """sfilter verdict for a message hash if any worker or instance has seen it"""
+    version = sfilter_version.current()
+    verdict = shared_cache.get(verdict_key(message_hash, version)) if version is not None else None
+    CACHE_LOOKUPS.labels("verdict", "miss" if verdict is None else "hit").inc()
+    return verdict.decode() if verdict is not None else None
+
+
+def cache_verdict(message_hash: str, verdict: str) -> None:
+    version = sfilter_version.current()
+    if version is not None:
+        shared_cache.set(verdict_key(message_hash, version), verdict.encode(), SHARED_CACHE_TTL_SECONDS)
+
+
+def swap_scorer(new_scorer: LookupScorer) -> None:
+    """Replaces the scorer and its thresholds for every request that starts from now on"""
+    global serving
+    calibration = getattr(new_scorer, "calibration", None) or {}
+    # Thresholds set explicitly in the environment always win
+    block_threshold = BFILTER_THRESHOLD if "BFILTER_THRESHOLD" in os.environ else \
+        float(calibration.get("block_threshold", BFILTER_THRESHOLD))
+    pass_threshold = BFILTER_PASS_THRESHOLD if "BFILTER_PASS_THRESHOLD" in os.environ else \
+        float(calibration.get("pass_threshold", BFILTER_PASS_THRESHOLD))
+    serving = ServingModel(new_scorer, new_scorer.version, pass_threshold, block_threshold, None, online=True)
+    prediction_cache.clear()
+    MODEL_SWAPS.inc()
+    structured_logger.info("Swapped in online model", version=new_scorer.version, path=scorer_watcher.path,
+                           pass_threshold=pass_threshold, block_threshold=block_threshold)
 
-# Performance tracking
-request_start_times = {}
 
+scorer_watcher = ScorerWatcher(
+    os.path.join(BFILTER_MODEL_DIR, ONLINE_SCORER_FILE), MODEL_RELOAD_INTERVAL, swap_scorer,
+    on_error=lambda e: structured_logger.error("Failed to swap in online model", error=str(e)))
 
+# Performance tracking
 @app.before_request
 def before_request() -> None:
-    request_start_times[request] = time.time()
+    g.request_start_time = time.perf_counter()
     app.request_count = getattr(app, 'request_count', 0) + 1
+    scorer_watcher.ensure_running()
 
 @app.after_request
 def after_request(response: Response) -> Response:
-    if request in request_start_times:
-        duration: float = time.time() - request_start_times[request]
+    start = g.get("request_start_time")
+    if start is not None:
+        duration: float = time.perf_counter() - start
+        record_request(duration, response.status_code)
         structured_logger.info("Request duration", duration=duration)
-        del request_start_times[request]
     return response
 
 HTML_TEMPLATE = """
@@ -231,15 +400,57 @@ HTML_TEMPLATE = """
 </html>
 """
 
-def process_text(text: str) -> str:
+def predict_spam_proba(features: sparse.csr_matrix) -> np.ndarray:
     """
-    Creates a new version of text processing, per the request.
-    This version filters out short words and corrects the iteration bug
-    from the original script. It does not include the text reversal logic.
+    Sparse equivalent of clf.predict_proba(features)[:, 1].
+    Multiplies the CSR rows against the pre-transposed log-probability
+    matrix so neither the features nor the model are densified or copied;
+    the work per row scales with its number of non-zero tokens.
     """
-    words = text.split(" ")
-    processed_words = [word for word in words if len(word) > 1]
-    return " ".join(processed_words)
+    if feature_log_prob_t is None:
+        return clf.predict_proba(features)[:, 1]
+    jll = features @ feature_log_prob_t + clf.class_log_prior_
+    jll -= jll.max(axis=1, keepdims=True)
+    proba = np.exp(jll)
+    proba /= proba.sum(axis=1, keepdims=True)
+    return proba[:, 1]
+
+
+def score_text(processed_message: str, model: Optional[ServingModel] = None) -> float:
+    """Returns the spam probability for an already processed message, by model or the one serving now"""
+    start = time.perf_counter()
+    model = model or serving
+    if model.scorer is not None:
+        weights = model.scorer.vectorize(processed_message)
+        vectorized = time.perf_counter()
+        score = model.scorer.predict(weights)
+    else:
+        features = cv.transform([processed_message])
+        vectorized = time.perf_counter()
+        score = float(predict_spam_proba(features)[0])
+    if model.score_calibration:
+        score = float(apply_score_calibration(np.array([score]), model.score_calibration)[0])
+    VECTORIZE_LATENCY.observe(vectorized - start)
+    PREDICT_LATENCY.observe(time.perf_counter() - vectorized)
+    return score
+
+
+def score_texts(processed_messages: List[str], model: ServingModel) -> np.ndarray:
+    """Returns spam probabilities for a batch of processed messages in one vectorized pass"""
+    start = time.perf_counter()
+    if model.scorer is not None:
+        rows, weights = model.scorer.vectorize_batch(processed_messages)
+        vectorized = time.perf_counter()
+        scores = model.scorer.predict_batch(rows, weights, len(processed_messages))
+    else:
+        features = cv.transform(processed_messages)
+        vectorized = time.perf_counter()
+        scores = predict_spam_proba(features)
+    if model.score_calibration:
+        scores = apply_score_calibration(scores, model.score_calibration)
+    VECTORIZE_LATENCY.observe(vectorized - start)
+    PREDICT_LATENCY.observe(time.perf_counter() - vectorized)
+    return scores
 
 
 # --- Circuit Breaker Implementation ---
@@ -249,54 +460,209 @@ class CircuitState(Enum):
     HALF_OPEN = "half_open"
 
 class CircuitBreaker:
-    def __init__(self, failure_threshold: int = 5, timeout: int = 60):
+    def __init__(self, failure_threshold: int = 5, timeout: int = 60, name: Optional[str] = None):
         self.failure_threshold = failure_threshold
         self.timeout = timeout
+        self.name = name
         self.failure_count = 0
         self.last_failure_time = None
         self.state = CircuitState.CLOSED
+    def _transition(self, state: CircuitState) -> None:
+        if state != self.state:
+            self.state = state
+            if self.name is not None:
+                BREAKER_TRANSITIONS.labels(self.name, state.value).inc()
     def call(self, func: Callable, *args, **kwargs) -> Any:
         if self.state == CircuitState.OPEN:
             if time.time() - self.last_failure_time > self.timeout:
-                self.state = CircuitState.HALF_OPEN
+                self._transition(CircuitState.HALF_OPEN)
             else:
                 raise Exception("Circuit breaker is OPEN")
         try:
             result = func(*args, **kwargs)
-            if self.state == CircuitState.HALF_OPEN:
-                self.state = CircuitState.CLOSED
-                self.failure_count = 0
-            return result
         except Exception as e:
-            self.failure_count += 1
-            self.last_failure_time = time.time()
-            if self.failure_count >= self.failure_threshold:
-                self.state = CircuitState.OPEN
+            self.record_failure()
             raise e
+        self.record_success()
+        return result
+    async def call_async(self, func: Callable, *args, **kwargs) -> Any:
+        """Same state machine as call() for coroutine functions"""
+        if self.state == CircuitState.OPEN:
+            if time.time() - self.last_failure_time > self.timeout:
+                self._transition(CircuitState.HALF_OPEN)
+            else:
+                raise Exception("Circuit breaker is OPEN")
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            self.record_failure()
+            raise e
+        self.record_success()
+        return result
+    def record_success(self) -> None:
+        """Outcome of a call made outside call(), such as a speculative one that was used"""
+        if self.state == CircuitState.HALF_OPEN:
+            self._transition(CircuitState.CLOSED)
+            self.failure_count = 0
+    def record_failure(self) -> None:
+        self.failure_count += 1
+        self.last_failure_time = time.time()
+        if self.failure_count >= self.failure_threshold:
+            self._transition(CircuitState.OPEN)
 
-sfilter_breaker = CircuitBreaker(failure_threshold=3, timeout=30)
-llmstub_breaker = CircuitBreaker(failure_threshold=3, timeout=30)
+sfilter_breaker = CircuitBreaker(failure_threshold=3, timeout=30, name="sfilter")
+llmstub_breaker = CircuitBreaker(failure_threshold=3, timeout=30, name="llmstub")
+
+# Pooled keep-alive sessions and cached identity tokens, one per target
+DOWNSTREAM_POOL_SIZE = int(os.getenv("DOWNSTREAM_POOL_SIZE", "10"))
+sfilter_client = ServiceClient(SFILTER_URL, pool_size=DOWNSTREAM_POOL_SIZE)
+llmstub_client = ServiceClient(LLMSTUB_URL, pool_size=DOWNSTREAM_POOL_SIZE)
 
 @retry_with_backoff(max_retries=3, base_delay=1.0)
-def make_authenticated_post_request(url: str, data: Dict[str, str]) -> requests.Response:
-    auth_req = auth_requests.Request()
-    identity_token = google_id_token.fetch_id_token(auth_req, url)
-    headers = {"Authorization": f"Bearer {identity_token}"}
-    response = requests.post(url, data=data, headers=headers, timeout=10)
-    response.raise_for_status()
-    return response
+def make_authenticated_post_request(client: ServiceClient, path: str = "",
+                                    data: Optional[Dict[str, str]] = None,
+                                    json_payload: Optional[Dict[str, Any]] = None) -> requests.Response:
+    return client.post(path, data=data, json_payload=json_payload)
 
 def call_sfilter_with_breaker(data: Dict[str, str]) -> requests.Response:
-    return sfilter_breaker.call(make_authenticated_post_request, SFILTER_URL, data)
+    start = time.perf_counter()
+    try:
+        return sfilter_breaker.call(make_authenticated_post_request, sfilter_client, data=data)
+    finally:
+        SFILTER_LATENCY.observe(time.perf_counter() - start)
+
+def call_sfilter_batch_with_breaker(messages: List[str]) -> requests.Response:
+    start = time.perf_counter()
+    try:
+        return sfilter_breaker.call(make_authenticated_post_request, sfilter_client, "/batch",
+                                    json_payload={"messages": messages})
+    finally:
+        SFILTER_BATCH_LATENCY.observe(time.perf_counter() - start)
 
 def call_llmstub_with_breaker(data: Dict[str, str]) -> requests.Response:
-    return llmstub_breaker.call(make_authenticated_post_request, LLMSTUB_URL, data)
+    start = time.perf_counter()
+    try:
+        return llmstub_breaker.call(make_authenticated_post_request, llmstub_client, data=data)
+    finally:
+        LLMSTUB_LATENCY.observe(time.perf_counter() - start)
+
+# --- Speculative dispatch ---
+# Opt-in per route: for routes listed in SPECULATIVE_ROUTES the llmstub call
+# starts alongside the sfilter call instead of after it, so approved messages
+# don't pay the two hops in sequence. The LLM answer is discarded when sfilter
+# rejects. Only messages that bfilter already rates as likely benign
+# (score < SPECULATION_MAX_SCORE) are speculated on, and nothing is while the
+# llmstub breaker is open. A speculative call only counts in the llmstub
+# breaker and latency once its answer is used, discarded ones are only
+# counted in bfilter_speculative_llmstub_total.
+SPECULATIVE_ROUTES = {route.strip() for route in os.getenv("SPECULATIVE_ROUTES", "").split(",") if route.strip()}
+SPECULATION_MAX_SCORE = float(os.getenv("SPECULATION_MAX_SCORE", "0.5"))
+speculation_executor = ThreadPoolExecutor(max_workers=int(os.getenv("SPECULATION_THREADS", "8")),
+                                          thread_name_prefix="bfilter-speculative")
+
+def speculation_allowed(route: str, score: float) -> bool:
+    # An UNSCORED message is no evidence of being benign
+    return (route in SPECULATIVE_ROUTES and 0.0 <= score < SPECULATION_MAX_SCORE
+            and llmstub_breaker.state != CircuitState.OPEN)
+
+# (response, error, seconds) of a speculative llmstub call
+SpeculativeResult = Tuple[Any, Optional[Exception], float]
+
+def call_llmstub_speculative(data: Dict[str, str]) -> SpeculativeResult:
+    """An llmstub call that records nothing until use_speculative() takes its answer"""
+    start = time.perf_counter()
+    try:
+        return make_authenticated_post_request(llmstub_client, data=data), None, time.perf_counter() - start
+    except Exception as e:
+        return None, e, time.perf_counter() - start
+
+def use_speculative(result: SpeculativeResult) -> Any:
+    """The llmstub response of a speculative call, recorded as if it had gone through the breaker"""
+    response, error, seconds = result
+    SPECULATIVE_CALLS.labels("used").inc()
+    LLMSTUB_LATENCY.observe(seconds)
+    if error is not None:
+        llmstub_breaker.record_failure()
+        raise error
+    llmstub_breaker.record_success()
+    return response
+
+def discard_speculative(future: Optional[Future]) -> None:
+    """Drops a speculative LLM call whose answer won't be used"""
+    if future is None:
+        return
+    SPECULATIVE_CALLS.labels("discarded").inc()
+    future.cancel()
+    if ENABLE_REQUEST_LOGGING:
+        structured_logger.info("Discarded speculative llmstub call")
+
+# One batching publisher per process, rejected messages are published without waiting on the broker
+secondary_filter_publisher = EventPublisher(
+    os.getenv("PROJECT_ID"), "secondary-filter",
+    max_messages=int(os.getenv("PUBSUB_MAX_MESSAGES", "100")),
+    max_bytes=int(os.getenv("PUBSUB_MAX_BYTES", str(1024 * 1024))),
+    max_latency_ms=float(os.getenv("PUBSUB_MAX_LATENCY_MS", "50")),
+    max_in_flight=int(os.getenv("PUBSUB_MAX_IN_FLIGHT", "1000")),
+    spill_capacity=int(os.getenv("PUBSUB_SPILL_CAPACITY", "10000")),
+)
+
+def publish_secondary_filter_event(userMessage: str) -> None:
+    """
+    Queues a message rejected by sfilter for the secondary-filter topic.
+    Never raises, failed publishes show up in bfilter_pubsub_failed.
+    """
+    data = json.dumps({"message": userMessage, "label": "spam"}).encode("utf-8")
+    secondary_filter_publisher.publish(data)
+    if ENABLE_REQUEST_LOGGING:
+        structured_logger.info("Queued message for pubsub", topic=secondary_filter_publisher.topic_id)
 
 @app.route("/")
 def index():
     """Serves the HTML form."""
     return render_template_string(HTML_TEMPLATE)
 
+def validate_message(userMessage: str) -> Optional[Tuple[Dict[str, str], int]]:
+    """Returns an error response for an invalid /handle message, None if it is valid"""
+    if not userMessage:
+        structured_logger.warning("Empty message received")
+        return {"error": "Message cannot be empty"}, 400
+    if len(userMessage) > MAX_MESSAGE_LENGTH:
+        structured_logger.warning("Message too long", length=len(userMessage))
+        return {"error": f"Message too long (max {MAX_MESSAGE_LENGTH} characters)"}, 413
+    return None
+
+def bayesian_score(userMessage: str, model: ServingModel) -> Tuple[str, float]:
+    """
+    Returns (message hash, NB spam score) for a stripped message, using the
+    prediction caches. The score is UNSCORED when nothing is left to score
+    after normalizing, so the message is escalated to sfilter.
+    """
+    message_hash = hashlib.md5(userMessage.encode()).hexdigest()
+    score = UNSCORED
+    if userMessage:
+        # Check cache first
+        cached_result = get_cached_prediction(message_hash, model)
+        if cached_result is not None:
+            score = cached_result
+            if ENABLE_REQUEST_LOGGING:
+                structured_logger.info("Cache hit", message_hash=message_hash, cache_size=len(prediction_cache))
+        else:
+            start = time.perf_counter()
+            processed_message = normalize(userMessage)
+            PREPROCESS_LATENCY.observe(time.perf_counter() - start)
+            if processed_message:
+                score = score_text(processed_message, model)
+            cache_prediction(message_hash, score, model)
+            if ENABLE_REQUEST_LOGGING:
+                structured_logger.info("BFilter score", score=score, message_length=len(userMessage))
+    return message_hash, score
+
+def cascade_zone(score: float, model: ServingModel) -> str:
+    """Zone of a score, by the thresholds of the model that scored it"""
+    score_zone = zone(score, model.pass_threshold, model.block_threshold)
+    CASCADE_ZONES.labels(score_zone).inc()
+    return score_zone
+
 @app.route("/handle", methods=["POST"])
 @handle_errors
 def main():
@@ -305,67 +671,156 @@ def main():
     
     userMessage = request.form.get('message', '')
     # Input validation
-    if not userMessage:
-        structured_logger.warning("Empty message received")
-        return {"error": "Message cannot be empty"}, 400
-    if len(userMessage) > MAX_MESSAGE_LENGTH:
-        structured_logger.warning("Message too long", length=len(userMessage))
-        return {"error": f"Message too long (max {MAX_MESSAGE_LENGTH} characters)"}, 413
+    validation_error = validate_message(userMessage)
+    if validation_error is not None:
+        return validation_error
     userMessage = userMessage.strip()
-    testMessage = userMessage.lower().replace("aeiou0123456789", "")
-    score = 0.0
     try:
-        if userMessage:
-            # Check cache first
-            message_hash = hashlib.md5(userMessage.encode()).hexdigest()
-            cached_result = get_cached_prediction(message_hash)
-            if cached_result is not None:
-                score = cached_result
+        model = serving
+        message_hash, score = bayesian_score(userMessage, model)
+        score_zone = cascade_zone(score, model)
+        if score_zone != ZONE_BLOCK:
+            # Uncertain scores proceed to the secondary filter (sfilter), unless
+            # another worker or instance already has its verdict. Confident
+            # passes go straight to llmstub.
+            cached_verdict = get_cached_verdict(message_hash) if score_zone == ZONE_ESCALATE else None
+            if cached_verdict == VERDICT_JAILBREAK:
                 if ENABLE_REQUEST_LOGGING:
-                    structured_logger.info("Cache hit", message_hash=message_hash, cache_size=len(prediction_cache))
-            else:
-                processed_message = process_text(testMessage)
-                if processed_message:
-                    v = cv.transform([processed_message]).toarray()
-                    score = clf.predict_proba(v)[0][1]
-                    cache_prediction(message_hash, score)
-                    if ENABLE_REQUEST_LOGGING:
-                        structured_logger.info("BFilter score", score=score, message_length=len(userMessage))
-        if score < BFILTER_THRESHOLD:
-            # If the score is low, proceed to the secondary filter (sfilter).
+                    structured_logger.info("Shared verdict cache hit", message_hash=message_hash, verdict=cached_verdict)
+                VERDICTS.labels("blocked_secondary").inc()
+                return "I don't understand your message, can you say it another way? (secondary)"
+            speculative_llm = None
+            if score_zone == ZONE_ESCALATE and cached_verdict is None:
+                if speculation_allowed(request.path, score):
+                    # Start the LLM call now, its answer is only used if sfilter approves
+                    speculative_llm = speculation_executor.submit(call_llmstub_speculative, {"message": userMessage})
+                try:
+                    call_sfilter_with_breaker({"message": userMessage})
+                    cache_verdict(message_hash, VERDICT_OK)
+                except requests.exceptions.HTTPError as e:
+                    discard_speculative(speculative_llm)
+                    if e.response.status_code == 401:
+                        cache_verdict(message_hash, VERDICT_JAILBREAK)
+                        publish_secondary_filter_event(userMessage)
+                        structured_logger.info("sfilter service detected a jailbreak.")
+                        VERDICTS.labels("blocked_secondary").inc()
+                        return "I don't understand your message, can you say it another way? (secondary)"
+                    else:
+                        structured_logger.error("HTTP error during sfilter check", url=SFILTER_URL, error=str(e))
+                        return {"error": f"Error communicating with the secondary filter. {e.response.status_code}"}, 503
+                except Exception:
+                    discard_speculative(speculative_llm)
+                    raise
             try:
-                call_sfilter_with_breaker({"message": userMessage})
-            except requests.exceptions.HTTPError as e:
-                if e.response.status_code == 401:
-                    try:
-                        project_id = os.getenv("PROJECT_ID")
-                        topic_id = "secondary-filter"
-                        publisher = pubsub_v1.PublisherClient()
-                        topic_path = publisher.topic_path(project_id, topic_id)
-                        data = json.dumps({"message": userMessage}).encode("utf-8")
-                        future = publisher.publish(topic_path, data)
-                        message_id = future.result()
-                        structured_logger.info("Published message to pubsub", topic=topic_path, message_id=message_id)
-                    except Exception as e:
-                        structured_logger.error("Error publishing event", error=str(e))
-                        return {"error": f"Error publishing event {e}"}, 503
-                    structured_logger.info("sfilter service detected a jailbreak.")
-                    return "I don't understand your message, can you say it another way? (secondary)"
+                if speculative_llm is not None:
+                    llmstub_response = use_speculative(speculative_llm.result())
                 else:
-                    structured_logger.error("HTTP error during sfilter check", url=SFILTER_URL, error=str(e))
-                    return {"error": f"Error communicating with the secondary filter. {e.response.status_code}"}, 503
-            try:
-                llmstub_response = call_llmstub_with_breaker({"message": userMessage})
+                    llmstub_response = call_llmstub_with_breaker({"message": userMessage})
+                VERDICTS.labels("passed").inc()
                 return llmstub_response.text
             except requests.exceptions.RequestException as e:
                 structured_logger.error("Error calling llmstub service", url=LLMSTUB_URL, error=str(e))
                 return {"error": "Error communicating with the primary service."}, 503
         else:
+            VERDICTS.labels("blocked").inc()
             return "I don't understand your message, can you say it another way?"
     except Exception as e:
         structured_logger.error("Unexpected error in main handler", error=str(e))
         return {"error": "Internal server error"}, 500
 
+def validate_batch(messages: Any) -> Optional[Tuple[Dict[str, str], int]]:
+    """Returns an error response for an invalid /handle/batch payload, None if it is valid"""
+    if not isinstance(messages, list) or not messages:
+        return {"error": "messages must be a non-empty list"}, 400
+    if len(messages) > MAX_BATCH_SIZE:
+        return {"error": f"Batch too large (max {MAX_BATCH_SIZE} messages)"}, 413
+    for userMessage in messages:
+        if not isinstance(userMessage, str) or not userMessage.strip():
+            return {"error": "Messages must be non-empty strings"}, 400
+        if len(userMessage) > MAX_MESSAGE_LENGTH:
+            return {"error": f"Message too long (max {MAX_MESSAGE_LENGTH} characters)"}, 413
+    return None
+
+def bayesian_score_batch(messages: List[str], model: ServingModel) -> Tuple[List[str], List[float]]:
+    """Batch version of bayesian_score, uncached messages are scored in one vectorized pass"""
+    message_hashes = [hashlib.md5(userMessage.encode()).hexdigest() for userMessage in messages]
+    scores = [get_cached_prediction(message_hash, model) for message_hash in message_hashes]
+
+    pending = [i for i, score in enumerate(scores) if score is None]
+    if pending:
+        start = time.perf_counter()
+        processed = [normalize(messages[i]) for i in pending]
+        PREPROCESS_LATENCY.observe(time.perf_counter() - start)
+        batch_scores = score_texts(processed, model)
+        for i, text, score in zip(pending, processed, batch_scores):
+            # Matches /handle, a message with nothing left after processing is escalated
+            scores[i] = float(score) if text else UNSCORED
+            cache_prediction(message_hashes[i], scores[i], model)
+    return message_hashes, scores
+
+def batch_verdicts(message_hashes: List[str], scores: List[float],
+                   model: ServingModel) -> Tuple[List[str], List[int]]:
+    """Verdicts known without sfilter, and the indices that still need to be escalated to it"""
+    zones = [cascade_zone(score, model) for score in scores]
+    verdicts = ["blocked" if score_zone == ZONE_BLOCK else "passed" for score_zone in zones]
+    escalated = []
+    for i, score_zone in enumerate(zones):
+        if score_zone != ZONE_ESCALATE:
+            continue
+        cached_verdict = get_cached_verdict(message_hashes[i])
+        if cached_verdict == VERDICT_JAILBREAK:
+            verdicts[i] = "blocked_secondary"
+        elif cached_verdict is None:
+            escalated.append(i)
+    return verdicts, escalated
+
+def apply_sfilter_batch_results(messages: List[str], message_hashes: List[str], verdicts: List[str],
+                                escalated: List[int], sfilter_results: List[Dict[str, Any]]) -> None:
+    for i, result in zip(escalated, sfilter_results):
+        cache_verdict(message_hashes[i], VERDICT_JAILBREAK if result["jailbreak"] else VERDICT_OK)
+        if result["jailbreak"]:
+            verdicts[i] = "blocked_secondary"
+            publish_secondary_filter_event(messages[i])
+
+def record_verdicts(verdicts: List[str]) -> None:
+    for verdict in verdicts:
+        VERDICTS.labels(verdict).inc()
+
+@app.route("/handle/batch", methods=["POST"])
+@handle_errors
+def handle_batch():
+    """
+    Classifies a JSON batch {"messages": [...]} in one pass.
+    Preprocessing, vectorization and prediction run once over the whole
+    batch and every message under the threshold is sent to sfilter in a
+    single batched call. Returns a score and verdict per message.
+    """
+    load_models()
+
+    payload = request.get_json(silent=True) or {}
+    messages = payload.get("messages")
+    validation_error = validate_batch(messages)
+    if validation_error is not None:
+        return validation_error
+
+    messages = [userMessage.strip() for userMessage in messages]
+    model = serving
+    message_hashes, scores = bayesian_score_batch(messages, model)
+    verdicts, escalated = batch_verdicts(message_hashes, scores, model)
+    if escalated:
+        try:
+            response = call_sfilter_batch_with_breaker([messages[i] for i in escalated])
+            sfilter_results = response.json()["results"]
+        except requests.exceptions.RequestException as e:
+            structured_logger.error("Error calling sfilter batch endpoint", url=SFILTER_URL, error=str(e))
+            return {"error": "Error communicating with the secondary filter."}, 503
+        apply_sfilter_batch_results(messages, message_hashes, verdicts, escalated, sfilter_results)
+
+    record_verdicts(verdicts)
+    if ENABLE_REQUEST_LOGGING:
+        structured_logger.info("BFilter batch", batch_size=len(messages), escalated=len(escalated))
+    return {"results": [{"score": score, "verdict": verdict} for score, verdict in zip(scores, verdicts)]}, 200
+
 # Health check endpoint
 @app.route("/health", methods=["GET"])
 def health_check():
@@ -374,8 +829,7 @@ def health_check():
         # Ensure models are loaded for health check
         load_models()
         # Quick model validation
-        test_vector = cv.transform(["test"]).toarray()
-        clf.predict_proba(test_vector)
+        score_text("test")
         return {"status": "healthy", "timestamp": time.time()}, 200
     except Exception as e:
         structured_logger.error("Health check failed", error=str(e))
@@ -399,41 +853,37 @@ def readiness_check():
     try:
         # Ensure models are loaded
         load_models()
-        if clf is None or cv is None:
+        if not models_loaded():
             errors.append("Models not loaded")
             checks["models"] = "FAIL"
         else:
-            test_vector = cv.transform(["test"]).toarray()
-            clf.predict_proba(test_vector)
+            score_text("test")
             checks["models"] = "OK"
     except Exception as e:
         errors.append(f"Model validation failed: {str(e)}")
         checks["models"] = "FAIL"
     # Check dependencies with timeout
     dependency_checks = [
-        ("sfilter", SFILTER_URL),
-        ("llmstub", LLMSTUB_URL)
+        ("sfilter", sfilter_client),
+        ("llmstub", llmstub_client)
     ]
-    for service_name, url in dependency_checks:
+    for service_name, client in dependency_checks:
         try:
-            # Use authenticated requests for internal services
-            auth_req = auth_requests.Request()
-            identity_token = google_id_token.fetch_id_token(auth_req, url)
-            headers = {"Authorization": f"Bearer {identity_token}"}
-            response = requests.get(f"{url.rstrip('/')}/health", headers=headers, timeout=5)
+            # Authenticated call over the same pooled session as forwarded messages
+            response = client.get("/health", timeout=5)
             if response.status_code == 200:
                 checks[service_name] = "OK"
             else:
                 errors.append(f"{service_name} unhealthy: {response.status_code}")
                 checks[service_name] = "FAIL"
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, ValueError) as e:
             errors.append(f"{service_name} unreachable: {str(e)}")
             checks[service_name] = "FAIL"
     # Check cache health
     try:
-        cache_size = len(prediction_cache)
-        if cache_size > 10000:
-            errors.append(f"Cache size too large: {cache_size}")
+        cache_bytes = prediction_cache.size_bytes
+        if prediction_cache.max_bytes is not None and cache_bytes > prediction_cache.max_bytes:
+            errors.append(f"Cache size too large: {cache_bytes} bytes")
             checks["cache"] = "WARN"
         else:
             checks["cache"] = "OK"
@@ -452,44 +902,47 @@ def readiness_check():
 
 
 # --- Prometheus Metrics Implementation ---
-metrics_data = {
-    "requests_total": 0,
-    "requests_filtered": 0,
-    "requests_passed": 0,
-    "cache_hits": 0,
-    "cache_misses": 0,
-    "error_count": defaultdict(int),
-    "response_time_sum": 0.0,
-    "response_time_count": 0
-}
-
 @app.route("/metrics", methods=["GET"])
 def metrics() -> Tuple[str, int]:
-    """Prometheus-compatible metrics endpoint"""
+    """
+    Prometheus-compatible metrics endpoint. Counters and histograms from
+    metrics_registry add up every worker; cache occupancy, publisher and
+    breaker state are those of the worker answering the scrape.
+    """
     uptime = time.time() - app.start_time
-    avg_response_time = (metrics_data["response_time_sum"] /
-                        max(metrics_data["response_time_count"], 1))
-    cache_hit_rate = (metrics_data["cache_hits"] /
-                     max(metrics_data["cache_hits"] + metrics_data["cache_misses"], 1))
-    metrics_output = f"""# HELP bfilter_requests_total Total number of requests
-# TYPE bfilter_requests_total counter
-bfilter_requests_total {metrics_data["requests_total"]}
-
+    totals = metrics_registry.totals()
+    response_time_sum, response_time_count = REQUEST_LATENCY.sum_and_count(totals)
+    avg_response_time = response_time_sum / max(response_time_count, 1)
+    requests_filtered = VERDICTS.value(totals, "blocked") + VERDICTS.value(totals, "blocked_secondary")
+    cache_hits = CACHE_LOOKUPS.value(totals, "prediction", "hit") + CACHE_LOOKUPS.value(totals, "shared_prediction", "hit")
+    cache_misses = CACHE_LOOKUPS.value(totals, "shared_prediction", "miss")
+    cache_hit_rate = cache_hits / max(cache_hits + cache_misses, 1)
+    cache_stats = prediction_cache.stats()
+    model = serving
+    publisher_stats = secondary_filter_publisher.stats()
+    breaker_states = "\n".join(
+        f'bfilter_circuit_breaker_state{{breaker="{breaker.name}",state="{state.value}"}} {int(breaker.state == state)}'
+        for breaker in (sfilter_breaker, llmstub_breaker) for state in CircuitState)
+    metrics_output = metrics_registry.render(totals) + f"""
 # HELP bfilter_requests_filtered Number of requests filtered
-# TYPE bfilter_requests_filtered counter  
-bfilter_requests_filtered {metrics_data["requests_filtered"]}
+# TYPE bfilter_requests_filtered counter
+bfilter_requests_filtered {requests_filtered:g}
 
 # HELP bfilter_requests_passed Number of requests passed
 # TYPE bfilter_requests_passed counter
-bfilter_requests_passed {metrics_data["requests_passed"]}
+bfilter_requests_passed {VERDICTS.value(totals, "passed"):g}
 
-# HELP bfilter_cache_hits Cache hits
+# HELP bfilter_cache_hits Prediction cache hits, local or shared
 # TYPE bfilter_cache_hits counter
-bfilter_cache_hits {metrics_data["cache_hits"]}
+bfilter_cache_hits {cache_hits:g}
 
-# HELP bfilter_cache_misses Cache misses  
+# HELP bfilter_cache_misses Prediction cache misses, local and shared
 # TYPE bfilter_cache_misses counter
-bfilter_cache_misses {metrics_data["cache_misses"]}
+bfilter_cache_misses {cache_misses:g}
+
+# HELP bfilter_cache_evictions Cache evictions
+# TYPE bfilter_cache_evictions counter
+bfilter_cache_evictions {cache_stats["evictions"]}
 
 # HELP bfilter_cache_hit_rate Cache hit rate
 # TYPE bfilter_cache_hit_rate gauge
@@ -497,7 +950,48 @@ bfilter_cache_hit_rate {cache_hit_rate:.4f}
 
 # HELP bfilter_cache_size Current cache size
 # TYPE bfilter_cache_size gauge
-bfilter_cache_size {len(prediction_cache)}
+bfilter_cache_size {cache_stats["size"]}
+
+# HELP bfilter_cache_bytes Estimated cache memory in bytes
+# TYPE bfilter_cache_bytes gauge
+bfilter_cache_bytes {cache_stats["bytes"]}
+
+# HELP bfilter_pubsub_published Rejected messages acknowledged by Pub/Sub
+# TYPE bfilter_pubsub_published counter
+bfilter_pubsub_published {publisher_stats["published"]}
+
+# HELP bfilter_pubsub_failed Rejected messages whose publish failed
+# TYPE bfilter_pubsub_failed counter
+bfilter_pubsub_failed {publisher_stats["failed"]}
+
+# HELP bfilter_pubsub_dropped Rejected messages dropped from a full spill queue
+# TYPE bfilter_pubsub_dropped counter
+bfilter_pubsub_dropped {publisher_stats["dropped"]}
+
+# HELP bfilter_pubsub_in_flight Publishes awaiting a broker answer
+# TYPE bfilter_pubsub_in_flight gauge
+bfilter_pubsub_in_flight {publisher_stats["in_flight"]}
+
+# HELP bfilter_pubsub_spilled Rejected messages waiting in the spill queue
+# TYPE bfilter_pubsub_spilled gauge
+bfilter_pubsub_spilled {publisher_stats["spilled"]}
+
+# HELP bfilter_cascade_threshold Cascade zone boundaries on the NB score
+# TYPE bfilter_cascade_threshold gauge
+bfilter_cascade_threshold{{bound="pass"}} {model.pass_threshold if model else BFILTER_PASS_THRESHOLD}
+bfilter_cascade_threshold{{bound="block"}} {model.block_threshold if model else BFILTER_THRESHOLD}
+
+# HELP bfilter_model_info Scorer this worker is serving, version="builtin" until an online model is swapped in
+# TYPE bfilter_model_info gauge
+bfilter_model_info{{version="{model.version if model and model.online else 'builtin'}"}} 1
+
+# HELP bfilter_model_load_seconds Time this worker's process took to load the models
+# TYPE bfilter_model_load_seconds gauge
+bfilter_model_load_seconds {model_load_seconds or 0.0:.6f}
+
+# HELP bfilter_circuit_breaker_state Current circuit breaker state (1 for the active state)
+# TYPE bfilter_circuit_breaker_state gauge
+{breaker_states}
 
 # HELP bfilter_uptime_seconds Service uptime in seconds
 # TYPE bfilter_uptime_seconds gauge
@@ -513,6 +1007,12 @@ bfilter_avg_response_time_seconds {avg_response_time:.6f}
 app.start_time = time.time()
 app.request_count = 0
 
+# Load the models before the server takes traffic rather than on the first
+# request. With gunicorn --preload this runs once in the master, and the
+# workers it forks share the mapped scorer.bin pages.
+if os.getenv("BFILTER_EAGER_LOAD", "true").lower() == "true":
+    load_models()
+
 if __name__ == "__main__":
     # Startup logging for Cloud Run diagnostics
     structured_logger.info("BFilter service starting", 
@@ -0,0 +1,186 @@
+"""
+Pooled, authenticated HTTP clients for bfilter's downstream services.
+
+Each ServiceClient owns one requests.Session with a keep-alive connection
+pool, so forwarded messages reuse TCP/TLS connections instead of opening a
+new one per call, and an IdTokenCache that asks the metadata server for a
+new identity token only shortly before the current one expires.
+
+Token fetching is pluggable: ID_TOKEN_SOURCE=stub swaps the metadata
+server for a local fetcher that mints unsigned tokens, for tests and for
+running the services locally without Google credentials.
+
+AsyncServiceClient is the asyncio counterpart used by the ASGI serving
+mode, built on a pooled aiohttp.ClientSession.
+"""
+
+import asyncio
+import base64
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from google.auth.transport import requests as auth_requests
+from google.oauth2 import id_token as google_id_token
+
+TokenFetcher = Callable[[str], str]
+
+DEFAULT_TOKEN_LIFETIME = 3600.0
+
+
+def token_expiry(token: str) -> float:
+    """exp claim of a JWT, or an hour from now if it can't be read"""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (IndexError, KeyError, ValueError, TypeError):
+        return time.time() + DEFAULT_TOKEN_LIFETIME
+
+
+class GoogleIdTokenFetcher:
+    """Fetches identity tokens from the metadata server over a pooled session"""
+    def __init__(self):
+        self._request = auth_requests.Request(requests.Session())
+
+    def __call__(self, audience: str) -> str:
+        return google_id_token.fetch_id_token(self._request, audience)
+
+
+def stub_token_fetcher(audience: str) -> str:
+    """Unsigned local token with a one hour exp claim, never hits the network"""
+    def encode(part: Dict[str, Any]) -> str:
+        return base64.urlsafe_b64encode(json.dumps(part).encode()).decode().rstrip("=")
+    claims = {"aud": audience, "iat": int(time.time()), "exp": int(time.time() + DEFAULT_TOKEN_LIFETIME)}
+    return f"{encode({'alg': 'none', 'typ': 'JWT'})}.{encode(claims)}."
+
+
+def default_token_fetcher() -> TokenFetcher:
+    if os.getenv("ID_TOKEN_SOURCE", "metadata").lower() == "stub":
+        return stub_token_fetcher
+    return GoogleIdTokenFetcher()
+
+
+class IdTokenCache:
+    def __init__(self, audience: str, fetcher: TokenFetcher, refresh_margin: float = 300.0):
+        self.audience = audience
+        self.fetcher = fetcher
+        self.refresh_margin = refresh_margin
+        self.refresh_count = 0
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> str:
+        token = self.peek()
+        if token is not None:
+            return token
+        with self._lock:
+            # Another thread may have refreshed while we waited for the lock
+            if self._token is None or time.time() >= self._expires_at - self.refresh_margin:
+                token = self.fetcher(self.audience)
+                self._expires_at = token_expiry(token)
+                self._token = token
+                self.refresh_count += 1
+            return self._token
+
+    def peek(self) -> Optional[str]:
+        """Current token if it doesn't need refreshing yet, without fetching"""
+        if self._token is not None and time.time() < self._expires_at - self.refresh_margin:
+            return self._token
+        return None
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._token = None
+
+
+class ServiceClient:
+    def __init__(self, base_url: Optional[str], token_fetcher: Optional[TokenFetcher] = None,
+                 pool_size: int = 10, timeout: float = 10.0):
+        self.base_url = (base_url or "").rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.tokens = IdTokenCache(base_url, token_fetcher or default_token_fetcher())
+
+    def _url(self, path: str) -> str:
+        if not self.base_url:
+            raise ValueError("Service URL not configured")
+        return f"{self.base_url}{path}"
+
+    def _headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.tokens.get()}"}
+
+    def post(self, path: str = "", data: Optional[Dict[str, str]] = None,
+             json_payload: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None) -> requests.Response:
+        """POST to the service, raising for error statuses like requests.Response.raise_for_status"""
+        response = self.session.post(self._url(path), data=data, json=json_payload, headers=self._headers(),
+                                     timeout=timeout or self.timeout)
+        response.raise_for_status()
+        return response
+
+    def get(self, path: str = "", timeout: Optional[float] = None) -> requests.Response:
+        return self.session.get(self._url(path), headers=self._headers(), timeout=timeout or self.timeout)
+
+
+class AsyncResponse(NamedTuple):
+    status: int
+    text: str
+
+
+class AsyncServiceClient:
+    def __init__(self, base_url: Optional[str], token_fetcher: Optional[TokenFetcher] = None,
+                 pool_size: int = 100, timeout: float = 10.0):
+        self.base_url = (base_url or "").rstrip("/")
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.tokens = IdTokenCache(base_url, token_fetcher or default_token_fetcher())
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _url(self, path: str) -> str:
+        if not self.base_url:
+            raise ValueError("Service URL not configured")
+        return f"{self.base_url}{path}"
+
+    def session(self) -> aiohttp.ClientSession:
+        # Created lazily so it binds to the event loop of the serving worker
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def _headers(self) -> Dict[str, str]:
+        token = self.tokens.peek()
+        if token is None:
+            # Token fetching is blocking, keep it off the event loop
+            token = await asyncio.get_running_loop().run_in_executor(None, self.tokens.get)
+        return {"Authorization": f"Bearer {token}"}
+
+    async def post(self, path: str = "", data: Optional[Dict[str, str]] = None,
+                   json_payload: Optional[Dict[str, Any]] = None) -> AsyncResponse:
+        """POST to the service, raising aiohttp.ClientResponseError for error statuses"""
+        async with self.session().post(self._url(path), data=data, json=json_payload,
+                                       headers=await self._headers()) as response:
+            text = await response.text()
+            if response.status >= 400:
+                raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                  status=response.status, message=text)
+            return AsyncResponse(response.status, text)
+
+    async def get(self, path: str = "", timeout: Optional[float] = None) -> AsyncResponse:
+        client_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else self.timeout
+        async with self.session().get(self._url(path), headers=await self._headers(),
+                                      timeout=client_timeout) as response:
+            return AsyncResponse(response.status, await response.text())
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
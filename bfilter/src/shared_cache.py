@@ -0,0 +1,367 @@
+"""
+Shared verdict cache used by bfilter and sfilter.
+
+The per-worker LRU in bfilter only helps the process that computed a result,
+so the same prompt sprayed across gunicorn workers and Cloud Run instances
+is scored again everywhere. This module provides cache backends that are
+shared between processes, selected with SHARED_CACHE_URL:
+
+    (unset)                              disabled
+    mmap:///dev/shm/llm-verdicts?slots=N workers on the same host
+    redis://host:6379?backoff=S          any instance that can reach host
+
+The redis backend speaks the small subset of RESP needed for GET and SET EX,
+so it works against Redis/Memorystore and against the stand-in server in
+this module:
+
+    python shared_cache.py serve --port 6379
+
+Keys are namespaced strings such as "sfilter:<model version>:<md5 of
+message>" and values are short byte strings. Backends never raise on lookup
+or store: a broken cache behaves like a miss so it can't take a request down
+with it. After a failure the redis backend stops trying for a backoff window
+(S seconds, doubling up to 30s while it keeps failing), so an unreachable
+cache costs one connect timeout per window rather than one per lookup.
+
+sfilter verdicts are keyed by the model version that produced them, so a
+deploy never serves the previous model's verdicts. sfilter publishes its
+version under VERDICT_VERSION_KEY, where bfilter reads it (PublishedVersion).
+
+bfilter/src holds the copy to edit; shared_modules.py at the repository
+root copies it into sfilter/src and checks that the copies match.
+"""
+
+import argparse
+import fcntl
+import hashlib
+import mmap
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+VERDICT_VERSION_KEY = "sfilter:version"
+
+
+def verdict_key(message_hash: str, model_version: str) -> str:
+    return f"sfilter:{model_version}:{message_hash}"
+
+
+class CacheBackend:
+    """Interface for shared caches, the base class is the disabled backend"""
+    name = "none"
+
+    def get(self, key: str) -> Optional[bytes]:
+        return None
+
+    def set(self, key: str, value: bytes, ttl_seconds: float) -> None:
+        return None
+
+
+# --- Shared-memory backend ---
+# Fixed-size open-addressed table in a memory-mapped file. Each slot holds
+# key digest | expiry | value length | crc32 | value. Writers serialize on a
+# POSIX record lock (per process) plus a thread lock; readers take no lock
+# and treat a slot whose crc doesn't match (a torn write) as a miss.
+_SLOT_HEADER = struct.Struct("<16sdHI")
+SLOT_SIZE = 128
+MAX_VALUE_SIZE = SLOT_SIZE - _SLOT_HEADER.size
+BUCKET_SLOTS = 4
+
+
+class MmapBackend(CacheBackend):
+    name = "mmap"
+
+    def __init__(self, path: str, slots: int = 65536):
+        self.path = path
+        self.slots = max(slots, BUCKET_SLOTS)
+        self.size = self.slots * SLOT_SIZE
+        self._thread_lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._map = None
+
+    def _mapping(self) -> mmap.mmap:
+        if self._pid != os.getpid():
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            if os.fstat(fd).st_size < self.size:
+                os.ftruncate(fd, self.size)
+            self._fd = fd
+            self._map = mmap.mmap(fd, self.size)
+            self._pid = os.getpid()
+        return self._map
+
+    @staticmethod
+    def _digest(key: str) -> bytes:
+        return hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+
+    def _bucket(self, digest: bytes) -> range:
+        start = int.from_bytes(digest[:8], "little") % self.slots
+        return range(start, start + BUCKET_SLOTS)
+
+    def _read_slot(self, table: mmap.mmap, slot: int) -> Optional[Tuple[bytes, float, bytes]]:
+        offset = (slot % self.slots) * SLOT_SIZE
+        raw = table[offset:offset + SLOT_SIZE]
+        digest, expires_at, length, crc = _SLOT_HEADER.unpack_from(raw)
+        if length > MAX_VALUE_SIZE:
+            return None
+        value = raw[_SLOT_HEADER.size:_SLOT_HEADER.size + length]
+        if zlib.crc32(digest + struct.pack("<d", expires_at) + value) != crc:
+            return None
+        return digest, expires_at, value
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            table = self._mapping()
+            digest = self._digest(key)
+            now = time.time()
+            for slot in self._bucket(digest):
+                entry = self._read_slot(table, slot)
+                if entry is not None and entry[0] == digest and entry[1] > now:
+                    return entry[2]
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def set(self, key: str, value: bytes, ttl_seconds: float) -> None:
+        if len(value) > MAX_VALUE_SIZE:
+            return
+        try:
+            table = self._mapping()
+            digest = self._digest(key)
+            expires_at = time.time() + ttl_seconds
+            with self._thread_lock:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX)
+                try:
+                    # Reuse this key's slot, else an empty or expired one, else the one expiring first
+                    target = None
+                    oldest = None
+                    now = time.time()
+                    for slot in self._bucket(digest):
+                        entry = self._read_slot(table, slot)
+                        if entry is None or entry[0] == digest or entry[1] <= now:
+                            target = slot
+                            break
+                        if oldest is None or entry[1] < oldest[1]:
+                            oldest = (slot, entry[1])
+                    if target is None:
+                        target = oldest[0]
+                    crc = zlib.crc32(digest + struct.pack("<d", expires_at) + value)
+                    offset = (target % self.slots) * SLOT_SIZE
+                    record = _SLOT_HEADER.pack(digest, expires_at, len(value), crc) + value
+                    table[offset:offset + len(record)] = record
+                finally:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        except (OSError, ValueError):
+            pass
+
+
+# --- Network backend (RESP subset) ---
+def _encode_command(*parts: bytes) -> bytes:
+    out = [b"*%d\r\n" % len(parts)]
+    for part in parts:
+        out.append(b"$%d\r\n%s\r\n" % (len(part), part))
+    return b"".join(out)
+
+
+def _read_reply(stream) -> Optional[bytes]:
+    line = stream.readline()
+    if not line:
+        raise ConnectionError("connection closed")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"$":
+        length = int(rest)
+        if length < 0:
+            return None
+        data = stream.read(length + 2)
+        return data[:-2]
+    if kind == b"-":
+        raise ConnectionError(rest.decode("utf-8", "replace"))
+    return rest
+
+
+class NetworkBackend(CacheBackend):
+    name = "redis"
+
+    def __init__(self, host: str, port: int = 6379, timeout: float = 0.05, backoff: float = 1.0,
+                 max_backoff: float = 30.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._local = threading.local()
+        # Shared by every thread of the process, a failure in one backs them all off
+        self._failures = 0
+        self._retry_at = 0.0
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = (sock, sock.makefile("rb"))
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _reset(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn[1].close()
+                conn[0].close()
+            except OSError:
+                pass
+
+    def _failed(self) -> None:
+        self._reset()
+        self._failures += 1
+        self._retry_at = time.monotonic() + min(self.backoff * 2 ** (self._failures - 1), self.max_backoff)
+
+    def _call(self, *parts: bytes) -> Optional[bytes]:
+        sock, stream = self._connection()
+        sock.sendall(_encode_command(*parts))
+        reply = _read_reply(stream)
+        if self._failures:
+            self._failures = 0
+        return reply
+
+    def get(self, key: str) -> Optional[bytes]:
+        if time.monotonic() < self._retry_at:
+            return None
+        try:
+            return self._call(b"GET", key.encode("utf-8"))
+        except (OSError, ConnectionError, ValueError):
+            self._failed()
+            return None
+
+    def set(self, key: str, value: bytes, ttl_seconds: float) -> None:
+        if time.monotonic() < self._retry_at:
+            return
+        try:
+            self._call(b"SET", key.encode("utf-8"), value, b"EX", str(max(int(ttl_seconds), 1)).encode())
+        except (OSError, ConnectionError, ValueError):
+            self._failed()
+
+
+class PublishedVersion:
+    """
+    A model version kept under a cache key: publish() stores it at most every
+    refresh_seconds, current() re-reads it at most as often. A reader may go
+    on using the previous version for up to refresh_seconds after a deploy.
+    """
+    def __init__(self, backend: CacheBackend, key: str = VERDICT_VERSION_KEY, refresh_seconds: float = 30.0):
+        self.backend = backend
+        self.key = key
+        self.refresh_seconds = refresh_seconds
+        self._version: Optional[str] = None
+        self._next_refresh = 0.0
+
+    def publish(self, version: str, ttl_seconds: float) -> None:
+        now = time.monotonic()
+        if now >= self._next_refresh:
+            self._next_refresh = now + self.refresh_seconds
+            self.backend.set(self.key, version.encode("utf-8"), max(ttl_seconds, self.refresh_seconds * 2))
+
+    def current(self) -> Optional[str]:
+        now = time.monotonic()
+        if now >= self._next_refresh:
+            self._next_refresh = now + self.refresh_seconds
+            version = self.backend.get(self.key)
+            self._version = version.decode("utf-8", "replace") if version is not None else None
+        return self._version
+
+
+def create_backend(url: Optional[str]) -> CacheBackend:
+    """Build the backend described by SHARED_CACHE_URL"""
+    if not url:
+        return CacheBackend()
+    parsed = urlparse(url)
+    if parsed.scheme == "mmap":
+        slots = int(parse_qs(parsed.query).get("slots", ["65536"])[0])
+        return MmapBackend(parsed.path, slots=slots)
+    if parsed.scheme == "redis":
+        query = parse_qs(parsed.query)
+        timeout = float(query.get("timeout", ["0.05"])[0])
+        backoff = float(query.get("backoff", ["1.0"])[0])
+        return NetworkBackend(parsed.hostname or "localhost", parsed.port or 6379, timeout=timeout, backoff=backoff)
+    raise ValueError(f"Unsupported SHARED_CACHE_URL scheme: {parsed.scheme}")
+
+
+# --- Local stand-in server for the network backend ---
+class _StandInHandler(socketserver.StreamRequestHandler):
+    def _read_command(self) -> Optional[list]:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()
+        parts = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            parts.append(self.rfile.read(length + 2)[:-2])
+        return parts
+
+    def handle(self) -> None:
+        store: Dict[bytes, Tuple[bytes, Optional[float]]] = self.server.store
+        lock: threading.Lock = self.server.lock
+        while True:
+            try:
+                command = self._read_command()
+            except (OSError, ValueError):
+                return
+            if command is None:
+                return
+            verb = command[0].upper() if command else b""
+            if verb == b"GET" and len(command) == 2:
+                with lock:
+                    entry = store.get(command[1])
+                    if entry is not None and entry[1] is not None and entry[1] <= time.time():
+                        del store[command[1]]
+                        entry = None
+                if entry is None:
+                    self.wfile.write(b"$-1\r\n")
+                else:
+                    self.wfile.write(b"$%d\r\n%s\r\n" % (len(entry[0]), entry[0]))
+            elif verb == b"SET" and len(command) in (3, 5):
+                expires_at = None
+                if len(command) == 5 and command[3].upper() == b"EX":
+                    expires_at = time.time() + int(command[4])
+                with lock:
+                    store[command[1]] = (command[2], expires_at)
+                self.wfile.write(b"+OK\r\n")
+            elif verb == b"PING":
+                self.wfile.write(b"+PONG\r\n")
+            else:
+                self.wfile.write(b"-ERR unsupported command\r\n")
+
+
+class StandInServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int]):
+        super().__init__(address, _StandInHandler)
+        self.store: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+        self.lock = threading.Lock()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the shared verdict cache")
+    parser.add_argument("command", choices=["serve"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    with StandInServer((args.host, args.port)) as server:
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
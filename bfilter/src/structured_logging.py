@@ -0,0 +1,264 @@
+"""
+Structured JSON logging shared by bfilter, sfilter and llmstub.
+
+Every record is one JSON line on stdout, which Cloud Logging turns into a
+structured entry:
+
+    {"timestamp": "...", "level": "INFO", "service": "bfilter", "message": "Cache hit", ...fields}
+
+Request threads never serialize or write. StructuredLogger checks the level
+and the event's sample rate first, so a disabled or sampled-out record
+costs a comparison and a dict lookup, and field values that are callables
+are only called for records that are kept. Kept records go on the queue of
+a LogWriter, whose background thread encodes them in batches with a compact
+json encoder and writes each batch with one write() and flush(). When the
+queue is full records are dropped and counted rather than waited on, and
+the writer reports the count in a later record.
+
+LOG_LEVEL sets the minimum level (INFO). LOG_SAMPLE_RATES keeps only a
+fraction of high-volume events, keyed by message, on top of the defaults a
+service passes in:
+
+    LOG_SAMPLE_RATES="Request duration=0.01,Cache hit=0.1"
+
+Kept records of a sampled event carry a sample_rate field, so counts can be
+scaled back up. configure() also sends the standard logging module through
+the same writer, so logger.info("... %s", x) calls and library logs come
+out as JSON too; their sample rates are keyed by the unformatted message.
+
+bfilter/src holds the copy to edit; shared_modules.py at the repository
+root copies it into sfilter/src and llmstub/src (sync) and fails the
+deploy when a copy differs (check).
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, TextIO, Tuple
+
+LEVELS = {"DEBUG": logging.DEBUG, "INFO": logging.INFO, "WARNING": logging.WARNING, "ERROR": logging.ERROR}
+MAX_BATCH = 512
+
+# (created, level, service, message, fields)
+Record = Tuple[float, str, str, str, Dict[str, Any]]
+
+_encoder = json.JSONEncoder(ensure_ascii=False, check_circular=False, separators=(",", ":"), default=str)
+
+
+def parse_level(name: str) -> int:
+    try:
+        return LEVELS[name.upper()]
+    except KeyError:
+        raise ValueError(f"Unknown log level {name!r}, expected one of {', '.join(LEVELS)}") from None
+
+
+def parse_sample_rates(spec: Optional[str]) -> Dict[str, float]:
+    """"event=rate,event=rate" as a dict, event names may contain spaces"""
+    rates = {}
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        event, sep, rate = item.rpartition("=")
+        if not sep:
+            raise ValueError(f"Expected event=rate in LOG_SAMPLE_RATES, got {item!r}")
+        rates[event.strip()] = float(rate)
+    return rates
+
+
+class _Flush:
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class LogWriter:
+    def __init__(self, stream: Optional[TextIO] = None, max_queue: int = 10000):
+        # None writes to whatever sys.stdout is at the time
+        self.stream = stream
+        self.max_queue = max_queue
+        # Approximate, increments from racing threads may be lost
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._queue: "queue.Queue" = queue.Queue(max_queue)
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_pid: Optional[int] = None
+        self._second = -1
+        self._second_text = ""
+        atexit.register(self.flush)
+
+    def _ensure_worker(self) -> None:
+        # Threads don't survive a fork, so gunicorn workers start their own
+        if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive() or self._worker_pid != os.getpid():
+                if self._worker_pid != os.getpid():
+                    self._queue = queue.Queue(self.max_queue)
+                self._worker = threading.Thread(target=self._run, name="structured-log-writer", daemon=True)
+                self._worker_pid = os.getpid()
+                self._worker.start()
+
+    def put(self, record: Record) -> None:
+        """Never blocks, a record that doesn't fit in the queue is dropped"""
+        if sys.is_finalizing():
+            # Starting a thread during interpreter shutdown can hang the exit, and a
+            # running one may be stopped before it drains, so late records (often
+            # from __del__ methods) are written here
+            self._write([self.format(record)])
+            return
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout: float = 2.0) -> None:
+        """Waits until the records queued so far by this process are written"""
+        if self._worker is None or not self._worker.is_alive() or self._worker_pid != os.getpid():
+            return
+        marker = _Flush()
+        try:
+            self._queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return
+        marker.done.wait(timeout)
+
+    def _timestamp(self, created: float) -> str:
+        """ISO 8601 UTC with microseconds, the seconds part is formatted once per second"""
+        second = int(created)
+        if second != self._second:
+            self._second_text = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+            self._second = second
+        return f"{self._second_text}.{int((created - second) * 1e6):06d}"
+
+    def format(self, record: Record) -> str:
+        created, level, service, message, fields = record
+        entry = {"timestamp": self._timestamp(created), "level": level, "service": service, "message": message}
+        entry.update(fields)
+        try:
+            return _encoder.encode(entry)
+        except (TypeError, ValueError, RecursionError) as e:
+            return _encoder.encode({"timestamp": entry["timestamp"], "level": level, "service": service,
+                                    "message": message, "log_error": str(e)})
+
+    def _write(self, lines: List[str]) -> None:
+        stream = self.stream or sys.stdout
+        try:
+            stream.write("\n".join(lines) + "\n")
+            stream.flush()
+        except (OSError, ValueError):
+            # stdout closed or gone, nowhere left to report it
+            pass
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            markers = []
+            for item in batch:
+                if isinstance(item, _Flush):
+                    markers.append(item)
+                else:
+                    lines.append(self.format(item))
+            dropped = self.dropped
+            if dropped != self._reported_dropped:
+                lines.append(self.format((time.time(), "WARNING", "structured_logging", "Dropped log records",
+                                          {"dropped": dropped - self._reported_dropped, "total_dropped": dropped})))
+                self._reported_dropped = dropped
+            if lines:
+                self._write(lines)
+            for marker in markers:
+                marker.done.set()
+
+
+writer = LogWriter()
+
+
+class StructuredLogger:
+    def __init__(self, service: str, level: Optional[str] = None,
+                 sample_rates: Optional[Dict[str, float]] = None, log_writer: Optional[LogWriter] = None):
+        self.service = service
+        self.level = parse_level(level or os.getenv("LOG_LEVEL", "INFO"))
+        self.sample_rates = {**(sample_rates or {}), **parse_sample_rates(os.getenv("LOG_SAMPLE_RATES"))}
+        self.writer = log_writer or writer
+
+    def enabled(self, level: str) -> bool:
+        """For callers that would do real work to build a record's fields"""
+        return LEVELS[level] >= self.level
+
+    def sample(self, event: str) -> Tuple[bool, Optional[float]]:
+        """Whether to keep one record of the event, and the rate it was sampled at"""
+        rate = self.sample_rates.get(event)
+        if rate is None:
+            return True, None
+        return random.random() < rate, rate
+
+    def _log(self, levelno: int, level: str, message: str, fields: Dict[str, Any]) -> None:
+        if levelno < self.level:
+            return
+        keep, rate = self.sample(message)
+        if not keep:
+            return
+        if rate is not None:
+            fields["sample_rate"] = rate
+        for key, value in fields.items():
+            if callable(value):
+                fields[key] = value()
+        self.writer.put((time.time(), level, self.service, message, fields))
+
+    def debug(self, message: str, **fields: Any) -> None:
+        self._log(logging.DEBUG, "DEBUG", message, fields)
+
+    def info(self, message: str, **fields: Any) -> None:
+        self._log(logging.INFO, "INFO", message, fields)
+
+    def warning(self, message: str, **fields: Any) -> None:
+        self._log(logging.WARNING, "WARNING", message, fields)
+
+    def error(self, message: str, **fields: Any) -> None:
+        self._log(logging.ERROR, "ERROR", message, fields)
+
+
+class StructuredHandler(logging.Handler):
+    """Hands standard logging records to a StructuredLogger's writer"""
+    def __init__(self, logger: StructuredLogger):
+        super().__init__(logger.level)
+        self.logger = logger
+        self._formatter = logging.Formatter()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            keep, rate = self.logger.sample(str(record.msg))
+            if not keep:
+                return
+            fields: Dict[str, Any] = {"logger": record.name}
+            if rate is not None:
+                fields["sample_rate"] = rate
+            if record.exc_info:
+                fields["exception"] = self._formatter.formatException(record.exc_info)
+            # Formatted here, the arguments may change once the caller moves on
+            self.logger.writer.put((record.created, record.levelname, self.logger.service,
+                                    record.getMessage(), fields))
+        except Exception:
+            self.handleError(record)
+
+
+def configure(service: str, level: Optional[str] = None,
+              sample_rates: Optional[Dict[str, float]] = None) -> StructuredLogger:
+    """The service's StructuredLogger, with the root logger writing through it"""
+    logger = StructuredLogger(service, level, sample_rates)
+    root = logging.getLogger()
+    root.handlers[:] = [StructuredHandler(logger)]
+    root.setLevel(logger.level)
+    return logger
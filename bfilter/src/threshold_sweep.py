@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Threshold and score calibration sweeps for the bfilter cascade.
+
+Messages are scored once and the score vectors cached:
+- jailbreaks.csv by its out-of-fold scores, which dataprep.py saves to
+  cascade_scores.npz next to the model (no model that scored a message
+  was trained on it)
+- each --holdout CSV (class,text) by the shipped model, cached in
+  --cache-dir under the file's content hash and the model version
+
+Everything after that is NumPy over the score vectors (cascade.sweep and
+cascade.cascade_grid): precision, recall and error rates of --points
+thresholds, and every (pass, block) pair of them with the jailbreaks that
+skip sfilter, the benign messages blocked, the share escalated to sfilter
+and the expected filtering latency, bfilter_ms + escalation_rate *
+sfilter_ms. The frontier holds, for each escalation rate, the pair with the
+fewest errors (fnr + fpr) at or under it. They are written to --out-dir as
+block_curve.csv, pass_curve.csv and frontier.csv.
+
+Thresholds are picked on the out-of-fold scores, either the way dataprep.py
+does (--target-fnr / --target-fpr) or as the pair with the fewest errors
+within --max-escalation or --latency-budget-ms, and are then reported on
+every holdout file. With --calibration, an isotonic or Platt map from
+scores to probabilities is fitted first, and the sweep runs on calibrated
+scores. The map's Brier score is cross-fitted, so it is not graded on the
+scores it was fitted to. An isotonic map is a step function, which leaves
+fewer distinct thresholds to choose from than Platt's sigmoid. --write
+stores the picked thresholds and the calibration in the model's
+cascade.json, and server.py applies both.
+
+    python threshold_sweep.py --model-dir . --holdout last_week.csv --latency-budget-ms 30 --calibration isotonic --write
+"""
+
+import argparse
+import hashlib
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from cascade import (CASCADE_FILE, SCORE_CALIBRATION_METHODS, SCORES_FILE, apply_score_calibration,
+                     calibrate_thresholds, cascade_grid, load_scores, load_thresholds, save_scores,
+                     save_thresholds, sweep)
+from lookup_scorer import load_model_files
+from normalize import normalize
+
+CALIBRATION_FOLDS = 5
+# Escalation rates listed in the printed summary of the frontier
+SUMMARY_ESCALATION = (0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6)
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=8)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def score_file(model: Tuple[Any, Any, Any], version: str, path: str, cache_dir: str,
+               chunk_size: int = 50000) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Raw scores and spam labels of a class,text CSV, from the cache when this
+    model has scored it before. Messages with nothing left after normalizing
+    are left out: the server escalates them whatever the thresholds.
+    """
+    cache_path = os.path.join(cache_dir, f"{os.path.basename(path)}.{file_digest(path)}.{version}.npz")
+    if os.path.exists(cache_path):
+        scores, is_spam, _ = load_scores(cache_path)
+        return scores, is_spam
+    scorer, clf, cv = model
+    scores, is_spam = [], []
+    for chunk in pd.read_csv(path, usecols=["class", "text"], dtype=str, keep_default_na=False,
+                             chunksize=chunk_size):
+        processed = [normalize(text) for text in chunk["text"]]
+        chunk_scores = scorer.score_batch(processed) if scorer is not None else \
+            clf.predict_proba(cv.transform(processed))[:, 1]
+        scored = np.array([bool(text) for text in processed], dtype=bool)
+        scores.append(chunk_scores[scored])
+        is_spam.append(chunk["class"].str.strip().to_numpy()[scored] == "spam")
+    scores, is_spam = np.concatenate(scores), np.concatenate(is_spam)
+    os.makedirs(cache_dir, exist_ok=True)
+    save_scores(scores, is_spam, cache_path, version=version, data=os.path.basename(path))
+    return scores, is_spam
+
+
+def fit_score_calibration(scores: np.ndarray, is_spam: np.ndarray, method: str) -> Dict[str, Any]:
+    """Score calibration in the form cascade.apply_score_calibration reads"""
+    if method == "isotonic":
+        from sklearn.isotonic import IsotonicRegression
+        isotonic = IsotonicRegression(y_min=0.0, y_max=1.0, out_of_bounds="clip").fit(scores, is_spam)
+        return {"method": "isotonic", "x": isotonic.X_thresholds_.tolist(), "y": isotonic.y_thresholds_.tolist()}
+    from sklearn.linear_model import LogisticRegression
+    clipped = np.clip(scores, 1e-15, 1 - 1e-15)
+    platt = LogisticRegression(C=1e6).fit(np.log(clipped / (1 - clipped))[:, None], is_spam)
+    return {"method": "platt", "a": float(platt.coef_[0][0]), "b": float(platt.intercept_[0])}
+
+
+def cross_fitted(scores: np.ndarray, is_spam: np.ndarray, method: str) -> np.ndarray:
+    """Each score calibrated by a map fitted on the other folds"""
+    folds = np.random.default_rng(0).permutation(len(scores)) % CALIBRATION_FOLDS
+    calibrated = np.zeros(len(scores))
+    for fold in range(CALIBRATION_FOLDS):
+        held_out = folds == fold
+        calibration = fit_score_calibration(scores[~held_out], is_spam[~held_out], method)
+        calibrated[held_out] = apply_score_calibration(scores[held_out], calibration)
+    return calibrated
+
+
+def threshold_grid(scores: np.ndarray, points: int) -> np.ndarray:
+    """Quantiles of the scores, plus thresholds that pass and block nothing"""
+    quantiles = np.quantile(scores, np.linspace(0.0, 1.0, points))
+    return np.unique(np.concatenate([[0.0], quantiles, [np.nextafter(scores.max(), np.inf)]]))
+
+
+def frontier(grid: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """For each escalation rate, the (pass, block) pair with the fewest errors at or under it"""
+    escalation = grid["escalation_rate"].ravel()
+    valid = ~np.isnan(escalation)
+    cells = np.flatnonzero(valid)
+    errors = (grid["fnr"] + grid["fpr"]).ravel()[cells]
+    order = np.lexsort((errors, escalation[cells]))
+    best_so_far = np.minimum.accumulate(errors[order])
+    improves = errors[order] < np.concatenate([[np.inf], best_so_far[:-1]])
+    pass_idx, block_idx = np.unravel_index(cells[order][improves], grid["escalation_rate"].shape)
+    return pd.DataFrame({
+        "escalation_rate": grid["escalation_rate"][pass_idx, block_idx],
+        "latency_ms": grid["latency_ms"][pass_idx, block_idx],
+        "fnr": grid["fnr"][pass_idx, block_idx],
+        "fpr": grid["fpr"][pass_idx, block_idx],
+        "pass_threshold": grid["pass_threshold"][pass_idx],
+        "block_threshold": grid["block_threshold"][block_idx],
+    })
+
+
+def operating_point(scores: np.ndarray, is_spam: np.ndarray, pass_threshold: float, block_threshold: float,
+                    bfilter_ms: float, sfilter_ms: float) -> Dict[str, Any]:
+    """The fields of calibrate_thresholds for given thresholds, and the expected latency"""
+    positive, negative = scores[is_spam], scores[~is_spam]
+    escalation = float(np.mean((scores >= pass_threshold) & (scores < block_threshold)))
+    return {
+        "pass_threshold": float(pass_threshold),
+        "block_threshold": float(block_threshold),
+        "fnr": float(np.mean(positive < pass_threshold)),
+        "fpr": float(np.mean(negative >= block_threshold)),
+        "benign_offload_rate": float(np.mean(negative < pass_threshold)),
+        "escalation_rate": escalation,
+        "latency_ms": bfilter_ms + escalation * sfilter_ms,
+        "positives": int(len(positive)),
+        "negatives": int(len(negative)),
+    }
+
+
+def describe(name: str, point: Dict[str, Any]) -> str:
+    return (f"{name:>24}: fnr {point['fnr']:.2%}  fpr {point['fpr']:.2%}  escalated {point['escalation_rate']:.1%}  "
+            f"benign offload {point['benign_offload_rate']:.1%}  {point['latency_ms']:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep the bfilter cascade thresholds and score calibration")
+    parser.add_argument("--model-dir", default=".", help="Directory holding dataprep.py's output")
+    parser.add_argument("--holdout", nargs="*", default=[], help="class,text CSVs to report the thresholds on")
+    parser.add_argument("--cache-dir", help="Where holdout scores are cached, default <model-dir>/sweep_cache")
+    parser.add_argument("--out-dir", default="sweep", help="Where the curve CSVs are written")
+    parser.add_argument("--points", type=int, default=5000, help="Thresholds of the block and pass curves")
+    parser.add_argument("--grid-points", type=int, default=1000,
+                        help="Thresholds of the (pass, block) grid, which has grid-points^2 pairs")
+    parser.add_argument("--bfilter-ms", type=float, default=1.0, help="bfilter latency per message")
+    parser.add_argument("--sfilter-ms", type=float, default=75.0, help="sfilter latency per escalated message")
+    parser.add_argument("--target-fnr", type=float, default=float(os.getenv("CASCADE_TARGET_FNR", "0.01")))
+    parser.add_argument("--target-fpr", type=float, default=float(os.getenv("CASCADE_TARGET_FPR", "0.01")))
+    parser.add_argument("--max-escalation", type=float, help="Pick the fewest errors escalating at most this share")
+    parser.add_argument("--latency-budget-ms", type=float, help="Same, as an expected latency per message")
+    parser.add_argument("--calibration", choices=SCORE_CALIBRATION_METHODS, help="Fit a score calibration first")
+    parser.add_argument("--write", action="store_true", help="Store the thresholds and calibration in cascade.json")
+    args = parser.parse_args()
+    if args.max_escalation is not None and args.latency_budget_ms is not None:
+        parser.error("Pass --max-escalation or --latency-budget-ms, not both")
+
+    ####################
+    # Score vectors, computed once
+    start = time.perf_counter()
+    scores, is_spam, saved = load_scores(os.path.join(args.model_dir, SCORES_FILE))
+    model = load_model_files(args.model_dir)
+    version = model[0].version if model[0] is not None else "pickle"
+    if saved.get("version") != version:
+        print(f"Warning: {SCORES_FILE} was saved for model {saved.get('version')}, the model is {version}")
+    cache_dir = args.cache_dir or os.path.join(args.model_dir, "sweep_cache")
+    holdouts = {path: score_file(model, version, path, cache_dir) for path in args.holdout}
+    print(f"Scores of {len(scores)} out-of-fold and {sum(len(s) for s, _ in holdouts.values())} holdout "
+          f"messages in {time.perf_counter() - start:.2f}s")
+
+    ####################
+    # Calibration, fitted on the out-of-fold scores
+    calibration: Optional[Dict[str, Any]] = None
+    if args.calibration:
+        start = time.perf_counter()
+        brier_raw = float(np.mean((scores - is_spam) ** 2))
+        brier_calibrated = float(np.mean((cross_fitted(scores, is_spam, args.calibration) - is_spam) ** 2))
+        calibration = fit_score_calibration(scores, is_spam, args.calibration)
+        scores = apply_score_calibration(scores, calibration)
+        holdouts = {path: (apply_score_calibration(s, calibration), labels) for path, (s, labels) in holdouts.items()}
+        print(f"{args.calibration} calibration in {time.perf_counter() - start:.2f}s, Brier score {brier_raw:.4f} "
+              f"raw, {brier_calibrated:.4f} calibrated (cross-fitted)")
+
+    ####################
+    # Sweeps
+    start = time.perf_counter()
+    positive, negative = scores[is_spam], scores[~is_spam]
+    curve = pd.DataFrame(sweep(positive, negative, threshold_grid(scores, args.points)))
+    thresholds = threshold_grid(scores, args.grid_points)
+    grid = cascade_grid(positive, negative, thresholds, args.bfilter_ms, args.sfilter_ms)
+    best = frontier(grid)
+    elapsed = time.perf_counter() - start
+    print(f"Swept {len(curve)} thresholds and {len(thresholds) ** 2} pass/block pairs in {elapsed * 1000:.0f} ms")
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    curve[["threshold", "precision", "recall", "fpr", "flagged_rate"]].to_csv(
+        os.path.join(args.out_dir, "block_curve.csv"), index=False)
+    curve[["threshold", "fnr", "benign_offload_rate", "flagged_rate"]].to_csv(
+        os.path.join(args.out_dir, "pass_curve.csv"), index=False)
+    best.to_csv(os.path.join(args.out_dir, "frontier.csv"), index=False)
+
+    print(f"\n{'escalated':>10} {'latency_ms':>11} {'fnr':>7} {'fpr':>7} {'pass':>12} {'block':>12}")
+    # Budgets picking the same frontier row, common after isotonic calibration, print it once
+    printed = set()
+    for budget in SUMMARY_ESCALATION:
+        within = best[best["escalation_rate"] <= budget]
+        if within.empty or within.index[-1] in printed:
+            continue
+        printed.add(within.index[-1])
+        row = within.iloc[-1]
+        print(f"{row['escalation_rate']:>10.1%} {row['latency_ms']:>11.1f} {row['fnr']:>7.2%} {row['fpr']:>7.2%} "
+              f"{row['pass_threshold']:>12.6g} {row['block_threshold']:>12.6g}")
+
+    ####################
+    # Pick
+    max_escalation = args.max_escalation
+    if args.latency_budget_ms is not None:
+        max_escalation = (args.latency_budget_ms - args.bfilter_ms) / args.sfilter_ms
+    if max_escalation is not None:
+        within = best[best["escalation_rate"] <= max_escalation]
+        if within.empty:
+            parser.error(f"No thresholds escalate at most {max_escalation:.1%}")
+        picked = within.iloc[-1]
+        pass_threshold, block_threshold = picked["pass_threshold"], picked["block_threshold"]
+        selection: Dict[str, Any] = {"mode": "budget", "max_escalation": max_escalation}
+    else:
+        targets = calibrate_thresholds(positive, negative, target_fnr=args.target_fnr, target_fpr=args.target_fpr)
+        pass_threshold, block_threshold = targets["pass_threshold"], targets["block_threshold"]
+        selection = {"mode": "targets", "target_fnr": args.target_fnr, "target_fpr": args.target_fpr}
+
+    print(f"\nPicked pass_threshold {pass_threshold:.6g}, block_threshold {block_threshold:.6g}")
+    point = operating_point(scores, is_spam, pass_threshold, block_threshold, args.bfilter_ms, args.sfilter_ms)
+    print(describe("out-of-fold", point))
+    for path, (holdout_scores, holdout_spam) in holdouts.items():
+        print(describe(os.path.basename(path), operating_point(holdout_scores, holdout_spam, pass_threshold,
+                                                                block_threshold, args.bfilter_ms, args.sfilter_ms)))
+
+    if args.write:
+        cascade_path = os.path.join(args.model_dir, CASCADE_FILE)
+        cascade = load_thresholds(cascade_path) or {}
+        cascade.update({key: value for key, value in point.items() if key != "latency_ms"})
+        # dataprep.py's targets only describe thresholds picked by them
+        for key in ("target_fnr", "target_fpr"):
+            cascade.pop(key, None)
+        cascade.update({key: value for key, value in selection.items() if key != "mode"})
+        cascade["selection"] = selection["mode"]
+        if calibration is None:
+            cascade.pop("score_calibration", None)
+        else:
+            cascade["score_calibration"] = calibration
+        save_thresholds(cascade, cascade_path)
+        print(f"Wrote {cascade_path}")
+
+
+if __name__ == "__main__":
+    main()
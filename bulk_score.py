@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Offline bulk scoring of logged messages with the bfilter or sfilter model,
+for rescoring a message log after a model or threshold change without
+going through /handle or calling any downstream service.
+
+    python bulk_score.py --model bfilter --model-dir models/ --input prompts.csv --output bfilter.csv
+    SECONDARY_MODEL=jackhhao/jailbreak-classifier \\
+        python bulk_score.py --model sfilter --input prompts.jsonl --output sfilter.jsonl
+
+The input is a CSV with a text column, or JSONL with a text field, named
+by --text-field. It is read in chunks of --chunk-size rows, so memory does
+not grow with the size of the log.
+
+Models are loaded by the services' own code, without importing their
+server.py, which loads the model and starts serving on import:
+
+- bfilter: lookup_scorer.load_model_files on --model-dir, the directory
+  dataprep.py wrote. Chunks are normalized and scored on a pool of
+  --workers processes, each mapping the same scorer.bin.
+- sfilter: model_loader.load_classifier, configured from the same
+  SECONDARY_MODEL and SFILTER_* variables as the service. It runs in this
+  process on --workers torch threads. Each call gets a whole chunk, so
+  the length buckets fill up before the --batch-size forward batches run.
+
+The output has one row per input row, in input order, as CSV or JSONL
+depending on the output file's extension. Each row holds:
+
+- row: the 0-based input row
+- the --id-field value, when one is given
+- for bfilter: bfilter_score, calibrated when cascade.json has a
+  score_calibration (threshold_sweep.py), and bfilter_zone, the cascade
+  zone under the cascade.json thresholds or --pass-threshold /
+  --block-threshold
+- for sfilter: sfilter_label, sfilter_score and sfilter_jailbreak
+
+Empty messages score as the services answer them: UNSCORED (-1.0) and
+zone escalate in bfilter, and label "empty" in sfilter.
+
+After each chunk is written and fsynced, <output>.checkpoint records the
+rows done and the output size. --resume cuts the output back to that size,
+which drops a chunk left half written by an interrupted run, and skips the
+rows already done. It only resumes a run with the same input and model.
+Throughput in rows per second is reported as chunks complete and at the end.
+"""
+
+import argparse
+import csv
+import hashlib
+import io
+import itertools
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SERVICES = ("bfilter", "sfilter")
+CHECKPOINT_SUFFIX = ".checkpoint"
+
+# (first row, texts, ids) of one chunk of the input
+Chunk = Tuple[int, List[str], Optional[List[Any]]]
+
+# bfilter model of each pool worker, set by _init_bfilter
+_bfilter_model = None
+
+
+def input_format(path: str) -> str:
+    return "jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv"
+
+
+def read_chunks(path: str, chunk_size: int, text_field: str, id_field: Optional[str], skip: int = 0) -> Iterator[Chunk]:
+    """Chunks of the input from row skip on. Rows are skipped after parsing, since a quoted newline spans lines."""
+    if input_format(path) == "csv":
+        columns = [text_field] + ([id_field] if id_field else [])
+        frames = (
+            (frame[text_field].tolist(), frame[id_field].tolist() if id_field else None)
+            for frame in pd.read_csv(path, usecols=columns, dtype=str, keep_default_na=False, chunksize=chunk_size)
+        )
+    else:
+        def jsonl_frames():
+            with open(path, encoding="utf-8") as f:
+                records = (json.loads(line) for line in f if line.strip())
+                while True:
+                    batch = list(itertools.islice(records, chunk_size))
+                    if not batch:
+                        return
+                    yield ([str(record.get(text_field) or "") for record in batch],
+                           [record.get(id_field) for record in batch] if id_field else None)
+        frames = jsonl_frames()
+
+    start = 0
+    for texts, ids in frames:
+        end = start + len(texts)
+        if end > skip:
+            offset = max(skip - start, 0)
+            yield start + offset, texts[offset:], ids[offset:] if ids is not None else None
+        start = end
+
+
+def ordered_map(fn: Callable, chunks: Iterator[Chunk], pool: Optional[Pool], window: int) -> Iterator[Tuple[Chunk, Any]]:
+    """fn over the texts of each chunk, on the pool when there is one, keeping at most window chunks in flight"""
+    if pool is None:
+        for chunk in chunks:
+            yield chunk, fn(chunk[1])
+        return
+    while True:
+        batch = list(itertools.islice(chunks, window))
+        if not batch:
+            return
+        yield from zip(batch, pool.imap(fn, [chunk[1] for chunk in batch]))
+
+
+####################
+# bfilter
+
+def _init_bfilter(model_dir: str) -> None:
+    global _bfilter_model
+    from lookup_scorer import load_model_files
+    _bfilter_model = load_model_files(model_dir)
+
+
+def _score_bfilter(texts: List[str]) -> np.ndarray:
+    from cascade import UNSCORED
+    from normalize import normalize
+    scorer, clf, cv = _bfilter_model
+    processed = [normalize(text) for text in texts]
+    if scorer is not None:
+        scores = scorer.score_batch(processed)
+    else:
+        scores = clf.predict_proba(cv.transform(processed))[:, 1]
+    # As in the server, a message with nothing left after normalizing is unscored
+    scores[np.array([not text for text in processed], dtype=bool)] = UNSCORED
+    return scores
+
+
+def bfilter_scorer(args: argparse.Namespace):
+    """Column names, the chunk scoring function, a version for the checkpoint and the pool to score on"""
+    from cascade import (CASCADE_FILE, UNSCORED, ZONE_BLOCK, ZONE_ESCALATE, ZONE_PASS, apply_score_calibration,
+                         load_thresholds)
+
+    _init_bfilter(args.model_dir)
+    scorer, clf, _ = _bfilter_model
+    version = scorer.version if scorer is not None else f"pickle:{os.path.getmtime(os.path.join(args.model_dir, 'model.pkl'))}"
+    calibration = load_thresholds(os.path.join(args.model_dir, CASCADE_FILE)) or {}
+    pass_threshold = args.pass_threshold if args.pass_threshold is not None else float(
+        os.getenv("BFILTER_PASS_THRESHOLD", calibration.get("pass_threshold", 0.0)))
+    block_threshold = args.block_threshold if args.block_threshold is not None else float(
+        os.getenv("BFILTER_THRESHOLD", calibration.get("block_threshold", 0.9)))
+    # As in the server, the built-in model's scores go through cascade.json's score calibration
+    score_calibration = calibration.get("score_calibration")
+    print(f"bfilter model {version}, pass below {pass_threshold:.6g}, block from {block_threshold:.6g}, "
+          f"{score_calibration['method'] if score_calibration else 'uncalibrated'} scores", file=sys.stderr)
+    # A resumed run must keep the zones and scores of the rows already written
+    settings = json.dumps([pass_threshold, block_threshold, score_calibration]).encode()
+    version = f"{version}:{hashlib.blake2b(settings, digest_size=6).hexdigest()}"
+
+    def columns(scores: np.ndarray) -> Dict[str, List[Any]]:
+        unscored = scores == UNSCORED
+        scores = np.where(unscored, UNSCORED, apply_score_calibration(scores, score_calibration))
+        # cascade.zone over a whole chunk
+        zones = np.where(unscored, ZONE_ESCALATE,
+                         np.where(scores >= block_threshold, ZONE_BLOCK,
+                                  np.where(scores < pass_threshold, ZONE_PASS, ZONE_ESCALATE)))
+        return {"bfilter_score": scores.tolist(), "bfilter_zone": zones.tolist()}
+
+    pool = Pool(args.workers, initializer=_init_bfilter, initargs=(args.model_dir,)) if args.workers > 1 else None
+    return columns, _score_bfilter, version, pool
+
+
+####################
+# sfilter
+
+def sfilter_scorer(args: argparse.Namespace):
+    import torch
+    from model_loader import load_classifier
+
+    model_name = os.getenv("SECONDARY_MODEL")
+    if not model_name:
+        raise ValueError("SECONDARY_MODEL environment variable is not set.")
+    torch.set_num_threads(args.workers)
+    backend_name = os.getenv("SFILTER_BACKEND", "torch").lower()
+    student_low = os.getenv("SFILTER_STUDENT_LOW")
+    student_high = os.getenv("SFILTER_STUDENT_HIGH")
+    _, _, classifier = load_classifier(
+        model_name,
+        backend_name,
+        onnx_path=os.getenv("SFILTER_ONNX_PATH"),
+        ort_threads=int(os.getenv("SFILTER_ORT_THREADS", "0")) or args.workers,
+        max_length=int(os.getenv("SFILTER_MAX_LENGTH", "512")),
+        length_buckets=[int(b) for b in os.getenv("SFILTER_LENGTH_BUCKETS", "16,32,64,128,256,512").split(",") if b.strip()],
+        truncation=os.getenv("SFILTER_TRUNCATION", "head").lower(),
+        head_tokens=int(os.getenv("SFILTER_HEAD_TOKENS", "128")),
+        student_path=os.getenv("SFILTER_STUDENT_PATH"),
+        student_low=float(student_low) if student_low else None,
+        student_high=float(student_high) if student_high else None
+    )
+    version = f"{model_name}:{backend_name}:{os.getenv('SFILTER_STUDENT_PATH') or 'no-student'}"
+    print(f"sfilter model {version}, {args.workers} threads", file=sys.stderr)
+
+    def score(texts: List[str]) -> List[Dict[str, Any]]:
+        # As in /batch, blank messages never reach the classifier
+        results = [{"label": "empty", "score": 0.0} for _ in texts]
+        pending = [i for i, text in enumerate(texts) if text.strip()]
+        if pending:
+            for i, result in zip(pending, classifier([texts[i] for i in pending], batch_size=args.batch_size)):
+                results[i] = result
+        return results
+
+    def columns(results: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+        return {"sfilter_label": [result["label"] for result in results],
+                "sfilter_score": [result["score"] for result in results],
+                "sfilter_jailbreak": [result["label"] == "jailbreak" for result in results]}
+
+    return columns, score, version, None
+
+
+####################
+# Output and checkpoints
+
+def format_rows(fmt: str, columns: Dict[str, List[Any]], header: bool) -> bytes:
+    names = list(columns)
+    rows = zip(*columns.values())
+    out = io.StringIO()
+    if fmt == "csv":
+        writer = csv.writer(out, lineterminator="\n")
+        if header:
+            writer.writerow(names)
+        writer.writerows(rows)
+    else:
+        for row in rows:
+            out.write(json.dumps(dict(zip(names, row)), ensure_ascii=False))
+            out.write("\n")
+    return out.getvalue().encode("utf-8")
+
+
+def load_checkpoint(path: str) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(path: str, checkpoint: Dict[str, Any]) -> None:
+    """Written to a temporary file and renamed into place, so an interrupted write leaves the previous one"""
+    with open(path + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(path + ".tmp", path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a message log offline with the bfilter or sfilter model")
+    parser.add_argument("--model", choices=SERVICES, required=True)
+    parser.add_argument("--input", required=True, help="CSV or JSONL (.jsonl, .ndjson) message log")
+    parser.add_argument("--output", required=True, help="Scores, as JSONL for a .jsonl or .ndjson name, else CSV")
+    parser.add_argument("--text-field", default="text", help="Column or field holding the message")
+    parser.add_argument("--id-field", help="Column or field copied to the output next to the row number")
+    parser.add_argument("--model-dir", default=".", help="bfilter: directory holding dataprep.py's output")
+    parser.add_argument("--pass-threshold", type=float, help="bfilter: cascade pass threshold, default cascade.json")
+    parser.add_argument("--block-threshold", type=float, help="bfilter: cascade block threshold, default cascade.json")
+    parser.add_argument("--chunk-size", type=int, default=20000,
+                        help="Rows read, scored and checkpointed together")
+    parser.add_argument("--batch-size", type=int, default=64, help="sfilter: messages per forward batch")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="bfilter: scoring processes, sfilter: torch threads")
+    parser.add_argument("--resume", action="store_true", help="Continue from the output's checkpoint")
+    args = parser.parse_args()
+
+    # The services ship modules under the same names (server, metrics, ...), so only one is importable at a time
+    sys.path.insert(0, os.path.join(ROOT, args.model, "src"))
+    checkpoint_path = args.output + CHECKPOINT_SUFFIX
+    fmt = input_format(args.output)
+    checkpoint = load_checkpoint(checkpoint_path) if args.resume else None
+    if args.resume and checkpoint is None:
+        print(f"No checkpoint at {checkpoint_path}, starting from the first row", file=sys.stderr)
+
+    columns, score, version, pool = (bfilter_scorer if args.model == "bfilter" else sfilter_scorer)(args)
+    run = {"input": os.path.abspath(args.input), "model": args.model, "version": version, "id_field": args.id_field}
+    if checkpoint is not None:
+        mismatched = [key for key, value in run.items() if checkpoint.get(key) != value]
+        if mismatched:
+            parser.error(f"Checkpoint {checkpoint_path} is for a different run ({', '.join(mismatched)} differ)")
+
+    done = checkpoint["rows"] if checkpoint else 0
+    out = open(args.output, "r+b" if checkpoint else "wb")
+    try:
+        if checkpoint:
+            out.truncate(checkpoint["output_bytes"])
+            out.seek(checkpoint["output_bytes"])
+            print(f"Resuming after {done} rows", file=sys.stderr)
+        start = time.perf_counter()
+        scored = 0
+        chunks = read_chunks(args.input, args.chunk_size, args.text_field, args.id_field, skip=done)
+        for (first, texts, ids), result in ordered_map(score, chunks, pool, 2 * args.workers):
+            rows = {"row": list(range(first, first + len(texts)))}
+            if ids is not None:
+                rows[args.id_field] = ids
+            rows.update(columns(result))
+            out.write(format_rows(fmt, rows, header=out.tell() == 0))
+            out.flush()
+            os.fsync(out.fileno())
+            done = first + len(texts)
+            scored += len(texts)
+            save_checkpoint(checkpoint_path, {**run, "rows": done, "output_bytes": out.tell()})
+            elapsed = time.perf_counter() - start
+            print(f"{done} rows, {scored / elapsed:.0f} rows/s", file=sys.stderr)
+    finally:
+        out.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    elapsed = time.perf_counter() - start
+    print(f"Scored {scored} rows in {elapsed:.1f}s, {scored / max(elapsed, 1e-9):.0f} rows/s "
+          f"({done} rows in {args.output})")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,11 @@ from flask import Flask
 from flask import request
 import time
 
+from structured_logging import configure
+
+
+# JSON logs written off the request path, Flask's error logs included
+configure("llmstub")
 
 app = Flask(__name__)
 app.start_time = time.time()
@@ -53,6 +53,12 @@ check_prerequisites() {
         exit 1
     fi
     
+    # Services are built from their own directories, each with a copy of the shared modules
+    if ! python3 shared_modules.py check; then
+        log_error "Shared modules differ between services."
+        exit 1
+    fi
+    
     log_info "Prerequisites check passed!"
 }
 
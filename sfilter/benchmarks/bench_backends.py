@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Load time, resident memory and latency of each sfilter inference backend.
+Every backend runs in its own subprocess so RSS isn't shared between them.
+Reports single-message p50/p99 latency and batched throughput on messages
+from sfilter/data/jailbreaks.csv.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def run_backend(args) -> None:
+    import pandas as pd
+    import torch
+
+    sys.path.insert(0, SRC_DIR)
+    from backends import load_backend
+    from classifier import SequenceClassifier
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    messages = pd.read_csv(args.data)["text"].astype(str).tolist()[:args.messages]
+    baseline_rss = rss_mb()
+    start = time.perf_counter()
+    tokenizer, backend = load_backend(args.worker, args.model, torch.device("cpu"),
+                                      onnx_path=args.onnx_path, ort_threads=args.threads or None)
+    classifier = SequenceClassifier(tokenizer, backend, max_length=512)
+    load_s = time.perf_counter() - start
+    classifier(messages[:8], batch_size=8)
+
+    latencies = []
+    for message in messages:
+        start = time.perf_counter()
+        classifier(message)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    start = time.perf_counter()
+    classifier(messages, batch_size=args.batch_size)
+    batch_s = time.perf_counter() - start
+    print(json.dumps({
+        "load_s": load_s,
+        "rss_mb": rss_mb() - baseline_rss,
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1],
+        "batch_msgs_per_s": len(messages) / batch_s,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="sfilter backend benchmark")
+    parser.add_argument("--model", default=os.getenv("SECONDARY_MODEL"), required=os.getenv("SECONDARY_MODEL") is None)
+    parser.add_argument("--data", default=os.path.join(SRC_DIR, "..", "data", "jailbreaks.csv"))
+    parser.add_argument("--backends", default="torch,torch-int8,onnx")
+    parser.add_argument("--onnx-path", default=None)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--threads", type=int, default=0, help="torch / ONNX Runtime intra-op threads, 0 for default")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_backend(args)
+        return
+
+    print(f"{'backend':>10} {'load_s':>8} {'rss_mb':>8} {'p50_ms':>8} {'p99_ms':>8} {'batch_msgs/s':>13}")
+    for name in args.backends.split(","):
+        command = [sys.executable, __file__, "--worker", name, "--model", args.model, "--data", args.data,
+                   "--messages", str(args.messages), "--batch-size", str(args.batch_size),
+                   "--threads", str(args.threads)]
+        if args.onnx_path:
+            command += ["--onnx-path", args.onnx_path]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{name:>10} {result['load_s']:>8.2f} {result['rss_mb']:>8.1f} {result['p50_ms']:>8.2f} "
+              f"{result['p99_ms']:>8.2f} {result['batch_msgs_per_s']:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
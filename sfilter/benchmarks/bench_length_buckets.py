@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Forward-pass cost of length-bucketed dynamic padding versus padding every
+micro-batch to its longest message. Messages from sfilter/data/jailbreaks.csv
+are shuffled into batches of --batch-size, as the micro-batcher would see
+them, and classified both ways. Reports the share of padding tokens and the
+mean time per batch.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+import pandas as pd
+import torch
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+import instrumentation  # noqa: E402
+from backends import BACKENDS, load_backend  # noqa: E402
+from classifier import DEFAULT_LENGTH_BUCKETS, SequenceClassifier  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="sfilter length bucketing benchmark")
+    parser.add_argument("--model", default=os.getenv("SECONDARY_MODEL"), required=os.getenv("SECONDARY_MODEL") is None)
+    parser.add_argument("--data", default=os.path.join(SRC_DIR, "..", "data", "jailbreaks.csv"))
+    parser.add_argument("--backend", choices=BACKENDS, default="torch")
+    parser.add_argument("--messages", type=int, default=512)
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    messages = pd.read_csv(args.data)["text"].astype(str).tolist()
+    random.Random(0).shuffle(messages)
+    messages = messages[:args.messages]
+    batches = [messages[i:i + args.batch_size] for i in range(0, len(messages), args.batch_size)]
+    tokenizer, backend = load_backend(args.backend, args.model, torch.device("cpu"))
+
+    print(f"{'padding':>10} {'padding_share':>14} {'ms/batch':>10}")
+    for name, buckets in (("longest", None), ("bucketed", DEFAULT_LENGTH_BUCKETS)):
+        classifier = SequenceClassifier(tokenizer, backend, max_length=512, length_buckets=buckets)
+        classifier(batches[0])
+        before = instrumentation.registry.totals()
+        timings = []
+        for batch in batches:
+            start = time.perf_counter()
+            classifier(batch)
+            timings.append((time.perf_counter() - start) * 1000)
+        totals = instrumentation.registry.totals() - before
+        real = instrumentation.TOKENS.value(totals, "real")
+        padding = instrumentation.TOKENS.value(totals, "padding")
+        print(f"{name:>10} {padding / max(real + padding, 1):>14.1%} {statistics.mean(timings):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Throughput and tail latency of the sfilter classifier under concurrent load,
+with and without micro-batching. Loads the same classifier as server.py from
+--model (a local HuggingFace model directory or hub id).
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from typing import Dict, List
+
+import pandas as pd
+import torch
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+from backends import BACKENDS, load_backend  # noqa: E402
+from batcher import MicroBatcher  # noqa: E402
+from classifier import SequenceClassifier  # noqa: E402
+
+
+def run_load(batcher: MicroBatcher, messages: List[str], clients: int) -> Dict[str, float]:
+    """Each client thread sends its share of messages back to back"""
+    latencies: List[float] = []
+    lock = threading.Lock()
+
+    def client(share: List[str]) -> None:
+        local = []
+        for message in share:
+            start = time.perf_counter()
+            batcher.classify(message)
+            local.append((time.perf_counter() - start) * 1000)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client, args=(messages[i::clients],)) for i in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "msgs_per_s": len(messages) / elapsed,
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="sfilter micro-batching benchmark")
+    parser.add_argument("--model", default=os.getenv("SECONDARY_MODEL"), required=os.getenv("SECONDARY_MODEL") is None)
+    parser.add_argument("--data", default=os.path.join(SRC_DIR, "..", "data", "jailbreaks.csv"))
+    parser.add_argument("--messages", type=int, default=256)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--batch-sizes", default="1,4,8,16")
+    parser.add_argument("--max-wait-ms", type=float, default=10.0)
+    parser.add_argument("--backend", choices=BACKENDS, default="torch")
+    args = parser.parse_args()
+
+    tokenizer, backend = load_backend(args.backend, args.model, torch.device("cpu"))
+    classifier = SequenceClassifier(tokenizer, backend, max_length=512)
+
+    messages = pd.read_csv(args.data)["text"].astype(str).tolist()[:args.messages]
+    classifier(messages[:8], batch_size=8)
+
+    print(f"torch threads: {torch.get_num_threads()}  clients: {args.clients}  messages: {len(messages)}")
+    print(f"{'max_batch':>9} {'msgs/s':>10} {'p50_ms':>10} {'p99_ms':>10}")
+    for max_batch in (int(b) for b in args.batch_sizes.split(",")):
+        batcher = MicroBatcher(lambda texts: classifier(texts, batch_size=len(texts)),
+                               max_batch_size=max_batch, max_wait_ms=args.max_wait_ms)
+        result = run_load(batcher, messages, args.clients)
+        print(f"{max_batch:>9} {result['msgs_per_s']:>10.1f} {result['p50_ms']:>10.1f} {result['p99_ms']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Memory and startup cost of scaling sfilter gunicorn workers, with and
+without SFILTER_PRELOAD. For every worker count it starts the server the way
+the Dockerfile does, waits for /ready and a few classified requests per worker,
+then sums the master's and the workers' memory from /proc:
+
+- rss: resident pages, counting shared pages once per process
+- pss: shared pages split between the processes mapping them, so the sum is
+  what the instance actually spends
+- private: pages only one process maps, the per-worker copy-on-write cost
+
+Without preload pss grows by a full model per worker; with it the workers
+share the master's weights and only their private pages grow. Loads
+--model (a local HuggingFace model directory or hub id).
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+import requests
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def children(pid: int) -> List[int]:
+    found = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name is parenthesised and may contain spaces
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            found.append(int(entry))
+    return found
+
+
+def memory_mb(pid: int) -> Dict[str, float]:
+    fields = {"Rss:": "rss", "Pss:": "pss", "Private_Clean:": "private", "Private_Dirty:": "private"}
+    totals = {"rss": 0.0, "pss": 0.0, "private": 0.0}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts and parts[0] in fields:
+                totals[fields[parts[0]]] += int(parts[1]) / 1024
+    return totals
+
+
+def run_server(model: str, backend: str, workers: int, preload: bool, timeout: float) -> Dict[str, float]:
+    port = free_port()
+    env = dict(os.environ, SECONDARY_MODEL=model, SFILTER_BACKEND=backend, WEB_CONCURRENCY=str(workers),
+               SFILTER_PRELOAD="true" if preload else "false")
+    command = [sys.executable, "-m", "gunicorn", "-b", f"127.0.0.1:{port}", "server:app", "--threads=4",
+               "--timeout=600"] + (["--preload"] if preload else [])
+    start = time.perf_counter()
+    server = subprocess.Popen(command, cwd=SRC_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with {server.returncode}")
+            if time.perf_counter() - start > timeout:
+                raise RuntimeError("server not ready in time")
+            try:
+                if requests.get(f"{url}/ready", timeout=1).status_code == 200:
+                    break
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        ready = time.perf_counter() - start
+        # Wait for every worker to fork and serve, so their first-request pages are counted
+        while len(children(server.pid)) < workers:
+            time.sleep(0.2)
+        for _ in range(workers * 4):
+            requests.post(url, data={"message": "please summarize this article for me"}, timeout=60)
+        totals = {"rss": 0.0, "pss": 0.0, "private": 0.0}
+        for pid in [server.pid] + children(server.pid):
+            for key, value in memory_mb(pid).items():
+                totals[key] += value
+        totals["ready_s"] = ready
+        return totals
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="sfilter prefork memory benchmark")
+    parser.add_argument("--model", default=os.getenv("SECONDARY_MODEL"), required=os.getenv("SECONDARY_MODEL") is None)
+    parser.add_argument("--backend", default="torch")
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--timeout", type=float, default=600)
+    args = parser.parse_args()
+
+    print(f"{'preload':>8} {'workers':>8} {'ready_s':>8} {'rss_mb':>8} {'pss_mb':>8} {'private_mb':>11}")
+    for preload in (False, True):
+        for workers in (int(w) for w in args.workers.split(",")):
+            result = run_server(args.model, args.backend, workers, preload, args.timeout)
+            print(f"{str(preload):>8} {workers:>8} {result['ready_s']:>8.1f} {result['rss']:>8.0f} "
+                  f"{result['pss']:>8.0f} {result['private']:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
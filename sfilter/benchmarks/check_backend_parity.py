@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Accuracy parity of the quantized and ONNX backends against the fp32 torch
+labels on sfilter/data/jailbreaks.csv. Reports label agreement and the
+largest score drift per backend, and exits non-zero when a backend agrees
+with fp32 on fewer than --min-agreement of the messages.
+"""
+
+import argparse
+import os
+import sys
+from typing import Dict, List
+
+import pandas as pd
+import torch
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+from backends import load_backend  # noqa: E402
+from classifier import SequenceClassifier  # noqa: E402
+
+
+def classify_all(backend_name: str, model: str, messages: List[str], batch_size: int,
+                 onnx_path: str = None) -> List[Dict]:
+    tokenizer, backend = load_backend(backend_name, model, torch.device("cpu"), onnx_path=onnx_path)
+    classifier = SequenceClassifier(tokenizer, backend, max_length=512)
+    return classifier(messages, batch_size=batch_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="sfilter backend parity check")
+    parser.add_argument("--model", default=os.getenv("SECONDARY_MODEL"), required=os.getenv("SECONDARY_MODEL") is None)
+    parser.add_argument("--data", default=os.path.join(SRC_DIR, "..", "data", "jailbreaks.csv"))
+    parser.add_argument("--backends", default="torch-int8,onnx")
+    parser.add_argument("--onnx-path", default=None)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--limit", type=int, default=0, help="only check the first N messages")
+    parser.add_argument("--min-agreement", type=float, default=0.99)
+    args = parser.parse_args()
+
+    messages = pd.read_csv(args.data)["text"].astype(str).tolist()
+    if args.limit:
+        messages = messages[:args.limit]
+
+    reference = classify_all("torch", args.model, messages, args.batch_size)
+    failed = False
+    print(f"{'backend':>10} {'agreement':>10} {'flipped':>8} {'max_score_diff':>15}")
+    for name in args.backends.split(","):
+        results = classify_all(name, args.model, messages, args.batch_size, args.onnx_path)
+        same = [ref["label"] == res["label"] for ref, res in zip(reference, results)]
+        agreement = sum(same) / len(same)
+        score_diff = max((abs(ref["score"] - res["score"]) for ref, res, ok in zip(reference, results, same) if ok),
+                         default=0.0)
+        print(f"{name:>10} {agreement:>10.4%} {len(same) - sum(same):>8} {score_diff:>15.6f}")
+        failed = failed or agreement < args.min_agreement
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Inference backends for the sfilter classifier, chosen with SFILTER_BACKEND.
+
+- torch: the HuggingFace model in fp32 PyTorch (default)
+- torch-int8: the same model with its Linear layers dynamically quantized
+  to int8, which roughly quarters their weight memory and speeds up CPU
+  matmuls
+- onnx: the model exported to ONNX and run by ONNX Runtime with full graph
+  optimizations and SFILTER_ORT_THREADS intra-op threads. The export is
+  written to SFILTER_ONNX_PATH on first load and reused afterwards.
+
+Every backend takes the tokenizer output for its `return_tensors` type and
+returns float32 CPU logits as a torch tensor, so SequenceClassifier's
+softmax/label step is shared.
+
+With gunicorn --preload the backend is built in the master and inherited by
+the forked workers, which call after_fork() before serving. Torch weights
+are plain tensors the workers share copy-on-write. An ONNX Runtime session
+owns thread pools that do not survive a fork, so each worker rebuilds its
+own, and with it its own copy of the weights: the onnx backend is meant for
+a single worker whose micro-batcher serves every request thread.
+"""
+
+import os
+from typing import Any, Dict, Optional
+
+import torch
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+BACKENDS = ("torch", "torch-int8", "onnx")
+
+
+class TorchBackend:
+    return_tensors = "pt"
+
+    def __init__(self, model: Any, device: torch.device):
+        self.model = model.eval().to(device)
+        self.device = device
+        self.config = model.config
+
+    @torch.inference_mode()
+    def forward(self, inputs: Dict[str, Any]) -> torch.Tensor:
+        inputs = {name: tensor.to(self.device) for name, tensor in inputs.items()}
+        # Copying the logits to the CPU waits for the device, so callers time the GPU work too
+        return self.model(**inputs).logits.float().cpu()
+
+    def after_fork(self) -> None:
+        """Nothing to rebuild, inference never writes to the shared weight pages"""
+
+
+class QuantizedTorchBackend(TorchBackend):
+    """Dynamic int8 quantization of the Linear layers, CPU only"""
+    def __init__(self, model: Any):
+        quantized = torch.ao.quantization.quantize_dynamic(model.eval(), {torch.nn.Linear}, dtype=torch.qint8)
+        super().__init__(quantized, torch.device("cpu"))
+
+
+class OnnxBackend:
+    return_tensors = "np"
+
+    def __init__(self, model_path: str, config: Any, threads: Optional[int] = None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = threads or os.cpu_count() or 1
+        # Requests are already serialized by the micro-batcher, a single inter-op thread avoids oversubscription
+        options.inter_op_num_threads = 1
+        self.model_path = model_path
+        self.options = options
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {node.name for node in self.session.get_inputs()}
+        self.config = config
+
+    def after_fork(self) -> None:
+        """The inherited session would wait on the parent's intra-op threads forever"""
+        import onnxruntime as ort
+
+        self.session = ort.InferenceSession(self.model_path, self.options, providers=["CPUExecutionProvider"])
+
+    def forward(self, inputs: Dict[str, Any]) -> torch.Tensor:
+        feeds = {name: array.astype("int64") for name, array in inputs.items() if name in self.input_names}
+        logits = self.session.run(["logits"], feeds)[0]
+        return torch.from_numpy(logits).float()
+
+
+def export_onnx(model: Any, tokenizer: Any, path: str) -> None:
+    """Exports the classifier with dynamic batch and sequence axes"""
+    sample = tokenizer(["export sample", "a slightly longer export sample"], padding=True, return_tensors="pt")
+    input_names = list(sample.keys())
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["logits"] = {0: "batch"}
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with torch.inference_mode():
+        torch.onnx.export(model.eval(), (dict(sample),), tmp_path, input_names=input_names,
+                          output_names=["logits"], dynamic_axes=dynamic_axes, opset_version=17)
+    os.replace(tmp_path, path)
+
+
+def load_backend(name: str, model_name: str, device: torch.device, onnx_path: Optional[str] = None,
+                 ort_threads: Optional[int] = None):
+    """Returns (tokenizer, backend) for one of BACKENDS"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown SFILTER_BACKEND {name!r}, expected one of {', '.join(BACKENDS)}")
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name)
+    if name == "torch":
+        return tokenizer, TorchBackend(model, device)
+    if name == "torch-int8":
+        return tokenizer, QuantizedTorchBackend(model)
+    onnx_path = onnx_path or os.path.join("/tmp", "sfilter-onnx", f"{model_name.replace('/', '--')}.onnx")
+    if not os.path.exists(onnx_path):
+        export_onnx(model, tokenizer, onnx_path)
+    backend = OnnxBackend(onnx_path, model.config, ort_threads)
+    # The torch weights aren't needed once the session is built
+    del model
+    return tokenizer, backend
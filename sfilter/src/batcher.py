@@ -0,0 +1,105 @@
+"""
+Dynamic micro-batching for the sfilter classifier.
+
+Flask request threads submit single messages; one background worker thread
+drains them into batches of up to max_batch_size messages, waiting at most
+max_wait_ms after the first message of a batch arrives, runs one padded
+forward pass over the batch and hands each result back to its waiting
+request through a Future.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, List, Optional, Tuple
+
+
+class MicroBatcher:
+    def __init__(self, infer: Callable[[List[str]], List[Any]], max_batch_size: int = 16,
+                 max_wait_ms: float = 10.0):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.infer = infer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_pid: Optional[int] = None
+
+    def _ensure_worker(self) -> None:
+        # Threads don't survive a fork, so gunicorn workers start their own
+        if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive() or self._worker_pid != os.getpid():
+                if self._worker_pid != os.getpid():
+                    self._queue = queue.Queue()
+                self._worker = threading.Thread(target=self._run, name="sfilter-microbatch", daemon=True)
+                self._worker_pid = os.getpid()
+                self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        """Queue a message for the next batch, the Future resolves to its classification"""
+        self._ensure_worker()
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def classify(self, text: str, timeout: Optional[float] = None) -> Any:
+        """Blocking helper for request handlers"""
+        future = self.submit(text)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise
+
+    def classify_many(self, texts: List[str], timeout: Optional[float] = None) -> List[Any]:
+        """
+        Blocking helper for a request carrying several messages. They share the
+        queue with every other request, so they are run in batches of at most
+        max_batch_size, and timeout bounds the wait for all of them together.
+        """
+        futures = [self.submit(text) for text in texts]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            return [future.result(timeout=None if deadline is None else max(deadline - time.monotonic(), 0.0))
+                    for future in futures]
+        except FutureTimeoutError:
+            for future in futures:
+                future.cancel()
+            raise
+
+    def _collect(self) -> List[Tuple[str, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    # Window closed, still take whatever is already queued
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            # Skip requests whose caller gave up while waiting in the queue
+            batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                results = self.infer([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,140 @@
+"""
+Text classification for sfilter with the stages the transformers pipeline
+hides made explicit: tokenize, model forward and softmax/label selection.
+
+SequenceClassifier returns the same [{"label": ..., "score": ...}] list as
+pipeline("text-classification") with the top label only, and times every
+stage of every forward batch into the instrumentation histograms. The
+forward pass is delegated to one of the backends in backends.py.
+
+Inputs are length-aware. Messages are tokenized once without padding,
+grouped into length buckets and each bucket is padded only to its own
+longest message, so a long outlier no longer makes every short message in
+the batch pay for its attention cost. Messages over the token budget are
+cut either to their head (the pipeline's behaviour) or, with
+truncation="head_tail", to their first head_tokens plus their last tokens,
+which keeps the instruction at the end of a long prompt in view.
+"""
+
+import bisect
+import time
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import torch
+
+import instrumentation
+
+TRUNCATION_STRATEGIES = ("head", "head_tail")
+DEFAULT_LENGTH_BUCKETS = (16, 32, 64, 128, 256, 512)
+
+
+class SequenceClassifier:
+    def __init__(self, tokenizer: Any, backend: Any, max_length: int = 512,
+                 length_buckets: Optional[Sequence[int]] = DEFAULT_LENGTH_BUCKETS,
+                 truncation: str = "head", head_tokens: int = 128, pad_to_multiple_of: Optional[int] = None):
+        if truncation not in TRUNCATION_STRATEGIES:
+            raise ValueError(f"Unknown truncation {truncation!r}, expected one of {', '.join(TRUNCATION_STRATEGIES)}")
+        self.tokenizer = tokenizer
+        self.backend = backend
+        self.max_length = max_length
+        # No buckets pads every forward batch to its longest message
+        self.length_buckets = sorted(length_buckets) if length_buckets else []
+        self.truncation = truncation
+        self.head_tokens = head_tokens
+        self.pad_to_multiple_of = pad_to_multiple_of
+        config = backend.config
+        self.id2label = config.id2label
+        # Same score function the pipeline picks for the model
+        self.use_sigmoid = config.problem_type == "multi_label_classification" or config.num_labels == 1
+
+    def __call__(self, texts: Union[str, Sequence[str]], batch_size: int = None) -> List[Dict[str, Any]]:
+        if isinstance(texts, str):
+            texts = [texts]
+        if not texts:
+            return []
+        batch_size = batch_size or len(texts)
+        results: List[Optional[Dict[str, Any]]] = [None] * len(texts)
+        with instrumentation.profiler.profile():
+            start = time.perf_counter()
+            sequences = self.encode(texts)
+            encode_time = time.perf_counter() - start
+            for indices in self.buckets(sequences, batch_size):
+                encode_share = encode_time * len(indices) / len(texts)
+                batch_results = self._classify([sequences[i] for i in indices], encode_share)
+                for i, result in zip(indices, batch_results):
+                    results[i] = result
+        return results
+
+    def warm_up(self, batch_sizes: Sequence[int] = (1,)) -> float:
+        """
+        Runs a dummy batch of every length bucket and batch size through the
+        backend, so the allocator, kernel selection and tokenizer state the
+        first real requests would otherwise pay for are set up. Returns the
+        seconds it took.
+        """
+        start = time.perf_counter()
+        lengths = [length for length in self.length_buckets if length <= self.max_length] or [self.max_length]
+        # Cut to exactly each bucket length, keeping the leading and trailing special tokens
+        longest = self.encode([" ".join(["warm up"] * max(lengths))])[0]
+        for length in lengths:
+            sequence = {key: values[:length - 1] + values[-1:] for key, values in longest.items()}
+            for batch_size in batch_sizes:
+                self._classify([sequence] * batch_size, 0.0)
+        return time.perf_counter() - start
+
+    def _truncate(self, sequence: Dict[str, List[int]]) -> Dict[str, List[int]]:
+        """Cuts the message tokens between the leading and trailing special tokens down to the budget"""
+        ids = sequence["input_ids"]
+        if len(ids) <= self.max_length:
+            return sequence
+        special = self.tokenizer.get_special_tokens_mask(ids, already_has_special_tokens=True)
+        start = special.index(0) if 0 in special else len(ids)
+        end = len(ids) - special[::-1].index(0) if 0 in special else len(ids)
+        budget = max(self.max_length - start - (len(ids) - end), 0)
+        content = list(range(start, end))
+        if self.truncation == "head":
+            kept = content[:budget]
+        else:
+            head = min(self.head_tokens, budget)
+            kept = content[:head] + (content[len(content) - (budget - head):] if budget > head else [])
+        positions = list(range(start)) + kept + list(range(end, len(ids)))
+        return {key: [values[p] for p in positions] for key, values in sequence.items()}
+
+    def encode(self, texts: Sequence[str]) -> List[Dict[str, List[int]]]:
+        """Unpadded model inputs per message, truncated to max_length"""
+        encoded = self.tokenizer(list(texts), truncation=False, return_attention_mask=False)
+        keys = list(encoded.keys())
+        return [self._truncate({key: encoded[key][i] for key in keys}) for i in range(len(texts))]
+
+    def buckets(self, sequences: Sequence[Dict[str, List[int]]], batch_size: int) -> List[List[int]]:
+        """Message indices grouped by length bucket, shortest first, at most batch_size per group"""
+        order = sorted(range(len(sequences)), key=lambda i: len(sequences[i]["input_ids"]))
+        groups: List[List[int]] = []
+        current_bucket = None
+        for i in order:
+            bucket = bisect.bisect_left(self.length_buckets, len(sequences[i]["input_ids"]))
+            if bucket != current_bucket or len(groups[-1]) >= batch_size:
+                groups.append([])
+                current_bucket = bucket
+            groups[-1].append(i)
+        return groups
+
+    def _classify(self, sequences: List[Dict[str, List[int]]], encode_time: float) -> List[Dict[str, Any]]:
+        start = time.perf_counter()
+        inputs = self.tokenizer.pad(sequences, padding=True, pad_to_multiple_of=self.pad_to_multiple_of,
+                                    return_tensors=self.backend.return_tensors)
+        tokenized = time.perf_counter()
+        logits = self.backend.forward(dict(inputs))
+        forwarded = time.perf_counter()
+        probs = torch.sigmoid(logits) if self.use_sigmoid else torch.softmax(logits, dim=-1)
+        scores, label_ids = probs.max(dim=-1)
+        results = [{"label": self.id2label[label_id], "score": score}
+                   for label_id, score in zip(label_ids.tolist(), scores.tolist())]
+        real_tokens = sum(len(sequence["input_ids"]) for sequence in sequences)
+        instrumentation.TOKENIZE_LATENCY.observe(encode_time + tokenized - start)
+        instrumentation.FORWARD_LATENCY.observe(forwarded - tokenized)
+        instrumentation.SOFTMAX_LATENCY.observe(time.perf_counter() - forwarded)
+        instrumentation.BATCH_SIZE.observe(len(sequences))
+        instrumentation.REAL_TOKENS.inc(real_tokens)
+        instrumentation.PADDING_TOKENS.inc(inputs["input_ids"].shape[0] * inputs["input_ids"].shape[1] - real_tokens)
+        return results
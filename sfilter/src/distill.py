@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Distils the sfilter transformer into the student served by student.py.
+
+The messages of jailbreaks.csv are split into a training and a held-out
+part. The training messages are augmented with perturbed copies (case
+changes, whitespace noise, character drops/swaps, leetspeak, truncation),
+so the student sees the kind of obfuscation jailbreaks use. Every text is
+labelled by the transformer (the teacher) and a char n-gram TF-IDF +
+logistic regression student is fitted on those labels, weighted by the
+teacher's confidence.
+
+The held-out messages are then scored by both models to report, for
+several uncertainty bands, the share of messages the student answers on
+its own, its agreement with the teacher and accuracy against the dataset
+labels once the rest is escalated, and the expected CPU cost per message.
+The widest band that keeps agreement at or above --min-agreement is saved
+with the student as its serving thresholds.
+
+    python distill.py --model $SECONDARY_MODEL --output student.joblib
+"""
+
+import argparse
+import os
+import random
+import re
+import time
+from typing import Dict, List, Sequence
+
+import numpy as np
+import pandas as pd
+import torch
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import Pipeline
+
+from backends import BACKENDS, load_backend
+from classifier import SequenceClassifier
+from student import StudentModel
+
+JAILBREAK_LABEL = "jailbreak"
+# Probability bands (low, 1 - low) the student defers on, 0.5 lets it decide everything
+BANDS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.3, 0.4, 0.5)
+LEET = str.maketrans({"a": "4", "e": "3", "i": "1", "o": "0", "s": "5", "t": "7"})
+
+
+def _drop_chars(text: str, rng: random.Random, rate: float = 0.03) -> str:
+    return "".join(c for c in text if c.isspace() or rng.random() >= rate)
+
+
+def _swap_chars(text: str, rng: random.Random, rate: float = 0.03) -> str:
+    chars = list(text)
+    for i in range(len(chars) - 1):
+        if rng.random() < rate:
+            chars[i], chars[i + 1] = chars[i + 1], chars[i]
+    return "".join(chars)
+
+
+def _noisy_whitespace(text: str, rng: random.Random) -> str:
+    return re.sub(r"\s+", lambda _: rng.choice((" ", "  ", "\n", "\t", " \n ")), text)
+
+
+def _truncate(text: str, rng: random.Random) -> str:
+    words = text.split()
+    if len(words) < 8:
+        return text
+    keep = rng.randint(len(words) // 2, len(words) - 1)
+    return " ".join(words[:keep] if rng.random() < 0.5 else words[-keep:])
+
+
+AUGMENTATIONS = (
+    lambda text, rng: text.upper(),
+    lambda text, rng: text.lower(),
+    lambda text, rng: text.translate(LEET),
+    _drop_chars,
+    _swap_chars,
+    _noisy_whitespace,
+    _truncate,
+)
+
+
+def augment(texts: Sequence[str], copies: int, seed: int = 0) -> List[str]:
+    """copies perturbed variants of every text, each from a randomly picked augmentation"""
+    rng = random.Random(seed)
+    augmented = []
+    for text in texts:
+        for _ in range(copies):
+            variant = rng.choice(AUGMENTATIONS)(text, rng)
+            if variant.strip() and variant != text:
+                augmented.append(variant)
+    return augmented
+
+
+def teacher_labels(classifier: SequenceClassifier, texts: Sequence[str], batch_size: int):
+    """Teacher jailbreak flags and confidences, and its mean CPU cost per message"""
+    flags, confidences = [], []
+    start = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        for result in classifier(list(texts[i:i + batch_size]), batch_size=batch_size):
+            flags.append(result["label"] == JAILBREAK_LABEL)
+            confidences.append(result["score"])
+    per_message = (time.perf_counter() - start) / max(len(texts), 1)
+    return np.array(flags), np.array(confidences), per_message
+
+
+def train_student(texts: Sequence[str], flags: np.ndarray, weights: np.ndarray, max_features: int) -> Pipeline:
+    pipeline = Pipeline([
+        ("tfidf", TfidfVectorizer(analyzer="char_wb", ngram_range=(2, 5), min_df=2, sublinear_tf=True,
+                                  max_features=max_features, dtype=np.float32)),
+        ("lr", LogisticRegression(C=4.0, max_iter=2000, class_weight="balanced")),
+    ])
+    pipeline.fit(list(texts), flags, lr__sample_weight=weights)
+    return pipeline
+
+
+def tradeoff_report(student_probs: np.ndarray, teacher_flags: np.ndarray, true_flags: np.ndarray,
+                    student_cost: float, teacher_cost: float) -> List[Dict[str, float]]:
+    """Offload, agreement, accuracy and cost per message for every band in BANDS"""
+    rows = []
+    for low in BANDS:
+        decided = (student_probs <= low) | (student_probs >= 1.0 - low)
+        verdicts = np.where(decided, student_probs >= 0.5, teacher_flags)
+        rows.append({
+            "low": low,
+            "high": 1.0 - low,
+            "offload_rate": float(np.mean(decided)),
+            "agreement": float(np.mean(verdicts == teacher_flags)),
+            "accuracy": float(np.mean(verdicts == true_flags)),
+            "cost_ms": 1000.0 * (student_cost + teacher_cost * float(np.mean(~decided))),
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distil the sfilter transformer into a char n-gram student")
+    parser.add_argument("--model", default=os.getenv("SECONDARY_MODEL"), required=os.getenv("SECONDARY_MODEL") is None)
+    parser.add_argument("--data", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "jailbreaks.csv"))
+    parser.add_argument("--backend", choices=BACKENDS, default="torch")
+    parser.add_argument("--output", default="student.joblib")
+    parser.add_argument("--augment", type=int, default=2, help="Perturbed copies per training message")
+    parser.add_argument("--holdout", type=float, default=0.2)
+    parser.add_argument("--min-agreement", type=float, default=0.99,
+                        help="Lowest held-out agreement with the teacher the serving band may have")
+    parser.add_argument("--max-features", type=int, default=200000)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.data)
+    df = df[df["text"].astype(str).str.strip().astype(bool)]
+    texts = df["text"].astype(str).tolist()
+    true_flags = (df["class"].str.strip() == "spam").to_numpy()
+    train_texts, test_texts, _, test_true = train_test_split(
+        texts, true_flags, test_size=args.holdout, stratify=true_flags, random_state=0)
+    train_texts = train_texts + augment(train_texts, args.augment)
+
+    tokenizer, backend = load_backend(args.backend, args.model, torch.device("cpu"))
+    teacher = SequenceClassifier(tokenizer, backend)
+    negative_label = next(label for label in teacher.id2label.values() if label != JAILBREAK_LABEL)
+    print(f"Labelling {len(train_texts)} training texts ({args.augment} augmented copies per message) with the teacher")
+    train_flags, train_confidence, _ = teacher_labels(teacher, train_texts, args.batch_size)
+    test_flags, _, teacher_cost = teacher_labels(teacher, test_texts, args.batch_size)
+
+    pipeline = train_student(train_texts, train_flags, train_confidence, args.max_features)
+    start = time.perf_counter()
+    student_probs = pipeline.predict_proba(test_texts)[:, 1]
+    student_cost = (time.perf_counter() - start) / len(test_texts)
+
+    report = tradeoff_report(student_probs, test_flags, test_true, student_cost, teacher_cost)
+    teacher_accuracy = float(np.mean(test_flags == test_true))
+    print(f"\nHeld-out messages: {len(test_texts)}, teacher accuracy {teacher_accuracy:.2%}, "
+          f"teacher {teacher_cost * 1000:.2f} ms/msg, student {student_cost * 1000:.3f} ms/msg")
+    print(f"{'band':>13} {'offload':>8} {'agreement':>10} {'accuracy':>9} {'ms/msg':>8}")
+    for row in report:
+        print(f"{row['low']:>5.2f}-{row['high']:<7.2f} {row['offload_rate']:>8.1%} {row['agreement']:>10.2%} "
+              f"{row['accuracy']:>9.2%} {row['cost_ms']:>8.3f}")
+
+    eligible = [row for row in report if row["agreement"] >= args.min_agreement]
+    chosen = max(eligible, key=lambda row: row["low"]) if eligible else {"low": 0.0, "high": 1.0}
+    if not eligible:
+        print(f"\nNo band reaches {args.min_agreement:.2%} agreement, the student will escalate everything")
+    else:
+        print(f"\nServing band {chosen['low']:.2f}-{chosen['high']:.2f}: "
+              f"{chosen['offload_rate']:.1%} offloaded at {chosen['agreement']:.2%} agreement")
+
+    StudentModel(pipeline, chosen["low"], chosen["high"], JAILBREAK_LABEL, negative_label, report).save(args.output)
+    print(f"Saved student to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
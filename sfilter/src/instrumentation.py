@@ -0,0 +1,159 @@
+"""
+Hot-path instrumentation for sfilter.
+
+Declares the sfilter metrics (request latency, per-stage latency of the
+classifier, batch sizes, real vs padding tokens, student decisions,
+verdicts and cache outcomes) on a lock-free MetricsRegistry served by /metrics, and an opt-in
+SamplingProfiler.
+
+The profiler is off unless SFILTER_PROFILE_SAMPLE_RATE is above 0. For that
+fraction of classifier calls a background thread samples the Python stack
+of the calling thread every SFILTER_PROFILE_INTERVAL_MS and accumulates
+them as folded stacks ("outer;inner;leaf count"). They are written to
+SFILTER_PROFILE_DIR/stacks-<pid>.folded, which flamegraph.pl, speedscope
+and inferno read directly.
+"""
+
+import atexit
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from metrics import MetricsRegistry
+
+registry = MetricsRegistry(os.getenv("METRICS_DIR"), prefix="sfilter")
+REQUESTS_TOTAL = registry.counter("sfilter_requests_total", "Total number of requests")
+REQUEST_LATENCY = registry.histogram(
+    "sfilter_request_duration_seconds", "End-to-end latency of classification requests",
+    ("route",), [("/",), ("/batch",)])
+STAGE_LATENCY = registry.histogram(
+    "sfilter_stage_duration_seconds", "Latency of each classifier stage per forward batch",
+    ("stage",), [("tokenize",), ("forward",), ("softmax",), ("student",)])
+TOKENIZE_LATENCY = STAGE_LATENCY.labels("tokenize")
+FORWARD_LATENCY = STAGE_LATENCY.labels("forward")
+SOFTMAX_LATENCY = STAGE_LATENCY.labels("softmax")
+STUDENT_LATENCY = STAGE_LATENCY.labels("student")
+STUDENT_DECISIONS = registry.counter(
+    "sfilter_student_decisions_total", "Messages answered by the distilled student, or escalated to the transformer",
+    ("outcome",), [("ok",), ("jailbreak",), ("escalated",)])
+BATCH_SIZE = registry.histogram(
+    "sfilter_batch_size", "Messages per forward batch",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+TOKENS = registry.counter(
+    "sfilter_tokens_total", "Tokens sent to the model, real and padding",
+    ("kind",), [("real",), ("padding",)])
+REAL_TOKENS = TOKENS.labels("real")
+PADDING_TOKENS = TOKENS.labels("padding")
+VERDICTS = registry.counter(
+    "sfilter_verdicts_total", "Classified messages by verdict",
+    ("verdict",), [("ok",), ("jailbreak",)])
+CACHE_LOOKUPS = registry.counter(
+    "sfilter_cache_lookups_total", "Shared verdict cache lookups by outcome",
+    ("outcome",), [("hit",), ("miss",)])
+ERRORS = registry.counter("sfilter_errors_total", "Classification errors")
+
+
+def fold_stack(frame) -> str:
+    """Folded-stack line for a frame, outermost call first"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    def __init__(self, sample_rate: float = 0.0, interval_ms: float = 5.0,
+                 output_dir: str = "/tmp/sfilter-profiles", flush_interval: float = 10.0):
+        self.sample_rate = sample_rate
+        self.interval = interval_ms / 1000.0
+        self.output_dir = output_dir
+        self.flush_interval = flush_interval
+        self.stacks: Counter = Counter()
+        self._active: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._sampler_pid: Optional[int] = None
+        self._last_flush = time.monotonic()
+        if sample_rate > 0:
+            atexit.register(self.flush)
+
+    @classmethod
+    def from_env(cls) -> "SamplingProfiler":
+        return cls(sample_rate=float(os.getenv("SFILTER_PROFILE_SAMPLE_RATE", "0")),
+                   interval_ms=float(os.getenv("SFILTER_PROFILE_INTERVAL_MS", "5")),
+                   output_dir=os.getenv("SFILTER_PROFILE_DIR", "/tmp/sfilter-profiles"))
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.output_dir, f"stacks-{os.getpid()}.folded")
+
+    def _ensure_sampler(self) -> None:
+        # Threads don't survive a fork, so gunicorn workers start their own
+        if self._sampler is not None and self._sampler.is_alive() and self._sampler_pid == os.getpid():
+            return
+        with self._lock:
+            if self._sampler is None or not self._sampler.is_alive() or self._sampler_pid != os.getpid():
+                if self._sampler_pid != os.getpid():
+                    self._active = {}
+                    self.stacks = Counter()
+                self._sampler = threading.Thread(target=self._run, name="sfilter-profiler", daemon=True)
+                self._sampler_pid = os.getpid()
+                self._sampler.start()
+
+    @contextmanager
+    def profile(self) -> Iterator[bool]:
+        """Samples the calling thread for the duration of the block, for sample_rate of the calls"""
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            yield False
+            return
+        self._ensure_sampler()
+        ident = threading.get_ident()
+        with self._lock:
+            self._active[ident] = self._active.get(ident, 0) + 1
+            self._wakeup.set()
+        try:
+            yield True
+        finally:
+            with self._lock:
+                self._active[ident] -= 1
+                if not self._active[ident]:
+                    del self._active[ident]
+                if not self._active:
+                    self._wakeup.clear()
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait()
+            time.sleep(self.interval)
+            with self._lock:
+                idents = list(self._active)
+            frames = sys._current_frames()
+            samples = [fold_stack(frames[ident]) for ident in idents if ident in frames]
+            with self._lock:
+                self.stacks.update(samples)
+
+    def flush(self) -> None:
+        """Rewrites this process's folded-stack file with everything sampled so far"""
+        self._last_flush = time.monotonic()
+        with self._lock:
+            stacks = sorted(self.stacks.items())
+        if not stacks:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = self.path
+        with open(f"{path}.tmp", "w") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in stacks)
+        os.replace(f"{path}.tmp", path)
+
+
+profiler = SamplingProfiler.from_env()
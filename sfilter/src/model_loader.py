@@ -0,0 +1,66 @@
+"""
+Builds the sfilter classifier: the inference backend, the length-aware
+SequenceClassifier around it and, when a student artifact is given, the
+StudentCascade in front of it.
+
+server.py builds what it serves with load_classifier, and offline tools
+(bulk_score.py at the repository root) call it with the same settings, so
+they score messages exactly as the service does without importing
+server.py, which loads the model and starts serving on import.
+"""
+
+import hashlib
+import json
+import os
+from typing import Any, Optional, Sequence, Tuple
+
+import torch
+
+from backends import load_backend
+from classifier import DEFAULT_LENGTH_BUCKETS, SequenceClassifier
+from student import StudentCascade, StudentModel
+
+
+def load_classifier(model_name: str, backend_name: str = "torch", device: Optional[torch.device] = None,
+                    onnx_path: Optional[str] = None, ort_threads: Optional[int] = None, max_length: int = 512,
+                    length_buckets: Optional[Sequence[int]] = DEFAULT_LENGTH_BUCKETS, truncation: str = "head",
+                    head_tokens: int = 128, student_path: Optional[str] = None, student_low: Optional[float] = None,
+                    student_high: Optional[float] = None) -> Tuple[Any, SequenceClassifier, Any]:
+    """
+    The backend, the transformer classifier, and the classifier to call:
+    the transformer itself, or the student cascade when student_path is set.
+    """
+    tokenizer, backend = load_backend(backend_name, model_name, device or torch.device("cpu"),
+                                      onnx_path=onnx_path, ort_threads=ort_threads)
+    # Tokenize / forward / softmax as separately timed stages, top prediction only
+    sequence_classifier = SequenceClassifier(
+        tokenizer,
+        backend,
+        max_length=max_length,
+        length_buckets=length_buckets,
+        truncation=truncation,
+        head_tokens=head_tokens
+    )
+    classifier = sequence_classifier
+    if student_path:
+        classifier = StudentCascade(StudentModel.load(student_path), sequence_classifier,
+                                    low=student_low, high=student_high)
+    return backend, sequence_classifier, classifier
+
+
+def model_version(model_name: str, *paths: Optional[str], **settings: Any) -> str:
+    """
+    Short digest of a model: its name, the settings that change its verdicts,
+    and the size and modification time of every local file it is loaded from.
+    A hub model name has no local files, only a new name or setting changes it.
+    """
+    digest = hashlib.blake2b(json.dumps([model_name, settings], sort_keys=True, default=str).encode(), digest_size=8)
+    for path in filter(None, (model_name, *paths)):
+        if os.path.isfile(path):
+            files = [path]
+        else:
+            files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+        for file in files:
+            stat = os.stat(file)
+            digest.update(f"{file}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
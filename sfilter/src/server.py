@@ -1,75 +1,181 @@
-from flask import Flask, request, render_template_string
+from flask import Flask, g, request, render_template_string
+import gc
 import os
 import requests
 import time
 import logging
 
-from transformers import AutoTokenizer, AutoModelForSequenceClassification, pipeline
+import hashlib
+
+from batcher import MicroBatcher
+import instrumentation
+from shared_cache import PublishedVersion, create_backend, verdict_key
+from structured_logging import configure
+from model_loader import load_classifier, model_version
+
 import torch
 
 app = Flask(__name__)
 app.start_time = time.time()
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# JSON logs written off the request path, see structured_logging.py
+configure("sfilter")
 logger = logging.getLogger(__name__)
 
 SECONDARY_MODEL = os.getenv("SECONDARY_MODEL")
 if not SECONDARY_MODEL:
   raise ValueError("SECONDARY_MODEL environment variable is not set.")
 
+# Micro-batching: concurrent requests are grouped into one forward pass of
+# up to SFILTER_MAX_BATCH_SIZE messages, waiting at most SFILTER_MAX_WAIT_MS
+SFILTER_MAX_BATCH_SIZE = int(os.getenv("SFILTER_MAX_BATCH_SIZE", "16"))
+SFILTER_MAX_WAIT_MS = float(os.getenv("SFILTER_MAX_WAIT_MS", "10"))
+SFILTER_REQUEST_TIMEOUT = float(os.getenv("SFILTER_REQUEST_TIMEOUT", "30"))
+
+# Inference backend: torch (fp32), torch-int8 (dynamic quantization) or onnx
+# (ONNX Runtime with SFILTER_ORT_THREADS intra-op threads)
+SFILTER_BACKEND = os.getenv("SFILTER_BACKEND", "torch").lower()
+SFILTER_ONNX_PATH = os.getenv("SFILTER_ONNX_PATH")
+SFILTER_ORT_THREADS = int(os.getenv("SFILTER_ORT_THREADS", "0")) or None
+
+# Length-aware inputs: messages are padded per length bucket rather than to
+# the longest message of the batch, and longer than SFILTER_MAX_LENGTH tokens
+# are cut to their head or, with SFILTER_TRUNCATION=head_tail, to
+# SFILTER_HEAD_TOKENS from the start plus the rest of the budget from the end
+SFILTER_MAX_LENGTH = int(os.getenv("SFILTER_MAX_LENGTH", "512"))
+SFILTER_LENGTH_BUCKETS = [int(b) for b in os.getenv("SFILTER_LENGTH_BUCKETS", "16,32,64,128,256,512").split(",") if b.strip()]
+SFILTER_TRUNCATION = os.getenv("SFILTER_TRUNCATION", "head").lower()
+SFILTER_HEAD_TOKENS = int(os.getenv("SFILTER_HEAD_TOKENS", "128"))
+
+# Distilled student (see distill.py) answering confident messages before the
+# transformer, disabled unless SFILTER_STUDENT_PATH is set. The thresholds
+# default to the ones stored in the artifact.
+SFILTER_STUDENT_PATH = os.getenv("SFILTER_STUDENT_PATH")
+SFILTER_STUDENT_LOW = float(os.getenv("SFILTER_STUDENT_LOW")) if os.getenv("SFILTER_STUDENT_LOW") else None
+SFILTER_STUDENT_HIGH = float(os.getenv("SFILTER_STUDENT_HIGH")) if os.getenv("SFILTER_STUDENT_HIGH") else None
+
+# Warm start. With SFILTER_PRELOAD the Dockerfile runs gunicorn --preload: the
+# model is loaded and warmed once in the master and the WEB_CONCURRENCY forked
+# workers share its weights copy-on-write instead of each loading a copy.
+# Warm-up runs a dummy batch of each SFILTER_WARMUP_BATCH_SIZES per length
+# bucket. Both run at import, before gunicorn serves, so a worker is only ever
+# up with a warm model.
+SFILTER_PRELOAD = os.getenv("SFILTER_PRELOAD", "false").lower() == "true"
+SFILTER_WARMUP_BATCH_SIZES = [int(b) for b in os.getenv("SFILTER_WARMUP_BATCH_SIZES", f"1,{SFILTER_MAX_BATCH_SIZE}").split(",") if b.strip()]
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# Intra-op threads per worker, by default the cores split between the workers
+SFILTER_TORCH_THREADS = int(os.getenv("SFILTER_TORCH_THREADS", "0")) or max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY)
+if SFILTER_PRELOAD:
+  # The tokenizer's thread pool doesn't survive the fork either
+  os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+# Verdict cache shared with bfilter and other sfilter instances, disabled
+# unless SHARED_CACHE_URL is set. Verdicts are keyed by the model version,
+# SFILTER_MODEL_VERSION or else a digest of the model files and settings,
+# which is published for bfilter to key its lookups by
+shared_cache = create_backend(os.getenv("SHARED_CACHE_URL"))
+SHARED_CACHE_TTL_SECONDS = float(os.getenv("SHARED_CACHE_TTL_SECONDS", "3600"))
+SFILTER_MODEL_VERSION = os.getenv("SFILTER_MODEL_VERSION")
+published_version = PublishedVersion(shared_cache)
+
 #Log secondary model
-logger.info(f"SECONDARY_MODEL = {SECONDARY_MODEL}")
-logger.info(f"PyTorch version: {torch.__version__}")
-logger.info(f"CUDA available: {torch.cuda.is_available()}")
+logger.info("SECONDARY_MODEL = %s", SECONDARY_MODEL)
+logger.info("PyTorch version: %s", torch.__version__)
+logger.info("CUDA available: %s", torch.cuda.is_available())
 
 # Global variables for model components
 classifier = None
+batcher = None
+backend = None
 model_loaded = False
+warmup_seconds = None
+verdict_version = None
 
 def load_model():
     """Load model with error handling and optimization"""
-    global classifier, model_loaded
+    global classifier, batcher, backend, model_loaded, warmup_seconds, verdict_version
     
     try:
         logger.info("Starting model loading...")
         start_time = time.time()
         
-        # Load model components
-        tokenizer = AutoTokenizer.from_pretrained(SECONDARY_MODEL)
-        model = AutoModelForSequenceClassification.from_pretrained(SECONDARY_MODEL)
-        
-        # Optimize model for inference
-        model.eval()  # Set to evaluation mode
-        if torch.cuda.is_available():
-            model = model.cuda()
-            logger.info("Model moved to CUDA")
-        
-        # Create pipeline with optimizations
-        classifier = pipeline(
-            "text-classification",
-            model=model,
-            tokenizer=tokenizer,
-            truncation=True,
-            max_length=512,  # Reduced from 8192 for faster processing
-            device=torch.device("cuda" if torch.cuda.is_available() else "cpu"),
-            batch_size=1,
-            return_all_scores=False  # Only return top prediction
+        # Load model components for the selected backend
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        if SFILTER_PRELOAD:
+            if device.type == "cuda":
+                raise ValueError("SFILTER_PRELOAD is CPU only, a CUDA context can't be shared with forked workers")
+            if SFILTER_BACKEND == "onnx" and WEB_CONCURRENCY > 1:
+                logger.warning("The onnx backend keeps a private copy of the model per worker, "
+                               "prefer WEB_CONCURRENCY=1 and more request threads")
+            # OpenMP threads started in the master would leave the workers' thread pool
+            # broken, so the master stays single threaded and workers resize after the fork
+            torch.set_num_threads(1)
+        backend, sequence_classifier, classifier = load_classifier(
+            SECONDARY_MODEL,
+            SFILTER_BACKEND,
+            device,
+            onnx_path=SFILTER_ONNX_PATH,
+            ort_threads=SFILTER_ORT_THREADS,
+            max_length=SFILTER_MAX_LENGTH,  # Reduced from 8192 for faster processing
+            length_buckets=SFILTER_LENGTH_BUCKETS,
+            truncation=SFILTER_TRUNCATION,
+            head_tokens=SFILTER_HEAD_TOKENS,
+            student_path=SFILTER_STUDENT_PATH,
+            student_low=SFILTER_STUDENT_LOW,
+            student_high=SFILTER_STUDENT_HIGH
+        )
+        logger.info("Inference backend: %s", SFILTER_BACKEND)
+        if SFILTER_STUDENT_PATH:
+            logger.info("Student stage enabled: %s (low=%.3f, high=%.3f)",
+                        SFILTER_STUDENT_PATH, classifier.low, classifier.high)
+        verdict_version = SFILTER_MODEL_VERSION or model_version(
+            SECONDARY_MODEL,
+            SFILTER_ONNX_PATH,
+            SFILTER_STUDENT_PATH,
+            backend=SFILTER_BACKEND,
+            max_length=SFILTER_MAX_LENGTH,
+            truncation=SFILTER_TRUNCATION,
+            head_tokens=SFILTER_HEAD_TOKENS,
+            student=[classifier.low, classifier.high] if SFILTER_STUDENT_PATH else None
+        )
+        logger.info("Verdict cache model version: %s", verdict_version)
+        batcher = MicroBatcher(
+            lambda messages: classifier(messages, batch_size=len(messages)),
+            max_batch_size=SFILTER_MAX_BATCH_SIZE,
+            max_wait_ms=SFILTER_MAX_WAIT_MS
         )
         
         model_loaded = True
         load_time = time.time() - start_time
-        logger.info(f"SFilter model loaded successfully in {load_time:.2f}s")
+        logger.info("SFilter model loaded successfully in %.2fs", load_time)
         
         # Test the model with a simple input
         test_result = classifier("test message")
-        logger.info(f"Model test successful: {test_result}")
+        logger.info("Model test successful: %s", test_result)
+        
+        # The transformer itself, the student would answer the dummy batches
+        warmup_seconds = sequence_classifier.warm_up(SFILTER_WARMUP_BATCH_SIZES)
+        logger.info("Model warmed up in %.2fs (batch sizes %s)", warmup_seconds, SFILTER_WARMUP_BATCH_SIZES)
+        if SFILTER_PRELOAD:
+            # Objects surviving to here are never collected, moving them out of the
+            # collector's reach keeps GC passes from dirtying the shared pages
+            gc.collect()
+            gc.freeze()
         
     except Exception as e:
-        logger.error(f"Error during model loading: {e}")
+        logger.error("Error during model loading: %s", e)
         model_loaded = False
         raise Exception(f"Error during startup: {e}, Secondary Model: {SECONDARY_MODEL}")
 
+def after_fork():
+    """Runs in each forked worker before it serves, see SFILTER_PRELOAD"""
+    if backend is not None:
+        backend.after_fork()
+    torch.set_num_threads(SFILTER_TORCH_THREADS)
+
+if SFILTER_PRELOAD:
+    os.register_at_fork(after_in_child=after_fork)
+
 # Load model on startup
 load_model()
 
@@ -87,10 +193,12 @@ def health_check():
             "status": "healthy", 
             "timestamp": time.time(), 
             "model": SECONDARY_MODEL,
+            "backend": SFILTER_BACKEND,
+            "student": SFILTER_STUDENT_PATH is not None,
             "cuda_available": torch.cuda.is_available()
         }, 200
     except Exception as e:
-        logger.error(f"Health check failed: {e}")
+        logger.error("Health check failed: %s", e)
         return {"status": "unhealthy", "error": str(e)}, 503
 
 @app.route("/ready", methods=["GET"])
@@ -98,42 +206,139 @@ def readiness_check():
     """Readiness check"""
     if not model_loaded or classifier is None:
         return {"status": "not_ready", "error": "Model not loaded"}, 503
-    return {"status": "ready", "timestamp": time.time()}, 200
+    return {"status": "ready", "timestamp": time.time(), "warmup_seconds": warmup_seconds}, 200
 
 
 
 @app.route("/", methods=["POST"])
 def main():
     """Main classification endpoint with performance tracking"""
-    start_time = time.time()
+    start_time = time.perf_counter()
     
     userMessage = request.form.get('message', '')
     
-    if not model_loaded or classifier is None:
+    if not model_loaded or batcher is None:
         logger.error("Model not loaded")
         return "Service temporarily unavailable", 503
     
     if not userMessage.strip():
         return "ok", 200
     
+    published_version.publish(verdict_version, SHARED_CACHE_TTL_SECONDS)
+    message_key = verdict_key(hashlib.md5(userMessage.encode()).hexdigest(), verdict_version)
+    cached_verdict = shared_cache.get(message_key)
+    instrumentation.CACHE_LOOKUPS.labels("miss" if cached_verdict is None else "hit").inc()
+    if cached_verdict == b"jailbreak":
+        logger.info("Jailbreak detected: shared verdict cache hit")
+        return "I don't understand your message, can you say it another way? (secondary)", 401
+    if cached_verdict == b"ok":
+        return "ok", 200
+    
     try:
-        # Perform classification
-        classification = classifier(userMessage)
+        # Perform classification, batched with any other in-flight requests
+        classification = batcher.classify(userMessage, timeout=SFILTER_REQUEST_TIMEOUT)
+        
+        processing_time = time.perf_counter() - start_time
+        logger.debug("Classification took %.3fs for message length %d", processing_time, len(userMessage))
         
-        # Log processing time
-        processing_time = time.time() - start_time
-        logger.info(f"Classification took {processing_time:.3f}s for message length {len(userMessage)}")
+        is_jailbreak = classification['label'] == 'jailbreak'
+        shared_cache.set(message_key, b"jailbreak" if is_jailbreak else b"ok", SHARED_CACHE_TTL_SECONDS)
         
-        if classification[0]['label'] == 'jailbreak':
-            logger.info(f"Jailbreak detected: confidence={classification[0]['score']:.3f}")
+        if is_jailbreak:
+            instrumentation.VERDICTS.labels("jailbreak").inc()
+            logger.info("Jailbreak detected: confidence=%.3f", classification['score'])
             return "I don't understand your message, can you say it another way? (secondary)", 401
         
-        logger.debug(f"Message passed: confidence={classification[0]['score']:.3f}")
+        instrumentation.VERDICTS.labels("ok").inc()
+        logger.debug("Message passed: confidence=%.3f", classification['score'])
         return "ok", 200
         
     except Exception as e:
-        logger.error(f"Classification error: {e}")
+        instrumentation.ERRORS.inc()
+        logger.error("Classification error: %s", e)
         return "Classification service error", 500
-            
+
+
+@app.route("/batch", methods=["POST"])
+def batch():
+    """Classifies a JSON batch {"messages": [...]} with one batched classifier call"""
+    start_time = time.perf_counter()
+
+    payload = request.get_json(silent=True) or {}
+    messages = payload.get("messages")
+    if not isinstance(messages, list) or not all(isinstance(m, str) for m in messages):
+        return {"error": "messages must be a list of strings"}, 400
+
+    if not model_loaded or batcher is None:
+        logger.error("Model not loaded")
+        return {"error": "Service temporarily unavailable"}, 503
+
+    results = [{"label": "empty", "score": 0.0, "jailbreak": False} for _ in messages]
+    published_version.publish(verdict_version, SHARED_CACHE_TTL_SECONDS)
+    verdict_keys = [verdict_key(hashlib.md5(m.encode()).hexdigest(), verdict_version) for m in messages]
+    pending = []
+    for i, message in enumerate(messages):
+        if not message.strip():
+            continue
+        cached_verdict = shared_cache.get(verdict_keys[i])
+        instrumentation.CACHE_LOOKUPS.labels("miss" if cached_verdict is None else "hit").inc()
+        if cached_verdict is None:
+            pending.append(i)
+        else:
+            is_jailbreak = cached_verdict == b"jailbreak"
+            results[i] = {"label": "cached", "score": None, "jailbreak": is_jailbreak}
+
+    try:
+        if pending:
+            # Through the micro-batcher like single messages, so a large request is
+            # split into SFILTER_MAX_BATCH_SIZE passes and never runs beside another
+            classifications = batcher.classify_many([messages[i] for i in pending], timeout=SFILTER_REQUEST_TIMEOUT)
+            for i, classification in zip(pending, classifications):
+                is_jailbreak = classification['label'] == 'jailbreak'
+                shared_cache.set(verdict_keys[i], b"jailbreak" if is_jailbreak else b"ok", SHARED_CACHE_TTL_SECONDS)
+                instrumentation.VERDICTS.labels("jailbreak" if is_jailbreak else "ok").inc()
+                results[i] = {
+                    "label": classification['label'],
+                    "score": classification['score'],
+                    "jailbreak": is_jailbreak
+                }
+
+        processing_time = time.perf_counter() - start_time
+        logger.debug("Batch classification took %.3fs for %d messages", processing_time, len(pending))
+        return {"results": results}, 200
+
+    except Exception as e:
+        instrumentation.ERRORS.inc()
+        logger.error("Batch classification error: %s", e)
+        return {"error": "Classification service error"}, 500
+
+
+@app.before_request
+def before_request() -> None:
+    g.request_start_time = time.perf_counter()
+    instrumentation.REQUESTS_TOTAL.inc()
+
+
+@app.after_request
+def after_request(response):
+    if request.method == "POST" and request.path in ("/", "/batch"):
+        instrumentation.REQUEST_LATENCY.labels(request.path).observe(time.perf_counter() - g.request_start_time)
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus-compatible metrics endpoint, summed across gunicorn workers"""
+    uptime = time.time() - app.start_time
+    metrics_output = instrumentation.registry.render() + f"""
+# HELP sfilter_uptime_seconds Service uptime in seconds
+# TYPE sfilter_uptime_seconds gauge
+sfilter_uptime_seconds {uptime:.2f}
+# HELP sfilter_warmup_seconds Time spent warming the model up before becoming ready
+# TYPE sfilter_warmup_seconds gauge
+sfilter_warmup_seconds {warmup_seconds or 0:.3f}
+"""
+    return metrics_output, 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
 if __name__ == "__main__":
     app.run(debug=True, port=8082, host='0.0.0.0')
\ No newline at end of file
@@ -0,0 +1,88 @@
+"""
+Distilled student classifier served in front of the sfilter transformer.
+
+The student is a char n-gram TF-IDF + logistic regression model trained by
+distill.py on the transformer's own labels. StudentCascade answers a
+message itself when the student's jailbreak probability is at or below
+`low` or at or above `high`, and escalates only the uncertain rest to the
+transformer. It has the same call signature as SequenceClassifier, so the
+micro-batcher and /batch use it unchanged.
+
+SFILTER_STUDENT_PATH enables it; the thresholds picked by distill.py are
+stored in the artifact and can be overridden with SFILTER_STUDENT_LOW /
+SFILTER_STUDENT_HIGH.
+"""
+
+import time
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import joblib
+import numpy as np
+
+import instrumentation
+
+
+class StudentModel:
+    def __init__(self, pipeline: Any, low: float, high: float, positive_label: str, negative_label: str,
+                 report: Optional[List[Dict[str, float]]] = None):
+        self.pipeline = pipeline
+        self.low = low
+        self.high = high
+        self.positive_label = positive_label
+        self.negative_label = negative_label
+        self.report = report or []
+
+    @classmethod
+    def load(cls, path: str) -> "StudentModel":
+        artifact = joblib.load(path)
+        return cls(artifact["pipeline"], artifact["low"], artifact["high"], artifact["positive_label"],
+                   artifact["negative_label"], artifact.get("report"))
+
+    def save(self, path: str) -> None:
+        joblib.dump({
+            "pipeline": self.pipeline,
+            "low": self.low,
+            "high": self.high,
+            "positive_label": self.positive_label,
+            "negative_label": self.negative_label,
+            "report": self.report,
+        }, path)
+
+    def jailbreak_proba(self, texts: Sequence[str]) -> np.ndarray:
+        return self.pipeline.predict_proba(list(texts))[:, 1]
+
+
+class StudentCascade:
+    def __init__(self, student: StudentModel, classifier: Any, low: Optional[float] = None,
+                 high: Optional[float] = None):
+        self.student = student
+        self.classifier = classifier
+        self.low = student.low if low is None else low
+        self.high = student.high if high is None else high
+
+    def __call__(self, texts: Union[str, Sequence[str]], batch_size: int = None) -> List[Dict[str, Any]]:
+        if isinstance(texts, str):
+            texts = [texts]
+        if not texts:
+            return []
+        start = time.perf_counter()
+        probs = self.student.jailbreak_proba(texts)
+        instrumentation.STUDENT_LATENCY.observe(time.perf_counter() - start)
+
+        results: List[Optional[Dict[str, Any]]] = [None] * len(texts)
+        escalated = []
+        for i, prob in enumerate(probs.tolist()):
+            if prob >= self.high:
+                results[i] = {"label": self.student.positive_label, "score": prob, "stage": "student"}
+                instrumentation.STUDENT_DECISIONS.labels("jailbreak").inc()
+            elif prob <= self.low:
+                results[i] = {"label": self.student.negative_label, "score": 1.0 - prob, "stage": "student"}
+                instrumentation.STUDENT_DECISIONS.labels("ok").inc()
+            else:
+                escalated.append(i)
+        if escalated:
+            instrumentation.STUDENT_DECISIONS.labels("escalated").inc(len(escalated))
+            transformer_results = self.classifier([texts[i] for i in escalated], batch_size=batch_size)
+            for i, result in zip(escalated, transformer_results):
+                results[i] = result
+        return results
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Modules shared between the services.
+
+Each service is built from its own Docker context (bfilter/, sfilter/,
+llmstub/), so a module used by several of them is copied into each one's
+src/. The copy in bfilter/src is the one to edit; sync copies it over the
+others, and check fails when any copy differs from it. setup.sh runs check
+before planning or deploying.
+
+    python3 shared_modules.py check
+    python3 shared_modules.py sync
+"""
+
+import argparse
+import filecmp
+import os
+import shutil
+import sys
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SOURCE = "bfilter"
+# Module -> the other services that carry a copy of it
+SHARED: Dict[str, Tuple[str, ...]] = {
+    "structured_logging.py": ("sfilter", "llmstub"),
+    "shared_cache.py": ("sfilter",),
+    "metrics.py": ("sfilter",),
+}
+
+
+def copies() -> List[Tuple[str, str]]:
+    """(source, copy) paths of every shared module"""
+    return [(os.path.join(ROOT, SOURCE, "src", module), os.path.join(ROOT, service, "src", module))
+            for module, services in SHARED.items() for service in services]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check or sync the modules shared between services")
+    parser.add_argument("command", choices=["check", "sync"])
+    args = parser.parse_args()
+
+    stale = [(source, copy) for source, copy in copies()
+             if not os.path.exists(copy) or not filecmp.cmp(source, copy, shallow=False)]
+    if args.command == "sync":
+        for source, copy in stale:
+            shutil.copyfile(source, copy)
+            print(f"Updated {os.path.relpath(copy, ROOT)}")
+        return
+    for source, copy in stale:
+        print(f"{os.path.relpath(copy, ROOT)} differs from {os.path.relpath(source, ROOT)}", file=sys.stderr)
+    if stale:
+        print("Run: python3 shared_modules.py sync", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()